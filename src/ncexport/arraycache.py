@@ -0,0 +1,175 @@
+"""On-disk cache of decoded variables, stored as uncompressed .npy files that are
+memory mapped when reused, so that exporting the same data again with different
+settings does not decode the netCDF file again."""
+
+import hashlib
+import os
+import pathlib
+import threading
+from typing import Any, Iterable, Iterator, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+from .options import CACHE_DIR_ENV, DEFAULT_CACHE_BYTES
+
+
+class ArrayCache(NamedTuple):
+    """Location and size cap of the cache."""
+
+    directory: pathlib.Path
+    """directory holding the cached .npy files"""
+    max_bytes: int = DEFAULT_CACHE_BYTES
+    """total size of the cached files that is kept after adding an array"""
+
+
+def get_default_cache_dir() -> pathlib.Path:
+    """NCEXPORT_CACHE_DIR if set, otherwise ncexport in the user cache directory"""
+    if CACHE_DIR_ENV in os.environ:
+        return pathlib.Path(os.environ[CACHE_DIR_ENV]).expanduser()
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "ncexport"
+
+
+def get_cache_key(nc_file: pathlib.Path, variable: str, selection: str) -> str:
+    """
+    Identify a decoded array by the identity of its source file (path, size and
+    modification time), the variable and the part of the variable that was read.
+    Modifying the file changes the key, so stale arrays are never used and are
+    eventually evicted.
+
+    :param nc_file: netCDF4 file the array is read from
+    :param variable: the variable the array is read from
+    :param selection: which part of the variable was read, e.g. the timestep
+    :returns: hexadecimal key, used as the filename of the cached array
+    """
+    stat = nc_file.stat()
+    identity = "|".join(
+        [
+            str(nc_file.resolve()),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+            variable,
+            selection,
+        ]
+    )
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def get_array_path(cache: ArrayCache, key: str) -> pathlib.Path:
+    """filepath of the cached array with the given key"""
+    return cache.directory / f"{key}.npy"
+
+
+def get_temp_path(path: pathlib.Path) -> pathlib.Path:
+    """filepath an array is written to before it is moved to path, unique to the
+    process and thread, since the server fills the cache from several threads"""
+    return path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def load_array(cache: ArrayCache, key: str) -> np.memmap[Any, np.dtype[Any]] | None:
+    """
+    Open a cached array as a read-only memory map and mark it as recently used.
+
+    :param cache: the cache to look in
+    :param key: key of the array, from get_cache_key
+    :returns: the array, or None if it is not cached
+    """
+    path = get_array_path(cache, key)
+    try:
+        array = np.load(path, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    # The modification time records when each array was last used, access times
+    # are not reliable since many filesystems are mounted with noatime
+    os.utime(path)
+    # Also applies a cap that was lowered since the arrays were stored
+    evict(cache)
+    return array
+
+
+def evict(cache: ArrayCache) -> int:
+    """
+    Delete the least recently used arrays until the cache fits within its cap.
+
+    :param cache: the cache to trim
+    :returns: number of arrays deleted
+    """
+    entries = []
+    for path in cache.directory.glob("*.npy"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, path in entries:
+        if total <= cache.max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+def store_slabs(
+    cache: ArrayCache,
+    key: str,
+    slabs: Iterable[tuple[int, npt.NDArray[Any]]],
+    shape: tuple[int, int, int],
+    dtype: np.dtype[Any],
+) -> Iterator[tuple[int, npt.NDArray[Any]]]:
+    """
+    Pass hyperslabs through unchanged while copying them into a new cached array.
+    The array is written to a temporary file, in Fortran order so that each
+    hyperslab along z is contiguous, and only added to the cache once every slab
+    has been seen. Arrays larger than the cache cap are not stored.
+
+    :param cache: the cache to add the array to
+    :param key: key of the array, from get_cache_key
+    :param slabs: (z offset, data in xyz order) pairs covering the whole array
+    :param shape: (x, y, z) shape of the whole array
+    :param dtype: numpy type of the array
+    :returns: generator of the same (z offset, data) pairs
+    """
+    if int(np.prod(shape)) * dtype.itemsize > cache.max_bytes:
+        yield from slabs
+        return
+    cache.directory.mkdir(parents=True, exist_ok=True)
+    path = get_array_path(cache, key)
+    tmp_path = get_temp_path(path)
+    array = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=dtype, shape=shape, fortran_order=True
+    )
+    try:
+        for z0, slab in slabs:
+            array[:, :, z0 : z0 + slab.shape[2]] = slab
+            yield z0, slab
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+    finally:
+        # Left behind if reading failed or the caller stopped early
+        tmp_path.unlink(missing_ok=True)
+    evict(cache)
+
+
+def store_array(cache: ArrayCache, key: str, array: npt.NDArray[Any]) -> None:
+    """
+    Add an array that is already in memory to the cache, unless it is larger than
+    the cache cap.
+
+    :param cache: the cache to add the array to
+    :param key: key of the array, from get_cache_key
+    :param array: the array to store
+    """
+    if array.nbytes > cache.max_bytes:
+        return
+    cache.directory.mkdir(parents=True, exist_ok=True)
+    path = get_array_path(cache, key)
+    tmp_path = get_temp_path(path)
+    with open(tmp_path, "wb") as fh:
+        np.save(fh, array)
+    os.replace(tmp_path, path)
+    evict(cache)
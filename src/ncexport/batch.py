@@ -0,0 +1,246 @@
+"""Batch conversion of many netCDF files, skipping inputs that are unchanged since
+the last run according to a manifest stored next to the outputs."""
+
+import concurrent.futures
+import glob
+import hashlib
+import importlib.metadata
+import json
+import os
+import pathlib
+from typing import Any, Final, Iterable, NamedTuple
+
+from . import convert, radiance
+from .options import MANIFEST_NAME, OUTPUT_EXTENSIONS
+
+HASH_CHUNK_BYTES: Final = 16 * 2**20
+"""Size of the blocks read when hashing input files."""
+
+
+class Job(NamedTuple):
+    """A single conversion of one input file to one kind of output."""
+
+    inpath: pathlib.Path
+    kind: str
+    outpath: pathlib.Path
+    variable: str
+    bits: int
+
+    @property
+    def key(self) -> str:
+        """manifest key, identifies the conversion independently of input content"""
+        return f"{self.inpath}|{self.kind}|{self.variable}|{self.bits}"
+
+
+def get_job(
+    inpath: pathlib.Path,
+    kind: str,
+    outdir: pathlib.Path | None,
+    variable: str,
+    rad_variable: str,
+    quantization_bits: int,
+) -> Job:
+    """the conversion of an input to one kind of output, see run_batch"""
+    return Job(
+        inpath,
+        kind,
+        (outdir or inpath.parent) / (inpath.stem + OUTPUT_EXTENSIONS[kind]),
+        rad_variable if kind == "png" else variable,
+        quantization_bits if kind == "nrrd" else 32,
+    )
+
+
+def get_tool_version() -> str:
+    """version of the installed ncexport package, part of every manifest entry"""
+    try:
+        return importlib.metadata.version("ncexport")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def find_inputs(patterns: Iterable[str]) -> list[pathlib.Path]:
+    """
+    Expand directories and glob patterns into a sorted list of netCDF files.
+    Directories are searched (non-recursively) for files with a .nc extension.
+
+    :param patterns: directories, files or glob patterns
+    :returns: list of resolved paths to netCDF files, without duplicates
+    """
+    found: set[pathlib.Path] = set()
+    for pattern in patterns:
+        path = pathlib.Path(pattern).expanduser()
+        if path.is_dir():
+            matches = [str(p) for p in path.iterdir()]
+        else:
+            matches = glob.glob(str(path))
+        for match in matches:
+            match_path = pathlib.Path(match)
+            if match_path.is_file() and match_path.suffix.lower() == ".nc":
+                found.add(match_path.resolve())
+    return sorted(found)
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """sha256 digest of a file, read in blocks to bound memory use"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while block := fh.read(HASH_CHUNK_BYTES):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: pathlib.Path) -> dict[str, dict[str, Any]]:
+    """reads the manifest, an empty manifest is returned if it does not exist yet"""
+    try:
+        with open(manifest_path, "r") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(
+    manifest_path: pathlib.Path, manifest: dict[str, dict[str, Any]]
+) -> None:
+    """writes the manifest through a temporary file so it is never left truncated"""
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def run_job(job: Job) -> str:
+    """
+    Hash the input file then run the conversion described by the job. Runs in a
+    worker process.
+
+    :param job: the conversion to perform
+    :returns: sha256 digest of the input file
+    """
+    digest = hash_file(job.inpath)
+    if job.kind == "nrrd":
+        convert.convert_nc_nrrd(job.inpath, job.outpath, job.variable, job.bits)
+    elif job.kind == "png":
+        radiance.export_radiance_image(job.inpath, job.outpath, job.variable)
+    else:
+        respath = job.outpath.with_suffix(".bin")
+        convert.convert_nc_gltf(job.inpath, job.outpath, respath, job.variable)
+    return digest
+
+
+def get_manifest_entry(
+    job: Job, digest: str, version: str, stat: os.stat_result
+) -> dict[str, Any]:
+    """manifest entry of a completed job, stat is that of the input it converted"""
+    return {
+        "output": str(job.outpath),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": digest,
+        "version": version,
+    }
+
+
+def is_up_to_date(
+    job: Job,
+    entry: dict[str, Any] | None,
+    version: str,
+    digests: dict[pathlib.Path, str],
+) -> bool:
+    """
+    Decide whether the output of a job from a previous run can be reused. The size
+    and modification time of the input are compared first, and the input is only
+    hashed if they differ, so touching a file does not force a new conversion.
+
+    :param job: the conversion to check
+    :param entry: manifest entry recorded for the job, if any
+    :param version: version of the running tool
+    :param digests: cache of input hashes computed during this run, updated in place
+    :returns: True if the conversion can be skipped
+    """
+    if entry is None or entry.get("version") != version:
+        return False
+    if not job.outpath.is_file():
+        return False
+    stat = job.inpath.stat()
+    if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        return True
+    if entry.get("size") != stat.st_size:
+        return False
+    if job.inpath not in digests:
+        digests[job.inpath] = hash_file(job.inpath)
+    if digests[job.inpath] != entry.get("sha256"):
+        return False
+    entry["mtime"] = stat.st_mtime
+    return True
+
+
+def run_batch(
+    inpaths: Iterable[pathlib.Path],
+    kinds: Iterable[str],
+    outdir: pathlib.Path | None = None,
+    variable: str = "QC",
+    rad_variable: str = "rad",
+    quantization_bits: int = 8,
+    workers: int | None = None,
+    manifest_path: pathlib.Path | None = None,
+    force: bool = False,
+) -> tuple[int, int, int]:
+    """
+    Convert every input file to every requested kind of output in a pool of worker
+    processes. Conversions whose input, variable, bit depth and tool version match
+    the manifest from a previous run, and whose output still exists, are skipped.
+
+    :param inpaths: netCDF files to convert
+    :param kinds: kinds of output to create, keys of OUTPUT_EXTENSIONS
+    :param outdir: directory for the outputs, defaults to the directory of each input
+    :param variable: variable exported to glb, gltf and nrrd outputs
+    :param rad_variable: variable exported to png outputs
+    :param quantization_bits: 8 or 16 to quantize nrrd outputs, otherwise float
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param manifest_path: manifest location, defaults to MANIFEST_NAME in outdir
+    :param force: convert every input even if it is up to date
+    :returns: number of conversions performed, skipped and failed
+    """
+    inpaths = list(inpaths)
+    if manifest_path is None:
+        manifest_dir = outdir or (inpaths[0].parent if inpaths else pathlib.Path())
+        manifest_path = manifest_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    version = get_tool_version()
+    digests: dict[pathlib.Path, str] = {}
+
+    jobs: list[Job] = []
+    skipped = 0
+    for inpath in inpaths:
+        for kind in kinds:
+            job = get_job(
+                inpath, kind, outdir, variable, rad_variable, quantization_bits
+            )
+            if not force and is_up_to_date(
+                job, manifest.get(job.key), version, digests
+            ):
+                skipped += 1
+            else:
+                jobs.append(job)
+    print(f"{len(jobs)} conversions to run, {skipped} up to date")
+
+    converted = failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                digest = future.result()
+            except Exception as err:
+                print(f"FAILED {job.inpath.name} -> {job.kind}: {err!r}")
+                failed += 1
+                continue
+            manifest[job.key] = get_manifest_entry(
+                job, digest, version, job.inpath.stat()
+            )
+            # Saved after every conversion so that an interrupted batch resumes
+            save_manifest(manifest_path, manifest)
+            converted += 1
+            print(f"done   {job.inpath.name} -> {job.outpath.name}")
+    save_manifest(manifest_path, manifest)
+    return converted, skipped, failed
@@ -0,0 +1,354 @@
+"""Benchmarks of the conversion hot paths on synthetic LES-like netCDF files, so
+that regressions can be caught without shipping the full size datasets. Results
+are written as JSON and can be compared between commits."""
+
+import contextlib
+import io
+import json
+import pathlib
+import platform
+import time
+import tracemalloc
+from typing import Any, Callable, Final, NamedTuple, Sequence
+
+import netCDF4
+import numpy as np
+import numpy.typing as npt
+
+from . import batch, convert, radiance
+from .options import BENCHMARKS, DEFAULT_DIMENSIONS, DEFAULT_SPARSITY, SIZE_TIERS
+
+CLOUD_LAYER: Final = (0.25, 0.6)
+"""Bottom and top of the cloud layer, as fractions of the domain height."""
+
+CLOUD_SCALE: Final = 8
+"""Number of grid cells spanned by one cell of the coarse noise shaping clouds."""
+
+MAX_CLOUD_WATER: Final = 2e-3
+"""Largest cloud water mixing ratio in the synthetic files, in kg/kg."""
+
+RESULTS_VERSION: Final = 1
+"""Version of the layout of the results file."""
+
+NOISE_SECONDS: Final = 1e-3
+"""Slowdowns shorter than this are not regressions, short runs are mostly noise."""
+
+
+class Result(NamedTuple):
+    """Timing and memory use of one benchmark on one tier."""
+
+    benchmark: str
+    tier: str
+    seconds: float
+    """fastest of the timed runs"""
+    mean_seconds: float
+    repeat: int
+    peak_bytes: int
+    """peak memory allocated during a run, as traced by tracemalloc"""
+
+
+def upsample_nearest(array: npt.NDArray[Any], shape: Sequence[int]) -> npt.NDArray[Any]:
+    """resizes an array to shape by repeating the nearest element along each axis"""
+    index = np.ix_(*[np.arange(n) * m // n for n, m in zip(shape, array.shape)])
+    return array[index]
+
+
+def get_cloud_field(
+    shape: tuple[int, int, int], sparsity: float, rng: np.random.Generator
+) -> npt.NDArray[np.float32]:
+    """
+    Random cloud water field that looks enough like LES output to exercise the
+    converters: clouds are clumps several cells across with ragged edges, confined
+    to a horizontal layer, and the rest of the domain is exactly zero.
+
+    :param shape: (x, y, z) shape of the field
+    :param sparsity: fraction of voxels holding cloud, between 0 and 1
+    :param rng: random number generator
+    :returns: field in Fortran order, in kg/kg
+    """
+    coarse = rng.random([n // CLOUD_SCALE + 1 for n in shape], dtype=np.float32)
+    field = np.asfortranarray(upsample_nearest(coarse, shape))
+    field += rng.random(shape, dtype=np.float32) * np.float32(0.5)
+    heights = (np.arange(shape[2], dtype=np.float32) + 0.5) / shape[2]
+    bottom, top = CLOUD_LAYER
+    center, half_width = (bottom + top) / 2, (top - bottom) / 2
+    field *= np.exp(-(((heights - center) / half_width) ** 8)).astype(np.float32)
+    threshold = np.quantile(field, 1 - sparsity) if sparsity > 0 else np.inf
+    field -= np.float32(threshold)
+    np.maximum(field, 0, out=field)
+    max_val = np.max(field)
+    if max_val > 0:
+        field *= np.float32(MAX_CLOUD_WATER / max_val)
+    return field
+
+
+def write_synthetic_les(
+    nc_file: pathlib.Path,
+    shape: tuple[int, int, int],
+    timesteps: int = 1,
+    dimensions: Sequence[str] = DEFAULT_DIMENSIONS,
+    sparsity: float = DEFAULT_SPARSITY,
+    variable: str = "QC",
+    seed: int = 0,
+) -> None:
+    """
+    Write a netCDF file with a synthetic cloud water variable laid out like the
+    LES files. The clouds drift along x from one timestep to the next.
+
+    :param nc_file: netCDF4 file to create
+    :param shape: (x, y, z) shape of the variable
+    :param timesteps: length of the nt dimension, if the variable has one
+    :param dimensions: order of the nx, ny, nz and optionally nt dimensions
+    :param sparsity: fraction of voxels holding cloud, between 0 and 1
+    :param variable: name of the variable
+    :param seed: seed of the random number generator, for repeatable files
+    :raises: ValueError if the dimensions are not nx, ny, nz and optionally nt
+    """
+    spatial = tuple(dim for dim in dimensions if dim != "nt")
+    if sorted(spatial) != ["nx", "ny", "nz"] or len(dimensions) - len(spatial) > 1:
+        raise ValueError("dimensions must be nx, ny, nz and optionally nt")
+    sizes: dict[str, int] = dict(zip(("nx", "ny", "nz"), shape))
+    sizes["nt"] = timesteps if "nt" in dimensions else 1
+    axes = convert.get_xyz_axes(tuple(dimensions))
+    # The inverse of the permutation from file order to xyz order
+    to_file = tuple(int(axis) for axis in np.argsort(axes))
+    field = get_cloud_field(shape, sparsity, np.random.default_rng(seed))
+    drift = max(shape[0] // 16, 1)
+
+    with netCDF4.Dataset(nc_file, "w") as rootgrp:
+        for dim in dimensions:
+            rootgrp.createDimension(dim, sizes[dim])
+        qcvar = rootgrp.createVariable(variable, "f4", tuple(dimensions))
+        for timestep in range(sizes["nt"]):
+            data = np.roll(field, timestep * drift, axis=0).transpose(to_file)
+            index = tuple(
+                timestep if dim == "nt" else slice(None) for dim in dimensions
+            )
+            qcvar[index] = data
+
+
+def write_synthetic_radiance(
+    nc_file: pathlib.Path,
+    shape: tuple[int, int],
+    angles: int = radiance.NADIR_ANGLE + 1,
+    variable: str = "rad",
+    seed: int = 0,
+) -> None:
+    """
+    Write a netCDF file with a synthetic radiance variable laid out like the MISR
+    files: bright clouds over a dark background, seen shifted at each angle.
+
+    :param nc_file: netCDF4 file to create
+    :param shape: (x, y) shape of each image
+    :param angles: number of viewing angles, the last one is nadir
+    :param variable: name of the variable
+    :param seed: seed of the random number generator, for repeatable files
+    """
+    rng = np.random.default_rng(seed)
+    clouds = upsample_nearest(
+        rng.random([n // CLOUD_SCALE + 1 for n in shape], dtype=np.float32), shape
+    )
+    image = np.float32(0.05) + np.maximum(clouds - np.float32(0.6), 0)
+    image += rng.random(shape, dtype=np.float32) * np.float32(0.01)
+    parallax = max(shape[0] // 64, 1)
+
+    with netCDF4.Dataset(nc_file, "w") as rootgrp:
+        rootgrp.createDimension("x", shape[0])
+        rootgrp.createDimension("y", shape[1])
+        rootgrp.createDimension("angle", angles)
+        radvar = rootgrp.createVariable(variable, "f4", ("x", "y", "angle"))
+        for angle in range(angles):
+            shift = (angle - angles + 1) * parallax
+            radvar[:, :, angle] = np.roll(image, shift, axis=0)
+
+
+def measure(func: Callable[[], Any], repeat: int = 3) -> tuple[list[float], int]:
+    """
+    Time a function over several runs and measure the peak memory it allocates.
+    Memory is traced on a separate first run, which also warms up caches, since
+    tracing slows down allocations.
+
+    :param func: function to benchmark, called without arguments
+    :param repeat: number of timed runs
+    :returns: duration of each timed run in seconds, and the peak traced bytes
+    """
+    tracemalloc.start()
+    try:
+        func()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    durations: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations, peak_bytes
+
+
+def run_tier(
+    workdir: pathlib.Path,
+    tier_name: str,
+    benchmarks: Sequence[str] = BENCHMARKS,
+    timesteps: int = 1,
+    dimensions: Sequence[str] = DEFAULT_DIMENSIONS,
+    sparsity: float = DEFAULT_SPARSITY,
+    repeat: int = 3,
+) -> list[Result]:
+    """
+    Generate the synthetic inputs of a tier and run benchmarks on them. Each
+    benchmark takes the output of the previous steps of the conversion as input,
+    which is computed beforehand so that it is not part of the measurement.
+
+    :param workdir: directory for the synthetic inputs and the exported files
+    :param tier_name: key of SIZE_TIERS
+    :param benchmarks: names of the benchmarks to run, see BENCHMARKS
+    :param timesteps: length of the nt dimension of the synthetic LES file
+    :param dimensions: order of the dimensions of the synthetic LES file
+    :param sparsity: fraction of voxels holding cloud in the synthetic LES file
+    :param repeat: number of timed runs of each benchmark
+    :returns: result of each benchmark, in the order of BENCHMARKS
+    """
+    tier = SIZE_TIERS[tier_name]
+    les_file = workdir / f"les_{tier_name}.nc"
+    rad_file = workdir / f"rad_{tier_name}.nc"
+    write_synthetic_les(les_file, tier.grid, timesteps, dimensions, sparsity)
+    if "export_radiance_image" in benchmarks:
+        write_synthetic_radiance(rad_file, tier.image)
+
+    qcarr = convert.parse_netcdf(les_file, "QC")
+    points = convert.get_nonzero_points(qcarr)
+    volume = convert.map_points_nrrd(points, qcarr, 8)
+    vertices = convert.rotate_points(points, np.float32)
+    min_y = int(np.min(points[:, 2])) if len(points) else 0
+    print(f"{tier_name:<17}: {tier.grid} grid, {len(points)} points")
+
+    functions: dict[str, Callable[[], Any]] = {
+        "parse_netcdf": lambda: convert.parse_netcdf(les_file, "QC"),
+        "get_nonzero_points": lambda: convert.get_nonzero_points(qcarr),
+        "map_points_nrrd": lambda: convert.map_points_nrrd(points, qcarr, 8),
+        "create_gltf_model": lambda: convert.create_gltf_model(
+            workdir / f"out_{tier_name}.glb", vertices
+        ),
+        "create_nrrd_model": lambda: convert.create_nrrd_model(
+            workdir / f"out_{tier_name}.nrrd", volume, min_y
+        ),
+        "export_radiance_image": lambda: radiance.export_radiance_image(
+            rad_file, workdir / f"out_{tier_name}.png"
+        ),
+    }
+    results: list[Result] = []
+    for name in BENCHMARKS:
+        if name not in benchmarks:
+            continue
+        # The exporters report progress, which would swamp the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            durations, peak_bytes = measure(functions[name], repeat)
+        result = Result(
+            name,
+            tier_name,
+            min(durations),
+            sum(durations) / len(durations),
+            repeat,
+            peak_bytes,
+        )
+        print(
+            f"  {name:<21}: {result.seconds * 1e3:9.2f} ms"
+            f"  {result.peak_bytes / 2**20:9.2f} MiB"
+        )
+        results.append(result)
+    return results
+
+
+def get_environment() -> dict[str, Any]:
+    """versions and machine details stored with results, to explain differences"""
+    return {
+        "ncexport": batch.get_tool_version(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "netCDF4": netCDF4.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def write_results(
+    results_file: pathlib.Path,
+    results: Sequence[Result],
+    label: str | None = None,
+    **parameters: Any,
+) -> None:
+    """
+    Write benchmark results as JSON, along with the environment and the
+    parameters of the synthetic inputs.
+
+    :param results_file: JSON file to create
+    :param results: results of all benchmarks
+    :param label: name of the run, such as a commit hash
+    :param parameters: how the synthetic inputs were generated
+    """
+    with open(results_file, "w") as fh:
+        json.dump(
+            {
+                "version": RESULTS_VERSION,
+                "label": label,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "environment": get_environment(),
+                "parameters": parameters,
+                "results": [result._asdict() for result in results],
+            },
+            fh,
+            indent=2,
+        )
+
+
+def load_results(results_file: pathlib.Path) -> list[Result]:
+    """
+    Read benchmark results written by write_results.
+
+    :param results_file: JSON file to read
+    :returns: results of all benchmarks
+    :raises: ValueError if the file is not in a known layout
+    """
+    with open(results_file) as fh:
+        data = json.load(fh)
+    if not isinstance(data, dict) or data.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{results_file} is not a benchmark results file")
+    return [Result(**result) for result in data["results"]]
+
+
+def compare_results(
+    baseline: Sequence[Result],
+    results: Sequence[Result],
+    tolerance: float = 0.1,
+) -> list[tuple[Result, Result]]:
+    """
+    Print the change in time and memory of each benchmark present in both sets of
+    results, and collect the ones that became slower by more than the tolerance.
+    The fastest runs are compared, since they are the least affected by noise,
+    and slowdowns under NOISE_SECONDS are ignored.
+
+    :param baseline: earlier results
+    :param results: new results
+    :param tolerance: allowed relative increase in time, 0.1 is 10% slower
+    :returns: (baseline, new) pairs of the regressed benchmarks
+    """
+    earlier = {(result.benchmark, result.tier): result for result in baseline}
+    regressions: list[tuple[Result, Result]] = []
+    for result in results:
+        before = earlier.get((result.benchmark, result.tier))
+        if before is None:
+            continue
+        time_ratio = result.seconds / before.seconds if before.seconds else 1.0
+        memory_ratio = (
+            result.peak_bytes / before.peak_bytes if before.peak_bytes else 1.0
+        )
+        slowdown = result.seconds - before.seconds
+        regressed = time_ratio > 1 + tolerance and slowdown > NOISE_SECONDS
+        print(
+            f"{result.tier:<7}{result.benchmark:<22}: time x{time_ratio:5.2f}"
+            f"  memory x{memory_ratio:5.2f}{'  REGRESSED' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append((before, result))
+    return regressions
@@ -0,0 +1,193 @@
+"""Export of volumes as fixed-size bricks, where bricks without any data are
+dropped. An index describes where each occupied brick is stored in a single
+packed data file so that clients can fetch bricks with HTTP range requests."""
+
+import json
+import pathlib
+from typing import Any, Iterator
+
+import numpy as np
+import numpy.typing as npt
+
+from . import convert, profiling
+
+Brick = tuple[tuple[int, int, int], npt.NDArray[np.uint8 | np.uint16 | np.float32]]
+"""The [x, y, z] brick coordinate and the voxels of one brick."""
+
+
+def iter_bricks(
+    nz_points: npt.NDArray[np.int_],
+    values: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    brick_size: int,
+) -> Iterator[Brick]:
+    """
+    Group sparse points into cubic bricks, yielding only bricks that contain at
+    least one point. Bricks are yielded in order of their coordinates (z varying
+    fastest) and their voxels are in Fortran order, like NRRD data.
+
+    :param nz_points: N-by-3 array of [x, y, z] indices, all non-negative
+    :param values: already quantized value of each point
+    :param brick_size: edge length of a brick in voxels
+    :returns: generator of (brick coordinate, brick voxels) pairs
+    """
+    if len(nz_points) == 0:
+        return
+    brick_coords = nz_points // brick_size
+    grid_shape = tuple(int(n) for n in brick_coords.max(axis=0) + 1)
+    brick_ids = np.asarray(np.ravel_multi_index(tuple(brick_coords.T), grid_shape))
+    order = np.argsort(brick_ids, kind="stable")
+    sorted_ids = brick_ids[order]
+    # Each run of equal ids in the sorted array is one occupied brick
+    starts = np.flatnonzero(np.diff(sorted_ids, prepend=-1))
+    ends = np.append(starts[1:], len(sorted_ids))
+    for start, end in zip(starts, ends):
+        members = order[start:end]
+        coord = brick_coords[members[0]]
+        local = nz_points[members] - coord * brick_size
+        brick = np.zeros((brick_size,) * 3, dtype=values.dtype, order="F")
+        brick[local[:, 0], local[:, 1], local[:, 2]] = values[members]
+        yield (int(coord[0]), int(coord[1]), int(coord[2])), brick
+
+
+def create_brick_model(
+    index_file: pathlib.Path,
+    data_file: pathlib.Path,
+    bricks: Iterator[Brick],
+    brick_size: int,
+    shape: tuple[int, int, int],
+    metadata: dict[str, Any] | None = None,
+) -> int:
+    """
+    Write occupied bricks back to back into one data file, and a JSON index with
+    the coordinate, byte offset and value range of each brick. The range only
+    covers the non-zero voxels, since every partly occupied brick also holds empty
+    space, so that clients can skip bricks by value. Every brick has the same byte
+    length, given in the index.
+
+    :param index_file: output filepath of the JSON index
+    :param data_file: output filepath of the packed brick data
+    :param bricks: (brick coordinate, brick voxels) pairs, e.g. from iter_bricks
+    :param brick_size: edge length of a brick in voxels
+    :param shape: (x, y, z) shape of the volume that was split into bricks
+    :param metadata: additional entries for the index, such as the volume offset
+    :returns: number of bricks written
+    """
+    entries: list[dict[str, Any]] = []
+    dtype = None
+    offset = 0
+    with open(data_file, "wb") as fh:
+        for coord, brick in bricks:
+            dtype = brick.dtype
+            fh.write(brick.T.data)
+            # Points quantized to 0 look like empty space, so a brick can have no
+            # non-zero voxels, in which case its range is that of all voxels
+            occupied = brick[brick != 0]
+            if len(occupied) == 0:
+                occupied = brick
+            entries.append(
+                {
+                    "coord": list(coord),
+                    "offset": offset,
+                    "min": occupied.min().item(),
+                    "max": occupied.max().item(),
+                }
+            )
+            offset += brick.nbytes
+    index = {
+        "data": data_file.name,
+        "type": dtype.name if dtype is not None else None,
+        "endian": "little",
+        "brickSize": brick_size,
+        "brickBytes": brick_size**3 * (dtype.itemsize if dtype is not None else 0),
+        "sizes": list(shape),
+        "grid": [-(-n // brick_size) for n in shape],
+        **(metadata or {}),
+        "bricks": entries,
+    }
+    with open(index_file, "w") as fh:
+        json.dump(index, fh, separators=(",", ":"))
+    return len(entries)
+
+
+def get_brick_paths(outpath: pathlib.Path) -> tuple[pathlib.Path, pathlib.Path]:
+    """index and data filepaths derived from an output filepath"""
+    return outpath.with_suffix(".bricks.json"), outpath.with_suffix(".bricks.bin")
+
+
+def convert_nc_bricks(
+    nc_file: pathlib.Path,
+    outpath: pathlib.Path,
+    variable: str = "QC",
+    quantization_bits: int = 8,
+    brick_size: int = 32,
+    slab_bytes: int = convert.DEFAULT_SLAB_BYTES,
+    crop: bool = False,
+    timestep: int = 0,
+    cache: convert.ArrayCache | None = None,
+    region: convert.Region | None = None,
+    pipeline: convert.Pipeline | None = None,
+) -> bool:
+    """
+    Main function for converting a netCDF dataset into a bricked sparse volume.
+    The volume spans the whole variable or the region, or the bounding box of the
+    non-zero data if cropping, and is split into cubes of brick_size voxels. Only
+    bricks that contain non-zero data are stored. Data values are quantized the
+    same way as for NRRD export.
+
+    :params nc_file: netCDF4 file to convert
+    :params outpath: output filepath, the suffix is replaced by .bricks.json for
+    the index and .bricks.bin for the packed data
+    :params variable: the variable to export
+    :params quantization_bits: 8 or 16 to quantize the data, otherwise float
+    :params brick_size: edge length of a brick in voxels, one of options.BRICK_SIZES
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params crop: only brick the bounding box of the non-zero data
+    :params timestep: index along nt to export, ignored for 3-dimensional variables
+    :params cache: optional cache of decoded variables
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variable
+    :params pipeline: optionally read hyperslabs and extract their points on
+    concurrent stages
+    :returns: True if successful
+    :raises: KeyError if the variable keyword does not exist in the netCDF database
+    :raises: ValueError if the dimensions in the variable are not named as expected
+    :raises: TypeError if the variable has more than 4 dimensions
+    """
+    nzdata = convert.read_nonzero_data(
+        nc_file, variable, timestep, slab_bytes, cache, region=region, pipeline=pipeline
+    )
+    nonzero_points = nzdata.points
+    print(f"Found {nonzero_points.shape[0]} points")
+
+    offset = (0, 0, 0)
+    shape = nzdata.shape
+    if crop:
+        origin = (0, 0, 0) if region is None else convert.get_region_box(region)[0]
+        offset, shape = convert.get_bounding_box(nonzero_points, origin)
+        nonzero_points = nonzero_points - np.array(offset)
+    elif region is not None:
+        offset, shape = convert.get_region_box(region)
+        nonzero_points = nonzero_points - np.array(offset)
+    levels = (2**quantization_bits) - 1
+    with profiling.stage("quantize") as counts:
+        values = convert.quantize_array(
+            nzdata.values, nzdata.min_val, nzdata.max_val, levels
+        )
+        counts.items = len(values)
+
+    index_file, data_file = get_brick_paths(outpath)
+    metadata = {
+        "offset": list(offset),
+        "originalSizes": list(nzdata.shape),
+        "valueRange": [float(nzdata.min_val), float(nzdata.max_val)],
+    }
+    bricks = iter_bricks(nonzero_points, values, brick_size)
+    with profiling.stage("write bricks") as counts:
+        count = create_brick_model(
+            index_file, data_file, bricks, brick_size, shape, metadata
+        )
+        counts.bytes_written = profiling.get_file_bytes(index_file, data_file)
+        counts.items = count
+    total = np.prod([-(-n // brick_size) for n in shape])
+    print(f"Wrote {count} of {total} bricks")
+    return True
@@ -0,0 +1,258 @@
+"""Export of several variables from one netCDF file in a single pass, either as
+one NRRD per variable or packed into the channels of a single volume that can be
+uploaded as one RG or RGBA 3D texture."""
+
+import pathlib
+from typing import Any, Final, Sequence
+
+import netCDF4
+import numpy as np
+import numpy.typing as npt
+
+from . import convert, nrrdio, occupancy
+from .options import MAX_CHANNELS
+
+CHANNEL_KINDS: Final = {1: "scalar", 2: "2-vector", 4: "4-vector"}
+"""NRRD kind of the channel axis for each supported number of channels."""
+
+
+def get_channel_count(variable_count: int) -> int:
+    """
+    Number of channels needed to pack the given number of variables. 3D textures
+    have 1, 2 or 4 channels, so 3 variables are padded with an empty fourth one.
+
+    :param variable_count: number of variables to pack
+    :returns: 1, 2 or 4
+    :raises: ValueError if there are more variables than MAX_CHANNELS
+    """
+    if not 1 <= variable_count <= MAX_CHANNELS:
+        raise ValueError(f"can only pack 1 to {MAX_CHANNELS} variables")
+    return 4 if variable_count == 3 else variable_count
+
+
+def get_variable_path(path: pathlib.Path, variable: str) -> pathlib.Path:
+    """appends the variable name to the stem of a filepath"""
+    return path.with_name(f"{path.stem}_{variable}{path.suffix}")
+
+
+def extract_variables(
+    nc_file: pathlib.Path,
+    variables: Sequence[str],
+    timestep: int = 0,
+    slab_bytes: int = convert.DEFAULT_SLAB_BYTES,
+    cache: convert.ArrayCache | None = None,
+    region: convert.Region | None = None,
+    pipeline: convert.Pipeline | None = None,
+) -> dict[str, convert.NonzeroData]:
+    """
+    Open a netCDF file once and collect the sparse data of each variable, one
+    hyperslab at a time. Variables found in the cache are not read from the file.
+
+    :param nc_file: netCDF4 file to read
+    :param variables: the variables to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param cache: optional cache of decoded variables
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variables
+    :param pipeline: optionally read hyperslabs and extract their points on
+    concurrent stages
+    :returns: non-zero points and values of each variable, by name
+    :raises: KeyError if a variable does not exist in the netCDF database
+    :raises: ValueError if the dimensions of a variable are not named as expected
+    :raises: ValueError if the variables do not all have the same shape
+    """
+    nzdatas: dict[str, convert.NonzeroData] = {}
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        for variable in variables:
+            shape = None
+            if region is not None:
+                shape = convert.get_xyz_shape(rootgrp.variables[variable])
+            slabs = convert.read_netcdf_slabs(
+                nc_file, variable, timestep, slab_bytes, cache, region, rootgrp
+            )
+            nzdatas[variable] = convert.extract_nonzero_slabs(
+                slabs, region=region, shape=shape, pipeline=pipeline
+            )
+            print(f"{variable:<17}: {len(nzdatas[variable].points)} points")
+    if len({nzdata.shape for nzdata in nzdatas.values()}) > 1:
+        raise ValueError("variables must all have the same shape")
+    return nzdatas
+
+
+def get_channel_header(
+    variables: Sequence[str],
+    value_ranges: Sequence[tuple[np.float_, np.float_]],
+    channel_count: int,
+    header: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """
+    NRRD header fields for a volume whose first axis holds one channel per
+    variable. The value range of each channel is stored so that viewers can map
+    quantized values back to data values.
+
+    :param variables: name of the variable in each channel
+    :param value_ranges: data values mapped to 0 and the highest level per channel
+    :param channel_count: number of channels, including padding
+    :param header: header fields of a single channel volume, e.g. from crop
+    :returns: dictionary of header fields
+    """
+    channel_header = dict(header or {})
+    channel_header["kinds"] = [CHANNEL_KINDS[channel_count]] + ["domain"] * 3
+    if "space directions" in channel_header:
+        # The channel axis does not extend into space
+        channel_header["space directions"] = np.vstack(
+            [np.full(3, np.nan), channel_header["space directions"]]
+        )
+    channel_header["channels"] = list(variables)
+    channel_header["channel min"] = [float(r[0]) for r in value_ranges]
+    channel_header["channel max"] = [float(r[1]) for r in value_ranges]
+    return channel_header
+
+
+def pack_channels(
+    nzdatas: Sequence[convert.NonzeroData],
+    quantization_bits: int,
+    base_shape: tuple[int, int, int],
+    offset: tuple[int, int, int] = (0, 0, 0),
+    out: npt.NDArray[np.uint8 | np.uint16 | np.float32] | None = None,
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """
+    Quantize several variables into the channels of a single volume. Channels are
+    the first axis and the volume is in Fortran order, so the channels of each
+    voxel are interleaved in the file as a 3D texture expects.
+
+    :param nzdatas: sparse data of each variable, each quantized with its own range
+    :param quantization_bits: export data as 8- or 16-bit values, otherwise as float
+    :param base_shape: (x, y, z) shape of the volume
+    :param offset: index of the first voxel of the volume, if cropped
+    :param out: zero-filled volume to write into, such as a memory mapped file
+    :returns: (channels, x, y, z) volume, padded to 1, 2 or 4 channels
+    """
+    channel_count = get_channel_count(len(nzdatas))
+    dt = convert.get_quantized_dtype(quantization_bits)
+    if out is None:
+        out = np.zeros((channel_count,) + base_shape, dtype=dt, order="F")
+    for channel, nzdata in enumerate(nzdatas):
+        convert.map_values_nrrd(
+            nzdata.points - np.array(offset),
+            nzdata.values,
+            nzdata.min_val,
+            nzdata.max_val,
+            quantization_bits,
+            base_shape,
+            out[channel],
+        )
+    return out
+
+
+def convert_nc_nrrd_channels(
+    nc_file: pathlib.Path,
+    nrrd_file: pathlib.Path,
+    variables: Sequence[str],
+    quantization_bits: int = 8,
+    slab_bytes: int = convert.DEFAULT_SLAB_BYTES,
+    crop: bool = False,
+    timestep: int = 0,
+    encoding: nrrdio.NrrdEncoding = nrrdio.NrrdEncoding(),
+    pack: bool = False,
+    lod_levels: int = 0,
+    pooling: str = "max",
+    cache: convert.ArrayCache | None = None,
+    occupancy_grid: occupancy.OccupancyGrid | None = None,
+    region: convert.Region | None = None,
+    pipeline: convert.Pipeline | None = None,
+) -> bool:
+    """
+    Main function for converting several variables of a netCDF dataset to NRRD,
+    reading the dataset once. Each variable is quantized with its own range.
+    Without packing, each variable is written to its own file with the variable
+    name appended. With packing, the variables are stored as the channels of a
+    single volume and the range of each channel is stored in the header.
+
+    :params nc_file: netCDF4 file to convert
+    :params nrrd_file: output filepath with .nrrd extension
+    :params variables: the variables to export
+    :params quantization_bits: 8 or 16 to quantize the data, otherwise float
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params crop: crop to the bounding box of the non-zero data, of all variables
+    when packing
+    :params timestep: index along nt to export, ignored for 3-dimensional variables
+    :params encoding: how the NRRD data is stored and compressed
+    :params pack: write a single multi-channel volume instead of one per variable
+    :params lod_levels: number of downsampled volumes to export per variable, not
+    supported when packing
+    :params pooling: how voxels are combined when downsampling, "max" or "mean"
+    :params cache: optional cache of decoded variables
+    :params occupancy_grid: optionally also export a coarse grid of where each
+    volume holds data, over all channels when packing
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variables
+    :params pipeline: optionally run reading, extraction and compression on
+    concurrent stages
+    :returns: True if successful
+    :raises: KeyError if a variable does not exist in the netCDF database
+    :raises: ValueError if a variable is repeated, if the variables do not all have
+    the same shape, or if more than MAX_CHANNELS variables are packed
+    """
+    # Checked before reading anything, since reading is the slow part
+    if len(set(variables)) != len(variables):
+        raise ValueError("each variable can only be exported once")
+    channel_count = get_channel_count(len(variables)) if pack else len(variables)
+    nzdatas = extract_variables(
+        nc_file, variables, timestep, slab_bytes, cache, region, pipeline
+    )
+    if not pack:
+        for variable, nzdata in nzdatas.items():
+            variable_file = get_variable_path(nrrd_file, variable)
+            print(f"{variable:<17}: {variable_file}")
+            convert.write_nonzero_nrrd(
+                nzdata,
+                variable_file,
+                quantization_bits,
+                crop,
+                encoding=encoding,
+                lod_levels=lod_levels,
+                pooling=pooling,
+                occupancy_grid=occupancy_grid,
+                region=region,
+                pipeline=pipeline,
+            )
+        return True
+
+    all_points = np.concatenate([nzdata.points for nzdata in nzdatas.values()])
+    min_y = convert.get_min_y(all_points)
+    base_shape = (512, 512, 512)
+    offset = (0, 0, 0)
+    header = None
+    original_shape = next(iter(nzdatas.values())).shape
+    if crop:
+        origin = (0, 0, 0) if region is None else convert.get_region_box(region)[0]
+        offset, base_shape = convert.get_bounding_box(all_points, origin)
+        print(f"Cropped volume   : {base_shape} at offset {offset}")
+        header = convert.get_crop_header(offset, original_shape)
+    elif region is not None:
+        offset, base_shape = convert.get_region_box(region)
+        print(f"Region volume    : {base_shape} at offset {offset}")
+        header = convert.get_crop_header(offset, original_shape)
+    del all_points
+    value_ranges = [(nzdata.min_val, nzdata.max_val) for nzdata in nzdatas.values()]
+    channel_header = get_channel_header(variables, value_ranges, channel_count, header)
+
+    out = None
+    if encoding.encoding == "detached":
+        dt = convert.get_quantized_dtype(quantization_bits)
+        shape = (channel_count,) + base_shape
+        out = nrrdio.create_detached_nrrd(nrrd_file, shape, dt, channel_header)
+    volume = pack_channels(
+        list(nzdatas.values()), quantization_bits, base_shape, offset, out
+    )
+    convert.create_nrrd_model(
+        nrrd_file, volume, min_y, channel_header, encoding, pipeline
+    )
+    if occupancy_grid is not None:
+        grid_file = occupancy.write_occupancy_grid(
+            nrrd_file, volume, occupancy_grid, header, encoding
+        )
+        print(f"Occupancy grid   : {grid_file}")
+    return True
@@ -1,9 +1,18 @@
 """CLI frontend for converting netCDF to gltf or nrrd."""
 
 import argparse
+import contextlib
 import pathlib
+import sys
+import tempfile
+from typing import TYPE_CHECKING, Callable, Iterator
 
-from . import convert, radiance
+# The export modules import netCDF4, gltflib, nrrd and PIL, which take most of the
+# startup time, so each command imports the ones it needs when it runs
+from . import options, pipeline, profiling
+
+if TYPE_CHECKING:
+    from . import arraycache, convert
 
 
 def sanitize_inpath(
@@ -44,11 +53,98 @@ def sanitize_outpath(
     return outpath
 
 
+def parse_timesteps(spec: str, count: int) -> list[int]:
+    """
+    Expand a timestep selection into a list of indices along nt. Accepts "all", a
+    single index, or a python style start:stop:step slice, e.g. "0:120:4".
+
+    :param spec: timestep selection from the command line
+    :param count: number of timesteps in the netCDF variable
+    :returns: list of selected timesteps
+    :raises: ValueError if the selection is malformed or selects no timesteps
+    """
+    if spec == "all":
+        return list(range(count))
+    parts = spec.split(":")
+    if len(parts) == 1:
+        timestep = int(spec)
+        if not 0 <= timestep < count:
+            raise ValueError(f"index {timestep} is out of range")
+        return [timestep]
+    if len(parts) > 3:
+        raise ValueError("too many fields in range")
+    bounds = [int(part) if part else None for part in parts]
+    timesteps = list(range(count))[slice(*bounds)]
+    if not timesteps:
+        raise ValueError("range is empty")
+    return timesteps
+
+
+def parse_angles(spec: str, count: int) -> list[int]:
+    """
+    Expand a viewing angle selection into a sorted list of angle indices. Accepts
+    "all", or a comma separated list of indices and start:stop:step ranges in the
+    same format as parse_timesteps, e.g. "0,4,8" or "2:7".
+
+    :param spec: angle selection from the command line
+    :param count: number of viewing angles in the radiance variable
+    :returns: list of selected angles
+    :raises: ValueError if the selection is malformed or selects no angles
+    """
+    angles: set[int] = set()
+    for part in spec.split(","):
+        angles.update(parse_timesteps(part, count))
+    return sorted(angles)
+
+
+def get_region(
+    args: argparse.Namespace,
+    parser: argparse.ArgumentParser,
+    shape_func: Callable[[pathlib.Path, str], tuple[int, ...]],
+    inpath: pathlib.Path,
+    variable: str,
+) -> "convert.Region | None":
+    """Region requested on the command line with --bbox, if any."""
+    if args.grid_spacing <= 0:
+        parser.error("grid spacing must be positive")
+    if args.bbox is None:
+        return None
+    from . import convert
+
+    try:
+        return convert.parse_bbox(
+            args.bbox, shape_func(inpath, variable), args.grid_spacing
+        )
+    except KeyError:
+        parser.error(f"variable {variable} does not exist in the input file")
+    except ValueError as err:
+        parser.error(f"invalid bounding box: {err}")
+
+
+def get_cache(
+    args: argparse.Namespace, parser: argparse.ArgumentParser
+) -> "arraycache.ArrayCache | None":
+    """Cache of decoded variables requested on the command line, if any."""
+    from . import arraycache
+
+    if args.cache_mb < 1:
+        parser.error("cache size must be at least 1 MB")
+    if not args.cache:
+        return None
+    cache = arraycache.ArrayCache(
+        arraycache.get_default_cache_dir(), args.cache_mb * 2**20
+    )
+    print(f"cache directory  : {cache.directory}")
+    return cache
+
+
 def process_file(
     args: argparse.Namespace, parser: argparse.ArgumentParser, is_nrrd: bool = False
 ) -> None:
     """Perform basic checks on filepath arguments before calling convert_nc_gltf
     or convert_nc_nrrd function."""
+    from . import bricks, channels, convert, occupancy
+
     inpath = sanitize_inpath(args.file, parser)
 
     if is_nrrd:
@@ -68,7 +164,12 @@ def process_file(
     except RuntimeError:
         parser.error("could not resolve resource path")
 
-    use_var = args.variable or "QC"
+    if is_nrrd:
+        variables = args.variable or ["QC"]
+    else:
+        variables = [args.variable or "QC"]
+    use_var = variables[0]
+    is_multi = len(variables) > 1 or (is_nrrd and args.pack)
 
     # Setting this value, which must be an int, to an arbitrary value tells the
     # quantization function in convert.py to interpret the data as a float
@@ -81,33 +182,385 @@ def process_file(
         else:
             parser.error("only 8 or 16 bits are allowed for quantizing data")
 
+    if args.slab_mb < 1:
+        parser.error("slab memory budget must be at least 1 MB")
+    slab_bytes = args.slab_mb * 2**20
+
+    timesteps = [0]
+    if args.time is not None:
+        try:
+            count = convert.get_timestep_count(inpath, use_var)
+            timesteps = parse_timesteps(args.time, count)
+        except KeyError:
+            parser.error(f"variable {use_var} does not exist in the input file")
+        except ValueError as err:
+            parser.error(f"invalid timestep selection: {err}")
+    is_series = args.time is not None and len(timesteps) > 1
+    if args.workers is not None and args.workers < 1:
+        parser.error("at least 1 worker process is required")
+    if args.stages < 1:
+        parser.error("at least 1 stage is required")
+    if args.queue_depth < 1:
+        parser.error("queues must hold at least 1 item")
+    stage_pipeline = None
+    if args.stages > 1:
+        stage_pipeline = pipeline.Pipeline(args.stages, args.queue_depth)
+    if is_nrrd and args.lod and args.bricks is not None:
+        parser.error("level of detail pyramids are not supported for bricks")
+    if len(set(variables)) != len(variables):
+        parser.error("each variable can only be exported once")
+    if is_multi and is_series:
+        parser.error("multiple variables support a single timestep at a time")
+    if is_multi and args.bricks is not None:
+        parser.error("bricked export supports a single variable")
+    occupancy_grid = None
+    if is_nrrd and args.occupancy is not None:
+        if args.bricks is not None:
+            parser.error("occupancy grids are not supported for bricks")
+        if args.occupancy_block < 2:
+            parser.error("occupancy blocks must be at least 2 voxels wide")
+        occupancy_grid = occupancy.OccupancyGrid(args.occupancy, args.occupancy_block)
+    if is_nrrd and args.pack:
+        if args.lod:
+            parser.error("level of detail pyramids are not supported with --pack")
+        if len(variables) > channels.MAX_CHANNELS:
+            parser.error(f"at most {channels.MAX_CHANNELS} variables can be packed")
+    if not is_nrrd and args.values and not args.quantize:
+        parser.error("--values requires --quantize")
+    if not is_nrrd and args.chunk_points is not None and args.chunk_points < 1:
+        parser.error("chunks must hold at least 1 point")
+    stats_sidecar = False
+    if is_nrrd:
+        stats_sidecar = check_stats_arguments(args, parser)
+        if args.clip_percentile is not None and bits == 32:
+            parser.error("--clip-percentile requires quantizing with --bits")
+        if stats_sidecar and (is_multi or args.bricks is not None):
+            parser.error("statistics support a single variable without --bricks")
+    region = get_region(args, parser, convert.get_variable_shape, inpath, use_var)
+
+    encoding = None
+    if is_nrrd:
+        if not 1 <= args.level <= 9:
+            parser.error("compression level must be between 1 and 9")
+        if args.threads is not None and args.threads < 1:
+            parser.error("at least 1 compression thread is required")
+        encoding = convert.NrrdEncoding(args.encoding, args.level, args.threads)
+
     print(f"input filepath   : {inpath}")
     print(f"output filepath  : {outpath}")
-    print(f"exported variable: {use_var}")
+    print(f"exported variable: {', '.join(variables)}")
+    if is_series:
+        print(f"timesteps        : {len(timesteps)} ({timesteps[0]}..{timesteps[-1]})")
+    else:
+        print(f"timestep         : {timesteps[0]}")
+    if region is not None:
+        print(f"region           : {convert.get_region_selection(region)}")
+    if stage_pipeline is not None:
+        print(
+            f"pipeline         : {args.stages} stages, queue depth {args.queue_depth}"
+        )
+    cache = get_cache(args, parser)
 
-    if is_nrrd:
+    if is_nrrd and args.bricks is not None:
+        if is_series:
+            parser.error("bricked export supports a single timestep at a time")
+        index_path, data_path = bricks.get_brick_paths(outpath)
         print(f"quantization     : {type_str}")
+        print(f"brick index      : {index_path}")
+        print(f"brick data       : {data_path}")
+        print(f"\nExporting data to {args.bricks}^3 bricks...")
+        bricks.convert_nc_bricks(
+            inpath,
+            outpath,
+            use_var,
+            bits,
+            args.bricks,
+            slab_bytes,
+            crop=args.crop,
+            timestep=timesteps[0],
+            cache=cache,
+            region=region,
+            pipeline=stage_pipeline,
+        )
+    elif encoding is not None:
+        print(f"quantization     : {type_str}")
+        print(f"encoding         : {encoding.encoding}")
         print("\nExporting data to NRRD...")
-        convert.convert_nc_nrrd(inpath, outpath, use_var, bits)
+        if is_multi:
+            channels.convert_nc_nrrd_channels(
+                inpath,
+                outpath,
+                variables,
+                bits,
+                slab_bytes,
+                crop=args.crop,
+                timestep=timesteps[0],
+                encoding=encoding,
+                pack=args.pack,
+                lod_levels=args.lod,
+                pooling=args.pooling,
+                cache=cache,
+                occupancy_grid=occupancy_grid,
+                region=region,
+                pipeline=stage_pipeline,
+            )
+        elif is_series:
+            convert.convert_nc_nrrd_series(
+                inpath,
+                outpath,
+                timesteps,
+                use_var,
+                bits,
+                slab_bytes,
+                crop=args.crop,
+                workers=args.workers,
+                encoding=encoding,
+                lod_levels=args.lod,
+                pooling=args.pooling,
+                cache=cache,
+                occupancy_grid=occupancy_grid,
+                region=region,
+                pipeline=stage_pipeline,
+                clip_percentile=args.clip_percentile,
+                stats_sidecar=stats_sidecar,
+            )
+        else:
+            convert.convert_nc_nrrd(
+                inpath,
+                outpath,
+                use_var,
+                bits,
+                slab_bytes,
+                crop=args.crop,
+                timestep=timesteps[0],
+                encoding=encoding,
+                lod_levels=args.lod,
+                pooling=args.pooling,
+                cache=cache,
+                occupancy_grid=occupancy_grid,
+                region=region,
+                pipeline=stage_pipeline,
+                clip_percentile=args.clip_percentile,
+                stats_sidecar=stats_sidecar,
+            )
     else:
         if outpath.suffix == ".gltf":
             print(f"vertices filepath: {respath}")
         print(f"\nExporting data to {outpath.suffix.upper().lstrip('.')}...")
-        convert.convert_nc_gltf(inpath, outpath, respath, use_var)
+        if is_series:
+            convert.convert_nc_gltf_series(
+                inpath,
+                outpath,
+                respath,
+                timesteps,
+                use_var,
+                slab_bytes,
+                workers=args.workers,
+                lod_levels=args.lod,
+                quantize_positions=args.quantize,
+                include_values=args.values,
+                chunk_points=args.chunk_points,
+                threshold=args.threshold,
+                cache=cache,
+                region=region,
+                pipeline=stage_pipeline,
+            )
+        else:
+            convert.convert_nc_gltf(
+                inpath,
+                outpath,
+                respath,
+                use_var,
+                slab_bytes,
+                timesteps[0],
+                lod_levels=args.lod,
+                quantize_positions=args.quantize,
+                include_values=args.values,
+                chunk_points=args.chunk_points,
+                threshold=args.threshold,
+                cache=cache,
+                region=region,
+                pipeline=stage_pipeline,
+            )
 
 
 def process_file_rad(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    from . import convert, radiance, tiles
+
     inpath = sanitize_inpath(args.file, parser)
     extensions = [".png", ".jpg"]
     outpath = sanitize_outpath(args.outfile, inpath, parser, extensions)
 
     use_var = args.variable or "rad"
 
+    angles = [radiance.NADIR_ANGLE]
+    if args.angles is not None:
+        try:
+            count = radiance.get_angle_count(inpath, use_var)
+            angles = parse_angles(args.angles, count)
+        except KeyError:
+            parser.error(f"variable {use_var} does not exist in the input file")
+        except ValueError as err:
+            parser.error(f"invalid angle selection: {err}")
+    region = get_region(args, parser, radiance.get_image_shape, inpath, use_var)
+    stats_sidecar = check_stats_arguments(args, parser)
+
     print(f"input filepath   : {inpath}")
     print(f"output filepath  : {outpath}")
     print(f"exported variable: {use_var}")
+    print(f"viewing angles   : {', '.join(map(str, angles))}")
+    if region is not None:
+        print(f"region           : {convert.get_region_selection(region)}")
+    cache = get_cache(args, parser)
+
+    if args.tiles is not None:
+        print(f"tile pyramid     : {tiles.get_tile_dir(outpath)} ({args.tiles})")
+
+    image_files = radiance.export_radiance_images(
+        inpath,
+        outpath,
+        use_var,
+        angles,
+        cache,
+        tile_format=args.tiles,
+        region=region,
+        clip_percentile=args.clip_percentile,
+        stats_sidecar=stats_sidecar,
+    )
+    if args.tiles is not None:
+        for image_file in image_files:
+            print(f"Tile metadata    : {image_file}")
+    elif len(image_files) > 1:
+        print(f"Wrote {len(image_files)} images")
+
+
+def add_region_arguments(parser: argparse.ArgumentParser, axes: str) -> None:
+    """Add the options selecting a region of the input to export."""
+    example = ",".join(f"{a}0:{a}1" for a in axes)
+    parser.add_argument(
+        "--bbox",
+        type=str,
+        metavar=example.upper(),
+        help=(
+            "only read and export this region of the input, given as start:stop"
+            " ranges of grid indices, or of metres with an m suffix such as"
+            " 2000m:6000m. omitted bounds extend to the edge of the grid"
+        ),
+    )
+    parser.add_argument(
+        "--grid-spacing",
+        type=float,
+        default=options.GRID_SPACING,
+        metavar="M",
+        help=(
+            "size of a grid cell in metres, used to convert --bbox bounds given in"
+            f" metres. default is {options.GRID_SPACING:g}"
+        ),
+    )
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options controlling the cache of decoded variables."""
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=(
+            "keep decoded variables in an on-disk cache, so that exporting the same"
+            " data again with different settings skips reading the netCDF file. the"
+            f" cache is stored in {options.CACHE_DIR_ENV} if set, otherwise in"
+            " ~/.cache/ncexport"
+        ),
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=options.DEFAULT_CACHE_BYTES // 2**20,
+        metavar="MB",
+        help=(
+            "size cap of the cache in megabytes, the least recently used variables"
+            " are removed past it. default is %(default)s"
+        ),
+    )
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options reporting where the time and memory of an export go."""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "measure the wall time, CPU time, peak memory, bytes read and written"
+            " and items handled by each stage of the export, and print them as a"
+            " table once it is done"
+        ),
+    )
+    parser.add_argument(
+        "--profile-json",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="also write the profile to FILE as JSON. implies --profile",
+    )
+
+
+def add_stats_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options writing statistics of the data and scaling with them."""
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=(
+            "gather the range, mean, non-zero count, percentiles and a histogram of"
+            " the exported data while it is read, and write them next to the output"
+            " in a .stats.json file for building transfer functions"
+        ),
+    )
+    parser.add_argument(
+        "--clip-percentile",
+        type=float,
+        metavar="P",
+        help=(
+            "span the quantized scale from the P-th to the (100-P)-th percentile"
+            " of the non-zero values instead of the full range, clamping the"
+            " outliers beyond it so that they do not squeeze the rest of the data"
+            f" into a few levels. P must be in [0, {options.MAX_CLIP_PERCENTILE:g})."
+            " implies --stats"
+        ),
+    )
+
+
+def check_stats_arguments(
+    args: argparse.Namespace, parser: argparse.ArgumentParser
+) -> bool:
+    """validates the statistics options, returns whether to write a sidecar"""
+    if args.clip_percentile is None:
+        return args.stats
+    if not 0 <= args.clip_percentile < options.MAX_CLIP_PERCENTILE:
+        parser.error(
+            f"clipping percentile must be in [0, {options.MAX_CLIP_PERCENTILE:g})"
+        )
+    return True
+
 
-    radiance.export_radiance_image(inpath, outpath, use_var)
+@contextlib.contextmanager
+def profile_export(args: argparse.Namespace) -> Iterator[None]:
+    """Profile the stages of the export run within it if requested, and report
+    them once it has completed."""
+    if not args.profile and args.profile_json is None:
+        yield
+        return
+    profiling.enable()
+    try:
+        yield
+    except BaseException:
+        profiling.disable()
+        raise
+    profile = profiling.disable()
+    if profile is None:
+        return
+    report = profiling.get_report(profile, command=sys.argv)
+    profiling.print_report(report)
+    if args.profile_json is not None:
+        profiling.write_report(args.profile_json.expanduser(), report)
+        print(f"Profile          : {args.profile_json}")
 
 
 def get_parser(is_nrrd: bool = False) -> argparse.ArgumentParser:
@@ -136,16 +589,101 @@ def get_parser(is_nrrd: bool = False) -> argparse.ArgumentParser:
         metavar="FILE",
         help=outfile_help,
     )
+    if is_nrrd:
+        parser.add_argument(
+            "-v",
+            "--variable",
+            type=str,
+            nargs="+",
+            help=(
+                "optionally specify the variable names to convert to a volume. the"
+                " file is read once and, unless --pack is given, each variable is"
+                " written to its own file with the variable name appended."
+                " default is QC"
+            ),
+        )
+    else:
+        parser.add_argument(
+            "-v",
+            "--variable",
+            type=str,
+            help=(
+                "optionally specify the variable name to convert to a point cloud."
+                " default is QC"
+            ),
+        )
+    parser.add_argument(
+        "-m",
+        "--slab-mb",
+        type=int,
+        default=options.DEFAULT_SLAB_BYTES // 2**20,
+        metavar="MB",
+        help=(
+            "memory budget in megabytes for each block of the variable that is read"
+            " from the netCDF file at a time. default is %(default)s"
+        ),
+    )
     parser.add_argument(
-        "-v",
-        "--variable",
+        "-t",
+        "--time",
         type=str,
+        metavar="SPEC",
         help=(
-            "optionally specify the variable name to convert to a point cloud."
-            " default is QC"
+            "timesteps to export from a variable with an nt dimension: a single"
+            " index, 'all', or a start:stop:step range such as 0:120:4. when more"
+            " than one timestep is selected, one file is written per timestep with"
+            " the timestep appended to its name. default is 0"
         ),
     )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        metavar="N",
+        help=(
+            "number of worker processes used when exporting several timesteps."
+            " default is the number of CPUs"
+        ),
+    )
+    parser.add_argument(
+        "--stages",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "run reading, extraction and compression as up to N concurrent stages"
+            " connected by bounded queues, so that they overlap instead of running"
+            " one after another. default is 1, which runs them in sequence"
+        ),
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=pipeline.DEFAULT_QUEUE_DEPTH,
+        metavar="N",
+        help=(
+            "with --stages, number of hyperslabs or blocks that can wait between"
+            " two stages, which bounds memory use. default is"
+            f" {pipeline.DEFAULT_QUEUE_DEPTH}"
+        ),
+    )
+    parser.add_argument(
+        "--lod",
+        type=int,
+        default=0,
+        choices=range(options.MAX_LOD_LEVELS + 1),
+        metavar="LEVELS",
+        help=(
+            "also export up to LEVELS coarser levels of detail, each reduced by a"
+            " further factor of 2 (2x, 4x, 8x), and a .lod.json manifest describing"
+            " them. default is %(default)s"
+        ),
+    )
+    add_region_arguments(parser, "xyz")
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
     if is_nrrd:
+        add_stats_arguments(parser)
         parser.add_argument(
             "-b",
             "--bits",
@@ -155,7 +693,128 @@ def get_parser(is_nrrd: bool = False) -> argparse.ArgumentParser:
                 "are 8 or 16 [bits]. If not provided, exports NRRD as float."
             ),
         )
+        parser.add_argument(
+            "-c",
+            "--crop",
+            action="store_true",
+            help=(
+                "crop the volume to the bounding box of the non-zero data instead of"
+                " a 512 voxel cube. the offset of the cropped volume is stored as the"
+                " space origin in the NRRD header"
+            ),
+        )
+        parser.add_argument(
+            "-e",
+            "--encoding",
+            choices=options.ENCODINGS,
+            default="gzip",
+            help=(
+                "how the NRRD data is stored. pgzip produces a standard gzip stream"
+                " compressed by several threads, detached writes a .nhdr header and"
+                " an uncompressed .raw file. default is %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "-l",
+            "--level",
+            type=int,
+            default=9,
+            help=(
+                "compression level from 1 (fastest) to 9 (smallest) for gzip and"
+                " pgzip encodings. default is %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            metavar="N",
+            help=(
+                "number of threads compressing pgzip data."
+                " default is the number of CPUs"
+            ),
+        )
+        parser.add_argument(
+            "--pooling",
+            choices=options.POOLING_MODES,
+            default="max",
+            help=(
+                "how each 2x2x2 block of voxels is combined in coarser levels of"
+                " detail. default is %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--occupancy",
+            choices=options.OCCUPANCY_MODES,
+            help=(
+                "also write a coarse grid next to the volume for empty space"
+                " skipping: the max value of each block of voxels, or the Chebyshev"
+                " distance in blocks to the nearest block holding data"
+            ),
+        )
+        parser.add_argument(
+            "--occupancy-block",
+            type=int,
+            default=8,
+            metavar="N",
+            help="edge length in voxels of each occupancy grid block. default is 8",
+        )
+        parser.add_argument(
+            "--pack",
+            action="store_true",
+            help=(
+                "pack the variables into the channels of a single volume (RG for 2"
+                f" variables, RGBA for up to {options.MAX_CHANNELS}), with the"
+                " value range of each channel stored in the header"
+            ),
+        )
+        parser.add_argument(
+            "--bricks",
+            type=int,
+            choices=options.BRICK_SIZES,
+            metavar="SIZE",
+            help=(
+                "instead of an NRRD, split the volume into bricks of SIZE^3 voxels"
+                f" ({', '.join(map(str, options.BRICK_SIZES))}) and write only the"
+                " bricks containing data to a .bricks.bin file, indexed by a"
+                " .bricks.json file"
+            ),
+        )
     else:
+        parser.add_argument(
+            "-q",
+            "--quantize",
+            action="store_true",
+            help=(
+                "store point positions as 8- or 16-bit integers with the"
+                " KHR_mesh_quantization extension, instead of as floats"
+            ),
+        )
+        parser.add_argument(
+            "--values",
+            action="store_true",
+            help=(
+                "with --quantize, also store the quantized value of each point in"
+                " the _VALUE vertex attribute so that it can be colormapped"
+            ),
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            help=(
+                "only export points whose value is above THRESHOLD, so that tiny"
+                " values do not add points. default is every non-zero point"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-points",
+            type=int,
+            metavar="N",
+            help=(
+                "sort points along a Morton (Z-order) curve and split them into"
+                " spatially compact chunks of at most N points, each exported as"
+                " its own mesh so that viewers can cull chunks outside the view"
+            ),
+        )
         parser.add_argument(
             "-r",
             "--resource",
@@ -196,16 +855,472 @@ def get_parser_rad() -> argparse.ArgumentParser:
             " default is rad"
         ),
     )
+    parser.add_argument(
+        "-a",
+        "--angles",
+        type=str,
+        metavar="SPEC",
+        help=(
+            "viewing angles to export: 'all', or a comma separated list of indices"
+            " and start:stop:step ranges such as 0,4,8. all angles share one color"
+            " scale, and when more than one is selected the angle index is appended"
+            f" to the name of each image. default is {options.NADIR_ANGLE} (nadir)"
+        ),
+    )
+    parser.add_argument(
+        "--tiles",
+        choices=options.TILE_FORMATS,
+        help=(
+            "instead of a single image, write a pyramid of"
+            f" {options.TILE_SIZE}x{options.TILE_SIZE} tiles in {{z}}/{{x}}/{{y}}"
+            " directories next to the output file, with a .tiles.json file"
+            " describing it, so that viewers can stream only the visible tiles"
+        ),
+    )
+    add_region_arguments(parser, "xy")
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    add_stats_arguments(parser)
     return parser
 
 
+def get_parser_batch() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        metavar="PATH",
+        help="directories or glob patterns of netCDF (.nc) files to convert",
+    )
+    parser.add_argument(
+        "-k",
+        "--kinds",
+        nargs="+",
+        choices=sorted(options.OUTPUT_EXTENSIONS),
+        default=["glb"],
+        help="kinds of output to create for every input. default is glb",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        type=pathlib.Path,
+        metavar="DIR",
+        help="directory to write outputs to. default is next to each input file",
+    )
+    parser.add_argument(
+        "-v",
+        "--variable",
+        type=str,
+        default="QC",
+        help="variable exported to glb, gltf and nrrd outputs. default is QC",
+    )
+    parser.add_argument(
+        "--rad-variable",
+        type=str,
+        default="rad",
+        help="variable exported to png outputs. default is rad",
+    )
+    parser.add_argument(
+        "-b",
+        "--bits",
+        type=int,
+        help=(
+            "Bits of precision to quantize nrrd outputs. Accepted values are 8 or"
+            " 16 [bits]. If not provided, exports NRRD as float."
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        metavar="N",
+        help="number of worker processes. default is the number of CPUs",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=pathlib.Path,
+        metavar="FILE",
+        help=(
+            "manifest of completed conversions used to skip unchanged inputs."
+            f" default is {options.MANIFEST_NAME} in the output directory"
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="convert every input, even if the manifest shows it is up to date",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        type=pathlib.Path,
+        action="append",
+        metavar="DIR",
+        help=(
+            "instead of converting PATH once, keep watching DIR (can be repeated)"
+            " and convert its netCDF files as they are completed, and again"
+            " whenever they change, until interrupted. outputs are written to a"
+            " temporary file and renamed into place, so they are never seen half"
+            " written"
+        ),
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=options.SETTLE_SECONDS,
+        metavar="SECONDS",
+        help=(
+            "with --watch, a file is complete once its size and modification time"
+            " have not changed for SECONDS, or as soon as it is closed where"
+            " inotify is available. default is %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=options.POLL_SECONDS,
+        metavar="SECONDS",
+        help="with --watch, time between scans of DIR. default is %(default)s",
+    )
+    return parser
+
+
+def process_batch(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    from . import batch, watch
+
+    if args.watch is not None:
+        if args.inputs:
+            parser.error("input paths cannot be combined with --watch")
+        for directory in args.watch:
+            if not directory.expanduser().is_dir():
+                parser.error(f"{directory} is not a directory")
+        if args.settle < 0 or args.poll <= 0:
+            parser.error("--settle must not be negative and --poll must be positive")
+    elif not args.inputs:
+        parser.error("provide input paths or --watch directories")
+    else:
+        inpaths = batch.find_inputs(args.inputs)
+        if not inpaths:
+            parser.error("no netCDF files matched the provided inputs")
+
+    outdir = None
+    if args.outdir is not None:
+        outdir = args.outdir.expanduser().resolve()
+        outdir.mkdir(parents=True, exist_ok=True)
+
+    bits = 32
+    if args.bits is not None:
+        if args.bits == 8 or args.bits == 16:
+            bits = args.bits
+        else:
+            parser.error("only 8 or 16 bits are allowed for quantizing data")
+    if args.workers is not None and args.workers < 1:
+        parser.error("at least 1 worker process is required")
+
+    if args.watch is not None:
+        directories = [directory.expanduser() for directory in args.watch]
+        print(f"watching         : {', '.join(map(str, directories))}")
+        print(f"output kinds     : {', '.join(args.kinds)}")
+        converted, failed = watch.watch_directories(
+            directories,
+            args.kinds,
+            outdir,
+            args.variable,
+            args.rad_variable,
+            bits,
+            args.workers,
+            args.manifest,
+            args.force,
+            args.settle,
+            args.poll,
+        )
+        print(f"\nConverted {converted}, {failed} failed or unfinished")
+        return
+
+    print(f"input files      : {len(inpaths)}")
+    print(f"output kinds     : {', '.join(args.kinds)}")
+    converted, skipped, failed = batch.run_batch(
+        inpaths,
+        args.kinds,
+        outdir,
+        args.variable,
+        args.rad_variable,
+        bits,
+        args.workers,
+        args.manifest,
+        args.force,
+    )
+    print(f"\nConverted {converted}, skipped {skipped} up to date, {failed} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+def get_parser_bench() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        nargs="+",
+        choices=list(options.SIZE_TIERS),
+        default=["small"],
+        help="size tiers of the synthetic inputs to benchmark. default is small",
+    )
+    parser.add_argument(
+        "-k",
+        "--benchmarks",
+        nargs="+",
+        choices=options.BENCHMARKS,
+        default=list(options.BENCHMARKS),
+        metavar="NAME",
+        help=f"functions to benchmark, any of {', '.join(options.BENCHMARKS)}."
+        " default is all of them",
+    )
+    parser.add_argument(
+        "-t",
+        "--timesteps",
+        type=int,
+        default=1,
+        metavar="N",
+        help="length of the nt dimension of the synthetic LES files. default is 1",
+    )
+    parser.add_argument(
+        "-d",
+        "--dims",
+        type=str,
+        default=",".join(options.DEFAULT_DIMENSIONS),
+        metavar="ORDER",
+        help=(
+            "comma separated order of the dimensions of the cloud variable, a"
+            " permutation of nx, ny, nz and optionally nt."
+            f" default is {','.join(options.DEFAULT_DIMENSIONS)}"
+        ),
+    )
+    parser.add_argument(
+        "--sparsity",
+        type=float,
+        default=options.DEFAULT_SPARSITY,
+        metavar="FRACTION",
+        help=(
+            "fraction of voxels holding cloud in the synthetic LES files."
+            f" default is {options.DEFAULT_SPARSITY}"
+        ),
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=3,
+        metavar="N",
+        help="number of timed runs of each benchmark, the fastest is kept. default"
+        " is 3",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="write the results to FILE as JSON",
+    )
+    parser.add_argument(
+        "-l",
+        "--label",
+        type=str,
+        help="name stored with the results to identify the run, such as a commit",
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        type=pathlib.Path,
+        metavar="FILE",
+        help=(
+            "results file of an earlier run to compare against. exits with an error"
+            " if a benchmark became slower than allowed by --tolerance"
+        ),
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="with --compare, allowed relative increase in time. default is 0.1",
+    )
+    parser.add_argument(
+        "-w",
+        "--workdir",
+        type=pathlib.Path,
+        metavar="DIR",
+        help=(
+            "directory to keep the synthetic inputs and exported files in. default"
+            " is a temporary directory that is removed afterwards"
+        ),
+    )
+    return parser
+
+
+def process_bench(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    from . import bench
+
+    dimensions = [dim.strip() for dim in args.dims.split(",")]
+    spatial = [dim for dim in dimensions if dim != "nt"]
+    if sorted(spatial) != ["nx", "ny", "nz"] or len(dimensions) - len(spatial) > 1:
+        parser.error("--dims must be a permutation of nx, ny, nz and optionally nt")
+    if args.timesteps < 1:
+        parser.error("at least 1 timestep is required")
+    if not 0 < args.sparsity <= 1:
+        # The exporters expect at least one cloudy voxel
+        parser.error("--sparsity must be above 0 and at most 1")
+    if args.repeat < 1:
+        parser.error("at least 1 timed run is required")
+    baseline = None
+    if args.compare is not None:
+        try:
+            baseline = bench.load_results(args.compare.expanduser())
+        except (OSError, ValueError) as err:
+            parser.error(f"could not read results to compare against: {err}")
+
+    print(f"dimensions       : {','.join(dimensions)}, {args.timesteps} timesteps")
+    print(f"sparsity         : {args.sparsity}")
+    with contextlib.ExitStack() as stack:
+        if args.workdir is None:
+            workdir = pathlib.Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        else:
+            workdir = args.workdir.expanduser().resolve()
+            workdir.mkdir(parents=True, exist_ok=True)
+        results: list[bench.Result] = []
+        for tier in args.sizes:
+            results += bench.run_tier(
+                workdir,
+                tier,
+                args.benchmarks,
+                args.timesteps,
+                dimensions,
+                args.sparsity,
+                args.repeat,
+            )
+
+    if args.outfile is not None:
+        bench.write_results(
+            args.outfile.expanduser(),
+            results,
+            args.label,
+            dimensions=dimensions,
+            timesteps=args.timesteps,
+            sparsity=args.sparsity,
+            repeat=args.repeat,
+        )
+        print(f"Results          : {args.outfile}")
+    if baseline is not None:
+        print()
+        regressions = bench.compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks regressed")
+            raise SystemExit(1)
+
+
+def get_parser_serve() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r",
+        "--root",
+        type=pathlib.Path,
+        default=pathlib.Path.cwd(),
+        metavar="DIR",
+        help=(
+            "directory holding the netCDF files to serve, requests name files"
+            " relative to it. default is the current directory"
+        ),
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=options.DEFAULT_HOST,
+        help="address to listen on. default is %(default)s",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=options.DEFAULT_PORT,
+        help="TCP port to listen on, 0 picks a free one. default is %(default)s",
+    )
+    parser.add_argument(
+        "-u",
+        "--socket",
+        type=pathlib.Path,
+        metavar="PATH",
+        help="listen on a Unix socket at this path instead of a TCP port",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-mb",
+        type=int,
+        default=options.DEFAULT_MEMORY_BYTES // 2**20,
+        metavar="MB",
+        help=(
+            "memory for decoded variables kept between requests, the least"
+            " recently used ones are dropped past it. default is %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--max-open",
+        type=int,
+        default=options.DEFAULT_OPEN_DATASETS,
+        metavar="N",
+        help=(
+            "number of netCDF files kept open between requests."
+            " default is %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--slab-mb",
+        type=int,
+        default=options.DEFAULT_SLAB_BYTES // 2**20,
+        metavar="MB",
+        help=(
+            "memory budget for each hyperslab read from a netCDF file, in megabytes."
+            " default is %(default)s"
+        ),
+    )
+    return parser
+
+
+def process_serve(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    from . import server
+
+    root = args.root.expanduser().resolve()
+    if not root.is_dir():
+        parser.error("root must be a directory")
+    if args.memory_mb < 1:
+        parser.error("memory budget must be at least 1 MB")
+    if args.max_open < 1:
+        parser.error("at least 1 open file is required")
+    if args.slab_mb < 1:
+        parser.error("slab memory budget must be at least 1 MB")
+    if args.socket is not None and sys.platform == "win32":
+        parser.error("Unix sockets are not supported on this platform")
+    socket_path = None
+    if args.socket is not None:
+        socket_path = args.socket.expanduser().resolve()
+        if socket_path.exists() and not socket_path.is_socket():
+            parser.error("socket path exists and is not a socket")
+
+    print(f"served directory : {root}")
+    print(f"memory budget    : {args.memory_mb} MB")
+    service = server.ExportService(
+        root, args.memory_mb * 2**20, args.max_open, args.slab_mb * 2**20
+    )
+    server.serve(service, args.host, args.port, socket_path)
+
+
 def main() -> None:
     """Process config and CLI arguments then initiate processing."""
     parser = get_parser()
     args = parser.parse_args()
     args.bits = None
 
-    process_file(args, parser)
+    with profile_export(args):
+        process_file(args, parser)
 
 
 def main_nrrd() -> None:
@@ -213,11 +1328,37 @@ def main_nrrd() -> None:
     parser = get_parser(is_nrrd=True)
     args = parser.parse_args()
 
-    process_file(args, parser, is_nrrd=True)
+    with profile_export(args):
+        process_file(args, parser, is_nrrd=True)
 
 
 def main_rad() -> None:
     parser = get_parser_rad()
     args = parser.parse_args()
 
-    process_file_rad(args, parser)
+    with profile_export(args):
+        process_file_rad(args, parser)
+
+
+def main_batch() -> None:
+    """Convert a directory or glob of netCDF files, skipping unchanged inputs."""
+    parser = get_parser_batch()
+    args = parser.parse_args()
+
+    process_batch(args, parser)
+
+
+def main_bench() -> None:
+    """Benchmark the conversion functions on synthetic netCDF files."""
+    parser = get_parser_bench()
+    args = parser.parse_args()
+
+    process_bench(args, parser)
+
+
+def main_serve() -> None:
+    """Serve exports over HTTP, keeping decoded variables between requests."""
+    parser = get_parser_serve()
+    args = parser.parse_args()
+
+    process_serve(args, parser)
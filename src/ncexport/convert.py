@@ -1,81 +1,508 @@
+import concurrent.futures
+import contextlib
+from dataclasses import dataclass
+import functools
 import gltflib
+import io
+import itertools
+import math
 import netCDF4
-import nrrd
 import numpy as np
 import numpy.typing as npt
 import pathlib
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from . import arraycache, lod, morton, nrrdio, occupancy, profiling, stats
+from .arraycache import ArrayCache
+from .nrrdio import NrrdEncoding
+from .occupancy import OccupancyGrid
+from .options import DEFAULT_SLAB_BYTES, GRID_SPACING
+from .pipeline import Pipeline, run_pipeline
+from .stats import StreamingStats
 
 # Open3D dependency removed until further notice
 # import open3d as o3d
 
 
-def parse_netcdf(nc_file: pathlib.Path, variable: str) -> npt.NDArray[np.float_]:
+Slab = tuple[int, npt.NDArray[np.float_]]
+"""A z offset and a block of variable data in (x, y, z) order starting at that z."""
+
+Region = tuple[tuple[int, int], ...]
+"""Start and stop (exclusive) index along each axis of a variable, x first."""
+
+
+class NonzeroData(NamedTuple):
+    """Sparse representation of one timestep of a variable."""
+
+    points: npt.NDArray[np.int16 | np.int32]
+    """N-by-3 array of the [x, y, z] index of each non-zero point"""
+    values: npt.NDArray[np.float_]
+    """data value at each of the N points"""
+    min_val: np.float_
+    """minimum of all data in the variable, including zeros"""
+    max_val: np.float_
+    """maximum of all data in the variable, including zeros"""
+    shape: tuple[int, int, int]
+    """(x, y, z) shape of the variable"""
+
+
+def get_xyz_axes(dimensions: tuple[str, ...]) -> tuple[int, int, int]:
+    """
+    Determine the transpose order that puts a variable into (x, y, z) order once its
+    time dimension (nt), if present, has been indexed away.
+
+    :param dimensions: dimension names of the netCDF variable
+    :returns: axes argument for np.transpose
+    :raises: ValueError if the dimensions in the variable are not named as expected
+    :raises: TypeError if the variable has more than 4 dimensions
+    """
+    if len(dimensions) > 4:
+        raise TypeError("unable to handle netCDF files with > 4 dimensions")
+    if len(dimensions) == 4 and "nt" not in dimensions:
+        raise ValueError("expected the 4th dimension of the variable to be nt")
+    spatial = tuple(dim for dim in dimensions if dim != "nt")
+    return (spatial.index("nx"), spatial.index("ny"), spatial.index("nz"))
+
+
+def get_xyz_shape(qcvar: netCDF4.Variable) -> tuple[int, int, int]:
+    """(x, y, z) shape of one timestep of a netCDF variable"""
+    sizes = dict(zip(qcvar.dimensions, qcvar.shape))
+    return sizes["nx"], sizes["ny"], sizes["nz"]
+
+
+def get_variable_shape(nc_file: pathlib.Path, variable: str) -> tuple[int, int, int]:
+    """(x, y, z) shape of one timestep of a variable in a netCDF file"""
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        return get_xyz_shape(rootgrp.variables[variable])
+
+
+def get_region_box(
+    region: Region,
+) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """index of the first voxel of a 3-dimensional region and its (x, y, z) size"""
+    (x0, x1), (y0, y1), (z0, z1) = region
+    return (x0, y0, z0), (x1 - x0, y1 - y0, z1 - z0)
+
+
+def get_region_selection(region: Region | None) -> str:
+    """describes a region as start:stop ranges, e.g. to tell cached arrays apart"""
+    if region is None:
+        return ""
+    return ",".join(f"{start}:{stop}" for start, stop in region)
+
+
+def parse_bound(text: str, spacing: float, rounding: Callable[[float], int]) -> int:
+    """grid index of a bound given as an index, or in metres with an m suffix, in
+    which case it is rounded to a whole grid cell with the given function"""
+    if text.endswith("m"):
+        return rounding(float(text[:-1]) / spacing)
+    return int(text)
+
+
+def parse_bbox(
+    spec: str, shape: tuple[int, ...], spacing: float | None = None
+) -> Region:
+    """
+    Expand a bounding box into the start and stop index along each axis. The box
+    is a comma separated list of start:stop ranges, x first, in grid indices or
+    in metres with an m suffix, e.g. "100:300,2000m:6000m". A range with an
+    omitted bound extends to the edge of the grid, and axes that are left out are
+    not limited. Ranges in metres are widened to whole grid cells, and stops past
+    the edge of the grid are clamped to it.
+
+    :param spec: bounding box, e.g. from the --bbox option
+    :param shape: size of the grid along each axis, x first
+    :param spacing: size of a grid cell in metres, GRID_SPACING if omitted
+    :returns: (start, stop) index of the box along each axis
+    :raises: ValueError if the box is malformed or empty along any axis
+    """
+    if spacing is None:
+        spacing = GRID_SPACING
+    parts = spec.split(",")
+    if len(parts) > len(shape):
+        raise ValueError(f"expected at most {len(shape)} ranges")
+    region: list[tuple[int, int]] = []
+    for axis, size in enumerate(shape):
+        part = parts[axis] if axis < len(parts) else ":"
+        fields = part.split(":")
+        if len(fields) != 2:
+            raise ValueError(f"expected a start:stop range, got '{part}'")
+        start = parse_bound(fields[0], spacing, math.floor) if fields[0] else 0
+        stop = parse_bound(fields[1], spacing, math.ceil) if fields[1] else size
+        if start < 0 or stop < 0:
+            raise ValueError("bounds must not be negative")
+        stop = min(stop, size)
+        if start >= stop:
+            raise ValueError(f"range '{part}' is empty")
+        region.append((start, stop))
+    return tuple(region)
+
+
+def get_slab_depth(
+    qcvar: netCDF4.Variable, slab_bytes: int, region: Region | None = None
+) -> int:
+    """
+    Number of z levels to read at a time so that a single hyperslab of one timestep
+    fits within slab_bytes. If the variable is chunked along nz, the depth is rounded
+    to a whole number of chunks so that no chunk is decompressed twice.
+
+    :param qcvar: netCDF variable that will be read
+    :param slab_bytes: memory budget for one hyperslab
+    :param region: optional (x, y, z) index ranges that will be read, so that a
+    hyperslab of a small region can span more z levels
+    :returns: number of z levels per hyperslab, at least 1
+    """
+    dimensions = qcvar.dimensions
+    nz = dimensions.index("nz")
+    plane_bytes = qcvar.dtype.itemsize
+    for dim, size in zip(dimensions, qcvar.shape):
+        if dim not in ("nz", "nt"):
+            plane_bytes *= size
+    if region is not None:
+        (x0, x1), (y0, y1) = region[:2]
+        plane_bytes = qcvar.dtype.itemsize * (x1 - x0) * (y1 - y0)
+    depth = max(1, slab_bytes // plane_bytes)
+    chunking = qcvar.chunking()
+    if not isinstance(chunking, str):
+        z_chunk = chunking[nz]
+        depth = max(z_chunk, depth // z_chunk * z_chunk)
+    return min(depth, qcvar.shape[nz])
+
+
+def iter_variable_slabs(
+    qcvar: netCDF4.Variable,
+    timestep: int = 0,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    region: Region | None = None,
+) -> Iterator[Slab]:
+    """
+    Read a single timestep of an open netCDF variable as a sequence of hyperslabs
+    along nz. Only one hyperslab is held in memory at a time. With a region, only
+    the hyperslabs of that region are read, so the amount of data read scales with
+    the size of the region.
+
+    :param qcvar: netCDF variable to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variable, z offsets are then relative to the start of the region
+    :returns: generator of (z offset, data in xyz order) pairs
+    :raises: ValueError if the dimensions in the variable are not named as expected
+    :raises: TypeError if the variable has more than 4 dimensions
+    """
+    dimensions = qcvar.dimensions
+    axes = get_xyz_axes(dimensions)
+    nz = dimensions.index("nz")
+    if region is None:
+        region = tuple((0, size) for size in get_xyz_shape(qcvar))
+    index: list[int | slice] = [slice(None)] * len(dimensions)
+    for dim, (start, stop) in zip(("nx", "ny"), region):
+        index[dimensions.index(dim)] = slice(start, stop)
+    if "nt" in dimensions:
+        index[dimensions.index("nt")] = timestep
+    depth = get_slab_depth(qcvar, slab_bytes, region)
+    zstart, zstop = region[2]
+    for z0 in range(zstart, zstop, depth):
+        index[nz] = slice(z0, min(z0 + depth, zstop))
+        with profiling.stage("read netCDF") as counts:
+            data = np.asarray(qcvar[tuple(index)])
+            counts.bytes_read = data.nbytes
+            counts.items = data.size
+        yield z0 - zstart, np.transpose(data, axes)
+
+
+def iter_array_slabs(
+    array: npt.NDArray[np.float_], slab_bytes: int = DEFAULT_SLAB_BYTES
+) -> Iterator[Slab]:
+    """
+    Split an (x, y, z) array, such as a memory mapped cached array, into the same
+    kind of hyperslabs along z as iter_variable_slabs, without copying them.
+
+    :param array: data in xyz order
+    :param slab_bytes: memory budget for one hyperslab
+    :returns: generator of (z offset, data in xyz order) pairs
+    """
+    plane_bytes = array.shape[0] * array.shape[1] * array.dtype.itemsize
+    depth = max(1, slab_bytes // plane_bytes)
+    for z0 in range(0, array.shape[2], depth):
+        yield z0, array[:, :, z0 : z0 + depth]
+
+
+def read_netcdf_slabs(
+    nc_file: pathlib.Path,
+    variable: str,
+    timestep: int = 0,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+    rootgrp: netCDF4.Dataset | None = None,
+) -> Iterator[Slab]:
+    """
+    Open a netCDF file and stream one timestep of a variable as hyperslabs in
+    (x, y, z) order. The dataset is closed once the generator is exhausted or closed.
+    With a cache, a previously decoded copy of the timestep is used instead of the
+    netCDF file if there is one, otherwise one is stored while reading. A region is
+    cached separately from the whole variable. Several variables of a file can be
+    read from one open dataset by passing it as rootgrp.
+
+    :param nc_file: netCDF4 file to read
+    :param variable: the variable to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param cache: optional cache of decoded variables
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variable, z offsets are then relative to the start of the region
+    :param rootgrp: optional open dataset of nc_file to read from, which is left
+    open, instead of opening the file
+    :returns: generator of (z offset, data in xyz order) pairs
+    :raises: KeyError if the variable keyword does not exist in the netCDF database
+    :raises: ValueError if the dimensions in the variable are not named as expected
+    :raises: TypeError if the variable has more than 4 dimensions
+    """
+    key = None
+    if cache is not None:
+        selection = f"t{timestep}" + get_region_selection(region)
+        key = arraycache.get_cache_key(nc_file, variable, selection)
+        cached = arraycache.load_array(cache, key)
+        if cached is not None:
+            yield from iter_array_slabs(cached, slab_bytes)
+            return
+    if rootgrp is None:
+        opened = netCDF4.Dataset(nc_file, "r")
+    else:
+        opened = contextlib.nullcontext(rootgrp)
+    with opened as dataset:
+        qcvar = dataset.variables[variable]
+        slabs = iter_variable_slabs(qcvar, timestep, slab_bytes, region)
+        if cache is not None and key is not None:
+            shape = get_xyz_shape(qcvar)
+            if region is not None:
+                shape = get_region_box(region)[1]
+            slabs = arraycache.store_slabs(
+                cache, key, slabs, shape, np.dtype(qcvar.dtype)
+            )
+        yield from slabs
+
+
+def parse_netcdf(
+    nc_file: pathlib.Path,
+    variable: str,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+) -> npt.NDArray[np.float_]:
     """
     Read in a netCDF file, handle the 4th dimension, if present, and then transpose
-    the data into a standard (x, y, z) dimension ordering.
+    the data into a standard (x, y, z) dimension ordering. Only the first timestep is
+    read from the file, one hyperslab at a time. With a region, only that hyperslab
+    of the variable is read and returned.
 
     :param nc_file: netCDF4 file to convert to a 3D object/texture
     :params variable: the variable to export to a 3D object/texture
+    :params slab_bytes: memory budget for one hyperslab read
+    :params cache: optional cache of decoded variables, if the variable is cached a
+    read-only memory map of it is returned
+    :params region: optional (x, y, z) index ranges to read instead of the whole
+    variable
     :returns: numpy ndarray containing data from the variable in xyz order
     :raises: KeyError if the variable keyword does not exist in the netCDF database
     :raises: ValueError if the dimensions in the variable are not named as expected
     :raises: TypeError if the variable has more than 4 dimensions
     """
-    rootgrp = netCDF4.Dataset(nc_file, "r")
-    qcvar = rootgrp.variables[variable]
-    qcarr = np.array(qcvar)
-    dimensions = qcvar.dimensions
-    nx = dimensions.index("nx")
-    ny = dimensions.index("ny")
-    nz = dimensions.index("nz")
+    if cache is not None:
+        selection = "t0" + get_region_selection(region)
+        key = arraycache.get_cache_key(nc_file, variable, selection)
+        cached = arraycache.load_array(cache, key)
+        if cached is not None:
+            return cached
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        qcvar = rootgrp.variables[variable]
+        shape = get_xyz_shape(qcvar)
+        if region is not None:
+            shape = get_region_box(region)[1]
+        qcarr = np.empty(shape, dtype=qcvar.dtype, order="F")
+        for z0, slab in iter_variable_slabs(qcvar, 0, slab_bytes, region):
+            # The transposed hyperslab is a view, copying it does the transpose
+            with profiling.stage("transpose") as counts:
+                qcarr[:, :, z0 : z0 + slab.shape[2]] = slab
+                counts.items = slab.size
+    if cache is not None:
+        arraycache.store_array(cache, key, qcarr)
+    return qcarr
+
+
+def get_timestep_count(nc_file: pathlib.Path, variable: str) -> int:
+    """
+    Number of timesteps (length of the nt dimension) in a netCDF variable, or 1 if
+    the variable has no time dimension.
+
+    :param nc_file: netCDF4 file to inspect
+    :param variable: the variable to inspect
+    :returns: number of timesteps that can be exported
+    :raises: KeyError if the variable keyword does not exist in the netCDF database
+    """
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        qcvar = rootgrp.variables[variable]
+        if "nt" not in qcvar.dimensions:
+            return 1
+        return qcvar.shape[qcvar.dimensions.index("nt")]
+
+
+def get_value_range(
+    nc_file: pathlib.Path,
+    variable: str,
+    timestep: int = 0,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+) -> tuple[np.float_, np.float_]:
+    """
+    Min and max of one timestep of a variable, read one hyperslab at a time.
+
+    :param nc_file: netCDF4 file to read
+    :param variable: the variable to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param cache: optional cache of decoded variables
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variable
+    :returns: tuple of the min and max value
+    """
+    slabs = read_netcdf_slabs(nc_file, variable, timestep, slab_bytes, cache, region)
+    extrema = [(np.min(slab), np.max(slab)) for _, slab in slabs]
+    return min(lo for lo, _ in extrema), max(hi for _, hi in extrema)
+
+
+def get_value_stats(
+    nc_file: pathlib.Path,
+    variable: str,
+    timestep: int = 0,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+) -> StreamingStats:
+    """
+    Statistics of one timestep of a variable, read one hyperslab at a time, for
+    when percentiles are needed as well as the range, see get_value_range.
+
+    :param nc_file: netCDF4 file to read
+    :param variable: the variable to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param cache: optional cache of decoded variables
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variable
+    :returns: statistics of the timestep
+    """
+    value_stats = StreamingStats()
+    slabs = read_netcdf_slabs(nc_file, variable, timestep, slab_bytes, cache, region)
+    for _, slab in slabs:
+        with profiling.stage("statistics") as counts:
+            value_stats.update(slab)
+            counts.items = slab.size
+    return value_stats
 
-    if len(dimensions) == 4:
-        # Assume the extra dimension is time (nt) and use the 0th index
-        nt = dimensions.index("nt")
-        qcarr = np.take(qcarr, indices=0, axis=nt)
-        if nt < nx:
-            nx -= 1
-        if nt < ny:
-            ny -= 1
-        if nt < nz:
-            nz -= 1
-    elif len(dimensions) > 4:
-        raise TypeError("unable to handle netCDF files with > 4 dimensions")
 
-    return np.transpose(qcarr, (nx, ny, nz))
+def get_timestep_path(path: pathlib.Path, timestep: int) -> pathlib.Path:
+    """appends a zero-padded timestep to the stem of a filepath"""
+    return path.with_name(f"{path.stem}_t{timestep:04d}{path.suffix}")
 
 
 def create_gltf_model(
     modelpath: pathlib.Path,
-    pointarray: npt.NDArray[np.int_],
+    pointarray: npt.NDArray[np.integer[Any] | np.float32],
     resource: str = "vertices.bin",
+    chunks: list[morton.Chunk] | None = None,
 ) -> None:
     """
     Create a glb or gltf format 3D object from the provided array of points. The
     resource file argument, if provided, is a binary file that will be created by
     the gltf module to store the vertex data (only used when exporting as gltf).
+    See get_gltf_model for the layout of the model.
 
     :param modelpath: output filepath to store the glb/gltf model
     :param pointarray: numpy array of vertices
     :param resource: optionally specify binary output file when exporting gltf
+    :param chunks: optional (start, end) ranges of pointarray to export separately
     :returns: none, side effect: a glb or gltf format file (and optionally .bin file)
     are saved at the specified location(s)
     """
+    gltf = get_gltf_model(pointarray, resource, chunks)
+    export_gltf_model(gltf, modelpath, resource, len(pointarray))
+
+
+def export_gltf_model(
+    gltf: gltflib.gltf.GLTF, modelpath: pathlib.Path, resource: str, point_count: int
+) -> None:
+    """writes a model to a glb or gltf file, chosen by the extension of modelpath,
+    along with its resource file when writing gltf"""
+    with profiling.stage("write glTF") as counts:
+        gltf.export(str(modelpath))
+        counts.bytes_written = profiling.get_file_bytes(
+            modelpath, modelpath.with_name(resource)
+        )
+        counts.items = point_count
+
+
+def get_glb_bytes(gltf: gltflib.gltf.GLTF) -> bytes:
+    """encodes a model as the contents of a glb file, without writing any file"""
+    stream = io.BytesIO()
+    gltf.write_glb(stream, save_file_resources=False)
+    return stream.getvalue()
+
+
+def get_gltf_model(
+    pointarray: npt.NDArray[np.integer[Any] | np.float32],
+    resource: str = "vertices.bin",
+    chunks: list[morton.Chunk] | None = None,
+) -> gltflib.gltf.GLTF:
+    """
+    Build a point cloud model from the provided array of points, with the vertex
+    data held in memory. If chunks are provided, each chunk of points becomes its
+    own mesh and node, with the bounds of its accessor computed from its own
+    points.
+
+    :param pointarray: numpy array of vertices
+    :param resource: name of the binary file holding the vertex data, if the
+    model is exported as gltf
+    :param chunks: optional (start, end) ranges of pointarray to export separately
+    :returns: the model, see export_gltf_model and get_glb_bytes
+    """
+    if len(pointarray) == 0:
+        return get_empty_gltf_model()
     vertex_data = create_vertex_buffer(pointarray)
-    model = gltflib.GLTFModel(
-        asset=gltflib.Asset(version="2.0"),
-        scenes=[gltflib.Scene(nodes=[0])],
-        nodes=[gltflib.Node(mesh=0)],
-        meshes=[
+    if chunks is None:
+        chunks = [(0, len(pointarray))]
+    accessors: list[gltflib.Accessor] = []
+    meshes: list[gltflib.Mesh] = []
+    for i, (start, end) in enumerate(chunks):
+        chunk = pointarray[start:end]
+        accessors.append(
+            gltflib.Accessor(
+                bufferView=0,
+                byteOffset=start * 3 * 4,
+                componentType=gltflib.ComponentType.FLOAT.value,
+                count=len(chunk),
+                type=gltflib.AccessorType.VEC3.value,
+                min=chunk.min(axis=0).astype(np.float32).tolist(),
+                max=chunk.max(axis=0).astype(np.float32).tolist(),
+            )
+        )
+        meshes.append(
             gltflib.Mesh(
                 primitives=[
                     gltflib.Primitive(
-                        attributes=gltflib.Attributes(POSITION=0),
+                        attributes=gltflib.Attributes(POSITION=i),
                         mode=0,  # mode 0 corresponds to POINTS
                     )
                 ]
             )
-        ],
+        )
+    model = gltflib.GLTFModel(
+        asset=gltflib.Asset(version="2.0"),
+        scenes=[gltflib.Scene(nodes=list(range(len(chunks))))],
+        nodes=[gltflib.Node(mesh=i) for i in range(len(chunks))],
+        meshes=meshes,
         buffers=[gltflib.Buffer(byteLength=len(vertex_data), uri=resource)],
         bufferViews=[
             gltflib.BufferView(
@@ -85,45 +512,413 @@ def create_gltf_model(
                 target=gltflib.BufferTarget.ARRAY_BUFFER.value,
             )
         ],
-        accessors=[
+        accessors=accessors,
+    )
+
+    file_resource = gltflib.gltf_resource.FileResource(resource, data=vertex_data)
+    return gltflib.gltf.GLTF(model=model, resources=[file_resource])
+
+
+def get_empty_gltf_model() -> gltflib.gltf.GLTF:
+    """model of a point cloud without any points, such as when a threshold or
+    region selects only clear air: a single scene with no nodes and no buffers"""
+    model = gltflib.GLTFModel(
+        asset=gltflib.Asset(version="2.0"), scenes=[gltflib.Scene()]
+    )
+    return gltflib.gltf.GLTF(model=model, resources=[])
+
+
+@dataclass
+class ValueAttributes(gltflib.Attributes):
+    """Primitive attributes, plus a custom attribute holding the data value."""
+
+    _VALUE: Optional[int] = None
+
+
+def create_quantized_gltf_model(
+    modelpath: pathlib.Path,
+    pointarray: npt.NDArray[np.integer[Any] | np.float32],
+    resource: str = "vertices.bin",
+    values: npt.NDArray[np.float_] | None = None,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    scale: float = 1.0,
+    offset: tuple[float, float, float] = (0.0, 0.0, 0.0),
+    chunks: list[morton.Chunk] | None = None,
+) -> None:
+    """
+    Create a glb or gltf point cloud with integer vertex positions, see
+    get_quantized_gltf_model.
+
+    :param modelpath: output filepath to store the glb/gltf model
+    :param pointarray: numpy array of integer valued vertices
+    :param resource: optionally specify binary output file when exporting gltf
+    :param values: optional data value of each vertex
+    :param value_range: data values mapped to 0 and 1, defaults to min/max of values
+    :param scale: size of a grid cell in the output coordinates
+    :param offset: position of grid index [0, 0, 0] in the output coordinates
+    :param chunks: optional (start, end) ranges of pointarray to export separately
+    :returns: none, side effect: a glb or gltf format file (and optionally .bin file)
+    are saved at the specified location(s)
+    """
+    gltf = get_quantized_gltf_model(
+        pointarray, resource, values, value_range, scale, offset, chunks
+    )
+    export_gltf_model(gltf, modelpath, resource, len(pointarray))
+
+
+def get_quantized_gltf_model(
+    pointarray: npt.NDArray[np.integer[Any] | np.float32],
+    resource: str = "vertices.bin",
+    values: npt.NDArray[np.float_] | None = None,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    scale: float = 1.0,
+    offset: tuple[float, float, float] = (0.0, 0.0, 0.0),
+    chunks: list[morton.Chunk] | None = None,
+) -> gltflib.gltf.GLTF:
+    """
+    Build a point cloud model with integer vertex positions, using the
+    KHR_mesh_quantization extension. Positions are stored relative to their minimum
+    as uint8 if they span at most 256 grid cells, otherwise as uint16, and the node
+    transform restores the original coordinates. Each vertex is padded to 4
+    components, and if values are provided the padding holds the quantized value
+    as the normalized custom attribute _VALUE, which shaders can colormap. If
+    chunks are provided, each chunk of points becomes its own mesh and node and is
+    quantized relative to its own minimum, so compact chunks often fit in uint8.
+
+    :param pointarray: numpy array of integer valued vertices
+    :param resource: name of the binary file holding the vertex data, if the
+    model is exported as gltf
+    :param values: optional data value of each vertex
+    :param value_range: data values mapped to 0 and 1, defaults to min/max of values
+    :param scale: size of a grid cell in the output coordinates
+    :param offset: position of grid index [0, 0, 0] in the output coordinates
+    :param chunks: optional (start, end) ranges of pointarray to export separately
+    :returns: the model, see export_gltf_model and get_glb_bytes
+    """
+    if len(pointarray) == 0:
+        return get_empty_gltf_model()
+    if chunks is None:
+        chunks = [(0, len(pointarray))]
+    if values is not None and value_range is None:
+        value_range = (values.min(), values.max())
+    blocks: list[bytes] = []
+    buffer_views: list[gltflib.BufferView] = []
+    accessors: list[gltflib.Accessor] = []
+    meshes: list[gltflib.Mesh] = []
+    nodes: list[gltflib.Node] = []
+    byte_offset = 0
+    for start, end in chunks:
+        chunk = pointarray[start:end]
+        low = chunk.min(axis=0)
+        local = chunk - low
+        high = local.max(axis=0)
+        if high.max() <= 255:
+            dt = np.uint8
+            component_type = gltflib.ComponentType.UNSIGNED_BYTE.value
+        else:
+            dt = np.uint16
+            component_type = gltflib.ComponentType.UNSIGNED_SHORT.value
+        itemsize = np.dtype(dt).itemsize
+
+        # Vertex attributes must be 4 byte aligned, so 3 component positions are
+        # padded to 4 components and the spare component is used for the value
+        vertices = np.zeros((len(chunk), 4), dtype=dt)
+        vertices[:, :3] = local
+        view = len(buffer_views)
+        attributes = ValueAttributes(POSITION=len(accessors))
+        accessors.append(
             gltflib.Accessor(
-                bufferView=0,
+                bufferView=view,
                 byteOffset=0,
-                componentType=gltflib.ComponentType.FLOAT.value,
-                count=len(pointarray),
+                componentType=component_type,
+                count=len(chunk),
                 type=gltflib.AccessorType.VEC3.value,
-                min=pointarray.min(axis=0).tolist(),
-                max=pointarray.max(axis=0).tolist(),
+                min=[0, 0, 0],
+                max=high.tolist(),
             )
-        ],
+        )
+        if values is not None and value_range is not None:
+            levels = np.iinfo(dt).max
+            vertices[:, 3] = quantize_array(
+                values[start:end], value_range[0], value_range[1], levels
+            )
+            attributes._VALUE = len(accessors)
+            accessors.append(
+                gltflib.Accessor(
+                    bufferView=view,
+                    byteOffset=3 * itemsize,
+                    componentType=component_type,
+                    normalized=True,
+                    count=len(chunk),
+                    type=gltflib.AccessorType.SCALAR.value,
+                    min=[int(vertices[:, 3].min())],
+                    max=[int(vertices[:, 3].max())],
+                )
+            )
+        # Every vertex is 4 or 8 bytes, so each block keeps the next one aligned
+        blocks.append(vertices.tobytes())
+        buffer_views.append(
+            gltflib.BufferView(
+                buffer=0,
+                byteOffset=byte_offset,
+                byteLength=len(blocks[-1]),
+                byteStride=4 * itemsize,
+                target=gltflib.BufferTarget.ARRAY_BUFFER.value,
+            )
+        )
+        byte_offset += len(blocks[-1])
+        meshes.append(
+            gltflib.Mesh(
+                primitives=[
+                    gltflib.Primitive(
+                        attributes=attributes,
+                        mode=0,  # mode 0 corresponds to POINTS
+                    )
+                ]
+            )
+        )
+        nodes.append(
+            gltflib.Node(
+                mesh=len(nodes),
+                translation=(low * scale + np.array(offset)).tolist(),
+                scale=[scale] * 3 if scale != 1 else None,
+            )
+        )
+    vertex_data = b"".join(blocks)
+
+    model = gltflib.GLTFModel(
+        asset=gltflib.Asset(version="2.0"),
+        extensionsUsed=["KHR_mesh_quantization"],
+        extensionsRequired=["KHR_mesh_quantization"],
+        scenes=[gltflib.Scene(nodes=list(range(len(nodes))))],
+        nodes=nodes,
+        meshes=meshes,
+        buffers=[gltflib.Buffer(byteLength=len(vertex_data), uri=resource)],
+        bufferViews=buffer_views,
+        accessors=accessors,
     )
 
     file_resource = gltflib.gltf_resource.FileResource(resource, data=vertex_data)
-    gltf = gltflib.gltf.GLTF(model=model, resources=[file_resource])
-    gltf.export(str(modelpath))
+    return gltflib.gltf.GLTF(model=model, resources=[file_resource])
 
 
-def create_vertex_buffer(vertices: npt.NDArray[np.int_]) -> bytes:
-    """flattens array of vertices to a buffer of bytes"""
-    return vertices.astype(np.float32).flatten().tobytes()
+def create_vertex_buffer(vertices: npt.NDArray[np.integer[Any] | np.float32]) -> bytes:
+    """copies an array of vertices to a buffer of float32 bytes, converting it first
+    only if it is not already a C contiguous float32 array"""
+    return np.ascontiguousarray(vertices, dtype=np.float32).tobytes()
 
 
-def get_nonzero_points(qcarr: npt.NDArray[np.float_]) -> npt.NDArray[np.int_]:
+def get_index_dtype(shape: tuple[int, ...]) -> type[np.int16 | np.int32]:
+    """smallest signed integer type that holds every index of an array of the given
+    shape, signed so that rotated or offset coordinates cannot wrap around"""
+    if max(shape) <= np.iinfo(np.int16).max + 1:
+        return np.int16
+    return np.int32
+
+
+def get_nonzero_points(
+    qcarr: npt.NDArray[np.float_],
+    threshold: float | None = None,
+    offset: tuple[int, int, int] = (0, 0, 0),
+) -> npt.NDArray[np.int16 | np.int32]:
     """
     Determines the 3-dimensional index of each non-zero point in the provided netCDF
     variable. Input dimensions should be X-by-Y-by-Z and output dimensions will be an
     N-by-3 where each point is an [x,y,z] coordinate and N is the number of non-zero
-    points.
+    points. Indices are stored with the narrowest type that fits, see get_index_dtype.
     :params qcarr: netcdf4 variable data as a numpy array
+    :params threshold: if provided, only points with a value above it are included
+    :params offset: [x, y, z] offset added to the indices, for hyperslabs of a
+    larger variable
     :returns: numpy ndarray containing the indices of all non-zero points as [x, y, z]
     """
-    nonzero_indices = np.nonzero(qcarr[:])
-    return np.stack(nonzero_indices, axis=-1)
+    mask = qcarr != 0 if threshold is None else qcarr > threshold
+    nonzero_indices = np.nonzero(mask)
+    dtype = get_index_dtype(tuple(o + n for o, n in zip(offset, qcarr.shape)))
+    # Each index array is copied straight into its column of the output, instead
+    # of stacking full width copies
+    points = np.empty((len(nonzero_indices[0]), 3), dtype=dtype)
+    for axis, indices in enumerate(nonzero_indices):
+        points[:, axis] = indices
+        if offset[axis]:
+            points[:, axis] += offset[axis]
+    return points
+
+
+def extract_slab(
+    slab: Slab,
+    threshold: float | None = None,
+    origin: tuple[int, int, int] = (0, 0, 0),
+) -> tuple[int, NonzeroData]:
+    """
+    Sparse data of a single hyperslab, see extract_nonzero_slabs.
+
+    :param slab: z offset and data in xyz order
+    :param threshold: if provided, only points with a value above it are collected
+    :param origin: index within the variable of the first voxel of the data that
+    the hyperslabs are read from
+    :returns: the z offset of the hyperslab and its non-zero points (indexed within
+    the variable), their values, the min and max of the hyperslab and its shape
+    """
+    z0, data = slab
+    offset = (origin[0], origin[1], origin[2] + z0)
+    with profiling.stage("extract points") as counts:
+        points = get_nonzero_points(data, threshold, offset)
+        # Boolean indexing visits points in the same order as np.nonzero
+        mask = data != 0 if threshold is None else data > threshold
+        shape = (data.shape[0], data.shape[1], data.shape[2])
+        nzdata = NonzeroData(points, data[mask], np.min(data), np.max(data), shape)
+        counts.items = len(points)
+    return z0, nzdata
+
+
+def extract_nonzero_slabs(
+    slabs: Iterable[Slab],
+    threshold: float | None = None,
+    region: Region | None = None,
+    shape: tuple[int, int, int] | None = None,
+    pipeline: Pipeline | None = None,
+    value_stats: StreamingStats | None = None,
+) -> NonzeroData:
+    """
+    Single pass over a stream of hyperslabs that collects the [x, y, z] index and
+    value of every non-zero point along with the min and max of all data (including
+    zeros). Only the sparse points are retained, so memory scales with the number of
+    non-zero points rather than with the size of the variable. When the slabs hold
+    a region of the variable, points are indexed within the whole variable.
+
+    :param slabs: (z offset, data in xyz order) pairs, e.g. from read_netcdf_slabs
+    :param threshold: if provided, only points with a value above it are collected
+    :param region: (x, y, z) index ranges of the variable held by the slabs, if
+    they hold only a region of it
+    :param shape: (x, y, z) shape of the whole variable, by default the shape
+    covered by the slabs
+    :param pipeline: optionally read the next hyperslabs while extracting the
+    points of earlier ones, on concurrent stages
+    :param value_stats: optionally gather statistics of the data into this, from
+    the extracted values of each hyperslab
+    :returns: non-zero points, their values, the data range and the variable shape
+    :raises: ValueError if the stream contains no slabs
+    """
+    origin = (0, 0, 0) if region is None else get_region_box(region)[0]
+    extract = functools.partial(extract_slab, threshold=threshold, origin=origin)
+    parts: Iterable[tuple[int, NonzeroData]] = map(extract, slabs)
+    if pipeline is not None:
+        parts = run_pipeline(slabs, [extract], pipeline)
+    point_parts: list[npt.NDArray[np.int16 | np.int32]] = []
+    value_parts: list[npt.NDArray[np.float_]] = []
+    min_val = max_val = None
+    slab_shape = (0, 0, 0)
+    for z0, part in parts:
+        min_val = part.min_val if min_val is None else min(min_val, part.min_val)
+        max_val = part.max_val if max_val is None else max(max_val, part.max_val)
+        slab_shape = (part.shape[0], part.shape[1], z0 + part.shape[2])
+        if value_stats is not None:
+            add_value_stats(value_stats, part)
+        point_parts.append(part.points)
+        value_parts.append(part.values)
+    if min_val is None or max_val is None:
+        raise ValueError("variable contains no data")
+    return NonzeroData(
+        np.concatenate(point_parts),
+        np.concatenate(value_parts),
+        min_val,
+        max_val,
+        shape or slab_shape,
+    )
+
+
+def add_value_stats(value_stats: StreamingStats, part: NonzeroData) -> None:
+    """adds the data of an extracted hyperslab to statistics, from its values"""
+    with profiling.stage("statistics") as counts:
+        value_stats.add(
+            part.values,
+            math.prod(part.shape),
+            float(part.min_val),
+            float(part.max_val),
+        )
+        counts.items = len(part.values)
+
+
+def read_nonzero_data(
+    nc_file: pathlib.Path,
+    variable: str,
+    timestep: int = 0,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    cache: ArrayCache | None = None,
+    threshold: float | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
+    value_stats: StreamingStats | None = None,
+) -> NonzeroData:
+    """
+    Read one timestep of a variable, or only a region of it, and collect its sparse
+    data with extract_nonzero_slabs.
+
+    :param nc_file: netCDF4 file to read
+    :param variable: the variable to read
+    :param timestep: index along nt to read, ignored for 3-dimensional variables
+    :param slab_bytes: memory budget for one hyperslab
+    :param cache: optional cache of decoded variables
+    :param threshold: if provided, only points with a value above it are collected
+    :param region: optional (x, y, z) index ranges to read instead of the whole
+    variable, points are still indexed within the whole variable
+    :param pipeline: optionally read and extract hyperslabs on concurrent stages
+    :param value_stats: optionally gather statistics of the data into this
+    :returns: non-zero points, their values, the data range and the variable shape
+    :raises: KeyError if the variable keyword does not exist in the netCDF database
+    :raises: ValueError if the dimensions in the variable are not named as expected
+    :raises: TypeError if the variable has more than 4 dimensions
+    """
+    shape = None
+    if region is not None:
+        shape = get_variable_shape(nc_file, variable)
+    slabs = read_netcdf_slabs(nc_file, variable, timestep, slab_bytes, cache, region)
+    return extract_nonzero_slabs(slabs, threshold, region, shape, pipeline, value_stats)
+
+
+def get_bounding_box(
+    nz_points: npt.NDArray[np.int_],
+    origin: tuple[int, int, int] = (0, 0, 0),
+) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """
+    Find the tightest axis-aligned box containing every point. Without any points,
+    such as when a region holds only clear air, the box is the single voxel at
+    origin.
 
+    :param nz_points: N-by-3 array of [x, y, z] indices
+    :param origin: index of the box if there are no points
+    :returns: index of the lowest corner of the box and the (x, y, z) size of the box
+    """
+    if len(nz_points) == 0:
+        return origin, (1, 1, 1)
+    low = nz_points.min(axis=0)
+    high = nz_points.max(axis=0)
+    offset = (int(low[0]), int(low[1]), int(low[2]))
+    extent = high - low + 1
+    return offset, (int(extent[0]), int(extent[1]), int(extent[2]))
+
+
+def get_min_y(nz_points: npt.NDArray[np.int_]) -> int:
+    """lowest index of any point along the z axis of the grid, which is y in the
+    scene, or 0 if there are no points"""
+    if len(nz_points) == 0:
+        return 0
+    return int(np.min(nz_points[:, 2]))
 
-def rotate_points(points: npt.NDArray[np.int_]) -> npt.NDArray[np.int_]:
-    """rotates all points in an Nx3 array by -pi/2 about the x axis"""
-    return np.column_stack((points[:, 0], points[:, 2], -points[:, 1]))
+
+def rotate_points(
+    points: npt.NDArray[np.integer[Any] | np.float32],
+    dtype: type[np.integer[Any] | np.float32] | None = None,
+) -> npt.NDArray[np.integer[Any] | np.float32]:
+    """rotates all points in an Nx3 array by -pi/2 about the x axis, writing them
+    directly into a new array of the given type (by default the type of points)"""
+    rotated = np.empty(points.shape, dtype=dtype or points.dtype)
+    rotated[:, 0] = points[:, 0]
+    rotated[:, 1] = points[:, 2]
+    # Negated before casting, so that y = 0 does not become -0.0 in float output
+    np.negative(points[:, 1], out=rotated[:, 2])
+    return rotated
 
 
 def quantize(
@@ -143,6 +938,48 @@ def quantize_float(
     return np.float32(u)
 
 
+def quantize_array(
+    u: npt.NDArray[np.float_], minu: np.float_, maxu: np.float_, levels: int
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """
+    Array counterpart to quantize and quantize_float. Values are scaled and truncated
+    the same way as the scalar functions, but the whole array is processed at once
+    instead of one Python call per value, and values outside of minu to maxu are
+    clamped to 0 or levels. Any level count other than 255 or 65535 is interpreted
+    as a request for floating point output.
+
+    :param u: array of values to quantize
+    :param minu: value mapped to 0
+    :param maxu: value mapped to levels
+    :param levels: 255 for uint8 output, 65535 for uint16 output
+    :returns: numpy ndarray with the same shape as u
+    """
+    if levels == 255:
+        dt = np.uint8
+    elif levels == 65535:
+        dt = np.uint16
+    else:
+        return u.astype(np.float32)
+    rangeu = maxu - minu
+    # The scalar function promotes to double precision when multiplying by levels,
+    # do the same here so that both truncate to identical values
+    scaled = ((u - minu) / rangeu).astype(np.float64) * levels
+    # Values outside of a clipped range are clamped instead of wrapping around
+    np.clip(scaled, 0, levels, out=scaled)
+    return scaled.astype(dt)
+
+
+def get_quantized_dtype(
+    quantization_bits: int,
+) -> type[np.uint8 | np.uint16 | np.float32]:
+    """numpy type of data quantized to 8 or 16 bits, otherwise float"""
+    if quantization_bits == 8:
+        return np.uint8
+    if quantization_bits == 16:
+        return np.uint16
+    return np.float32
+
+
 def map_points_nrrd(
     nz_points: npt.NDArray[np.int_],
     vardata: npt.NDArray[np.float_],
@@ -161,45 +998,52 @@ def map_points_nrrd(
     :param quantization_bits: export data as 8- or 16-bit values, otherwise as float
     :returns: numpy ndarray with the data as the type specified by quantization_bits
     """
-    base_shape = (512, 512, 512)  # vardata.shape
-
-    # The output coordinate space has y up, so denote the z dimension of the input data
-    # as a y dimension for the output point cloud
-    min_y = np.min(nz_points[:, 2])
-    max_y = np.max(nz_points[:, 2])
-    # Currently discarding this value due to an as yet unsolved issue with the shader
-    y_shape = max_y - min_y
-
     min_val: np.float_ = np.min(vardata[:])
     max_val: np.float_ = np.max(vardata[:])
+    values = vardata[nz_points[:, 0], nz_points[:, 1], nz_points[:, 2]]
+    return map_values_nrrd(nz_points, values, min_val, max_val, quantization_bits)
+
+
+def map_values_nrrd(
+    nz_points: npt.NDArray[np.int_],
+    values: npt.NDArray[np.float_],
+    min_val: np.float_,
+    max_val: np.float_,
+    quantization_bits: int,
+    base_shape: tuple[int, int, int] = (512, 512, 512),
+    out: npt.NDArray[np.uint8 | np.uint16 | np.float32] | None = None,
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """
+    Same as map_points_nrrd, but takes the values at each non-zero point and the
+    scaling range directly, so the full variable does not need to be in memory.
+
+    :param nz_points: the indices of non-zero data values
+    :param values: the data value at each of the non-zero points
+    :param min_val: data value that is quantized to 0
+    :param max_val: data value that is quantized to the highest level
+    :param quantization_bits: export data as 8- or 16-bit values, otherwise as float
+    :param base_shape: shape of the output volume, points outside of it are dropped
+    :param out: zero-filled volume of base_shape and the right type to write into,
+    such as a memory mapped file, instead of allocating a new one
+    :returns: numpy ndarray with the data as the type specified by quantization_bits
+    """
     levels: int = (2 ** (quantization_bits)) - 1
-    if quantization_bits == 8:
-        dt = np.uint8
-        quant_fn = quantize
-    elif quantization_bits == 16:
-        dt = np.uint16
-        quant_fn = quantize
-    else:
-        dt = np.float32
-        quant_fn = quantize_float
-    # The NRRD file will occupy a cube with the dimensions of the xy plane from the
-    # original data. The y height is set this way to get it to work with the
-    # volumetric shader. TO DO: Modify the shader to allow more efficient data packing
-    points = np.zeros((base_shape[0], base_shape[0], base_shape[1]), dtype=dt)
-    for pt in nz_points:
-        if (
-            pt[0] > base_shape[0] - 1
-            or pt[1] > base_shape[1] - 1
-            or pt[2] > base_shape[2] - 1
-        ):
-            continue
-        in_x: int = pt[0]
-        in_y: int = pt[1]
-        in_z: int = pt[2]
-        x = in_x
-        y = in_y  # in_z - min_y - 1
-        z = in_z  # base_shape[1] - in_y - 1
-        points[x][y][z] = quant_fn(vardata[in_x][in_y][in_z], min_val, max_val, levels)
+    dt = get_quantized_dtype(quantization_bits)
+    # By default the NRRD file will occupy a 512 voxel cube regardless of the extent
+    # of the original data, which is what the volumetric shader expects. Passing the
+    # bounding box of the points as the base shape packs the data tightly instead
+    # NRRD stores voxels with x varying fastest, so allocate the volume in Fortran
+    # order to avoid a transposing copy when it is written
+    points = np.zeros(base_shape, dtype=dt, order="F") if out is None else out
+    # Points outside of the volume are dropped, then the remaining values are
+    # quantized and scattered into the volume in a single pass
+    with profiling.stage("quantize") as counts:
+        in_bounds = np.all(nz_points < np.array(base_shape), axis=1)
+        in_x, in_y, in_z = nz_points[in_bounds].T
+        points[in_x, in_y, in_z] = quantize_array(
+            values[in_bounds], min_val, max_val, levels
+        )
+        counts.items = len(in_x)
     return points
 
 
@@ -207,17 +1051,46 @@ def create_nrrd_model(
     nrrd_file: pathlib.Path,
     points: npt.NDArray[np.uint8 | np.uint16 | np.float32],
     min_y: int,
+    header: dict[str, Any] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    pipeline: Pipeline | None = None,
 ) -> None:
-    """exports a numpy array to NRRD"""
+    """exports a numpy array to NRRD, with optional extra header fields, compressing
+    and writing it on concurrent stages if a pipeline is given"""
     # Append the y offset to the filename
     print(f"Y offset: {min_y} meters")
     # new_name = nrrd_file.stem + f"_{min_y}m" + nrrd_file.suffix
     # outpath = str(nrrd_file.with_name(new_name))
 
-    # No need to append y offset to filename since data is not effciently
-    # packed at this time
-    outpath = str(nrrd_file)
-    nrrd.write(outpath, points)
+    # No need to append y offset to filename since the offset of packed data is
+    # stored in the header
+    if isinstance(points, np.memmap):
+        # Detached data was filled in place, the header was written beforehand
+        with profiling.stage("write NRRD") as counts:
+            points.flush()
+            counts.bytes_written = points.nbytes
+    else:
+        nrrdio.write_nrrd(nrrd_file, points, header, encoding, pipeline)
+
+
+def get_crop_header(
+    offset: tuple[int, int, int], original_shape: tuple[int, int, int]
+) -> dict[str, Any]:
+    """
+    NRRD header fields describing where a cropped volume sits within the original
+    variable. The offset is stored as the space origin (in voxels) and the shape of
+    the uncropped variable is stored as the "original sizes" key/value pair.
+
+    :param offset: [x, y, z] index of the first voxel of the cropped volume
+    :param original_shape: (x, y, z) shape of the variable before cropping
+    :returns: dictionary of header fields to pass to create_nrrd_model
+    """
+    return {
+        "space dimension": 3,
+        "space directions": np.eye(3),
+        "space origin": np.array(offset, dtype=float),
+        "original sizes": list(original_shape),
+    }
 
 
 def convert_nc_gltf(
@@ -225,6 +1098,16 @@ def convert_nc_gltf(
     gltf_file: pathlib.Path,
     res_file: pathlib.Path,
     variable: str = "QC",
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    timestep: int = 0,
+    lod_levels: int = 0,
+    quantize_positions: bool = False,
+    include_values: bool = False,
+    chunk_points: int | None = None,
+    threshold: float | None = None,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
 ) -> bool:
     """
     Main function for converting a netCDF dataset into a glb or gltf format point
@@ -237,19 +1120,109 @@ def convert_nc_gltf(
     :params gltf_file: output filepath, can have glb or gltf extension
     :params res_file: when exporting gltf, vertices are stored in this filepath
     :params variable: the variable to export to a 3D point cloud
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params timestep: index along nt to export, ignored for 3-dimensional variables
+    :params lod_levels: number of additional point clouds to export, each decimated
+    by a further factor of 2, along with a manifest describing them
+    :params quantize_positions: store positions as 8- or 16-bit integers using the
+    KHR_mesh_quantization extension instead of as floats
+    :params include_values: with quantized positions, also store the quantized data
+    value of each point as the _VALUE attribute
+    :params chunk_points: sort points by Morton code and split them into spatially
+    compact chunks of at most this many points, each exported as its own node
+    :params threshold: if provided, only points with a value above it are exported
+    :params cache: optional cache of decoded variables
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variable, points keep their position within the whole variable
+    :params pipeline: optionally read hyperslabs and extract their points on
+    concurrent stages
     :returns: True if successful
     :raises: KeyError if the variable keyword does not exist in the netCDF database
     :raises: ValueError if the dimensions in the variable are not named as expected
     :raises: TypeError if the variable has more than 4 dimensions
     """
-    qcarr = parse_netcdf(nc_file, variable)
-
-    nonzero_points = get_nonzero_points(qcarr)
+    nzdata = read_nonzero_data(
+        nc_file, variable, timestep, slab_bytes, cache, threshold, region, pipeline
+    )
+    nonzero_points = nzdata.points
     print(f"Found {nonzero_points.shape[0]} points")
 
-    points = rotate_points(nonzero_points)
-    create_gltf_model(gltf_file, points, str(res_file.name))
+    values = nzdata.values if include_values else None
+    value_range = (nzdata.min_val, nzdata.max_val)
+    chunks = None
+    if chunk_points:
+        with profiling.stage("Morton sort") as counts:
+            order, chunks = morton.sort_points(nonzero_points, chunk_points)
+            counts.items = len(nonzero_points)
+        nonzero_points = nonzero_points[order]
+        if values is not None:
+            values = values[order]
+        print(f"Split into {len(chunks)} chunks")
+    if quantize_positions:
+        points = rotate_points(nonzero_points)
+        create_quantized_gltf_model(
+            gltf_file,
+            points,
+            str(res_file.name),
+            values,
+            value_range,
+            chunks=chunks,
+        )
+    else:
+        # Rotated straight into the float32 vertices that are written to the file
+        points = rotate_points(nonzero_points, np.float32)
+        create_gltf_model(gltf_file, points, str(res_file.name), chunks)
     # pointcloud_to_mesh(gltf_file, points)
+
+    if lod_levels:
+        levels = [
+            {"level": 0, "factor": 1, "file": gltf_file.name, "points": len(points)}
+        ]
+        for level in range(1, lod_levels + 1):
+            factor = 2**level
+            level_file = lod.get_level_path(gltf_file, level)
+            level_res = lod.get_level_path(res_file, level).name
+            if quantize_positions:
+                # Cell indices are stored as integers and the node transform places
+                # them at the center of each cell
+                cells, cell_values = lod.decimate_cells(nonzero_points, factor, values)
+                level_chunks = None
+                if chunk_points:
+                    order, level_chunks = morton.sort_points(cells, chunk_points)
+                    cells = cells[order]
+                    if cell_values is not None:
+                        cell_values = cell_values[order]
+                center = (factor - 1) / 2
+                create_quantized_gltf_model(
+                    level_file,
+                    rotate_points(cells),
+                    level_res,
+                    cell_values,
+                    value_range,
+                    factor,
+                    (center, center, -center),
+                    level_chunks,
+                )
+                count = len(cells)
+            else:
+                decimated = lod.decimate_points(nonzero_points, factor)
+                level_chunks = None
+                if chunk_points:
+                    order, level_chunks = morton.sort_points(decimated, chunk_points)
+                    decimated = decimated[order]
+                create_gltf_model(
+                    level_file, rotate_points(decimated), level_res, level_chunks
+                )
+                count = len(decimated)
+            levels.append(
+                {
+                    "level": level,
+                    "factor": factor,
+                    "file": level_file.name,
+                    "points": count,
+                }
+            )
+        print(f"LOD manifest     : {lod.write_lod_manifest(gltf_file, levels)}")
     return True
 
 
@@ -258,6 +1231,19 @@ def convert_nc_nrrd(
     nrrd_file: pathlib.Path,
     variable: str = "QC",
     quantization_bits: int = 8,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    crop: bool = False,
+    timestep: int = 0,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    lod_levels: int = 0,
+    pooling: str = "max",
+    cache: ArrayCache | None = None,
+    occupancy_grid: OccupancyGrid | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
+    clip_percentile: float | None = None,
+    stats_sidecar: bool = False,
 ) -> bool:
     """
     Main function for converting a netCDF dataset into a Near-Raw Raster Data (NRRD)
@@ -270,22 +1256,591 @@ def convert_nc_nrrd(
     :params nrrd_file: output filepath with .nrrd extension
     :params variable: the variable to export to a 3D texture
     :params quantization_bits: passed to pre-processing function to quantize float data
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params crop: pack the volume into the bounding box of the non-zero data on all
+    three axes instead of a 512 voxel cube, storing the offset in the header
+    :params timestep: index along nt to export, ignored for 3-dimensional variables
+    :params value_range: min and max used for quantization instead of the range of
+    this timestep, so that several timesteps can share one scale
+    :params encoding: how the NRRD data is stored and compressed
+    :params lod_levels: number of additional volumes to export, each downsampled by
+    a further factor of 2, along with a manifest describing them
+    :params pooling: how voxels are combined when downsampling, "max" or "mean"
+    :params cache: optional cache of decoded variables
+    :params occupancy_grid: optionally also export a coarse grid of where the volume
+    holds data, for empty space skipping
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variable, the volume then spans the region and its offset is stored in the
+    header
+    :params pipeline: optionally run reading, extraction and compression on
+    concurrent stages. When the volume is not cropped and its scale is known
+    (float output or a value range), the volume is written while it is read with
+    stream_nc_nrrd
+    :params clip_percentile: when quantizing without a value range, scale between
+    this percentile of the non-zero values and its complement instead of the min
+    and max, see StreamingStats.get_clipped_range
+    :params stats_sidecar: also write the statistics of the data, gathered while it
+    is read, to a .stats.json file next to the volume
     :returns: True if successful
     :raises: KeyError if the variable keyword does not exist in the netCDF database
     :raises: ValueError if the dimensions in the variable are not named as expected
     :raises: TypeError if the variable has more than 4 dimensions
     """
-    qcarr = parse_netcdf(nc_file, variable)
+    is_scaled = quantization_bits in (8, 16)
+    value_stats = None
+    if stats_sidecar or clip_percentile is not None:
+        value_stats = StreamingStats()
+    # A clipped range is only known once all of the data has been read
+    is_clipped = is_scaled and clip_percentile is not None and value_range is None
+    is_known = value_range is not None or not is_scaled
+    if pipeline is not None and not crop and is_known and not is_clipped:
+        volume, header = stream_nc_nrrd(
+            nc_file,
+            nrrd_file,
+            variable,
+            quantization_bits,
+            slab_bytes,
+            timestep,
+            value_range,
+            encoding,
+            cache,
+            region,
+            pipeline,
+            value_stats,
+        )
+        write_volume_extras(
+            nrrd_file,
+            volume,
+            header,
+            encoding,
+            lod_levels,
+            pooling,
+            occupancy_grid,
+            pipeline,
+        )
+        if value_stats is not None:
+            write_value_stats(
+                nrrd_file,
+                value_stats,
+                value_range if is_scaled else None,
+                variable=variable,
+                timestep=timestep,
+                bits=quantization_bits,
+            )
+        return True
+    nzdata = read_nonzero_data(
+        nc_file,
+        variable,
+        timestep,
+        slab_bytes,
+        cache,
+        region=region,
+        pipeline=pipeline,
+        value_stats=value_stats,
+    )
+    print(f"Found {nzdata.points.shape[0]} points")
+    if is_clipped and value_stats is not None and clip_percentile is not None:
+        value_range = value_stats.get_clipped_range(clip_percentile)
+        print(f"Clipped range    : {value_range[0]:g} to {value_range[1]:g}")
+    write_nonzero_nrrd(
+        nzdata,
+        nrrd_file,
+        quantization_bits,
+        crop,
+        value_range,
+        encoding,
+        lod_levels,
+        pooling,
+        occupancy_grid,
+        region,
+        pipeline,
+    )
+    if value_stats is not None:
+        write_value_stats(
+            nrrd_file,
+            value_stats,
+            value_range if is_scaled else None,
+            variable=variable,
+            timestep=timestep,
+            bits=quantization_bits,
+            clip_percentile=clip_percentile,
+        )
+    return True
+
+
+def write_value_stats(
+    path: pathlib.Path,
+    value_stats: StreamingStats,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    **metadata: Any,
+) -> None:
+    """writes the statistics sidecar of an export, with the range its values were
+    quantized over, which is the range of the data if none is given"""
+    if value_range is None:
+        value_range = (
+            np.float_(value_stats.min_val or 0.0),
+            np.float_(value_stats.max_val or 0.0),
+        )
+    scale = (float(value_range[0]), float(value_range[1]))
+    sidecar = stats.write_sidecar(path, value_stats, scale, **metadata)
+    print(f"Statistics       : {sidecar}")
+
+
+def get_volume_layout(
+    nzdata: NonzeroData, crop: bool = False, region: Region | None = None
+) -> tuple[tuple[int, int, int], tuple[int, int, int], dict[str, Any] | None]:
+    """
+    Position and size of the NRRD volume holding sparse data: the bounding box of
+    the data when cropping, the region it was read from if any, and otherwise the
+    512 voxel cube that the volumetric shader expects.
 
-    nonzero_points = get_nonzero_points(qcarr)
-    print(f"Found {nonzero_points.shape[0]} points")
-    # quantization_bits = 32 if exporting data as floating point
-    points = map_points_nrrd(nonzero_points, qcarr, quantization_bits)
+    :params nzdata: non-zero points and values
+    :params crop: pack the volume into the bounding box of the non-zero data
+    :params region: (x, y, z) index ranges the data was read from
+    :returns: index of the first voxel of the volume, its shape, and the header
+    fields recording its offset, which are None for the default cube
+    """
+    if crop:
+        origin = (0, 0, 0) if region is None else get_region_box(region)[0]
+        offset, base_shape = get_bounding_box(nzdata.points, origin)
+    elif region is not None:
+        offset, base_shape = get_region_box(region)
+    else:
+        return (0, 0, 0), (512, 512, 512), None
+    return offset, base_shape, get_crop_header(offset, nzdata.shape)
 
+
+def write_nonzero_nrrd(
+    nzdata: NonzeroData,
+    nrrd_file: pathlib.Path,
+    quantization_bits: int = 8,
+    crop: bool = False,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    lod_levels: int = 0,
+    pooling: str = "max",
+    occupancy_grid: OccupancyGrid | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
+) -> None:
+    """
+    Write the sparse data of one variable to an NRRD file, and optionally its
+    level of detail pyramid. See convert_nc_nrrd for the meaning of each option.
+
+    :params nzdata: non-zero points and values, e.g. from extract_nonzero_slabs
+    :params nrrd_file: output filepath with .nrrd extension
+    :params quantization_bits: export data as 8- or 16-bit values, otherwise as float
+    :params crop: pack the volume into the bounding box of the non-zero data
+    :params value_range: min and max used for quantization instead of the data range
+    :params encoding: how the NRRD data is stored and compressed
+    :params lod_levels: number of additional downsampled volumes to export
+    :params pooling: how voxels are combined when downsampling, "max" or "mean"
+    :params occupancy_grid: optionally also export a coarse grid of where the volume
+    holds data
+    :params region: (x, y, z) index ranges the data was read from, the volume spans
+    the region unless cropping
+    :params pipeline: optionally compress and write the volume on concurrent stages
+    """
+    nonzero_points = nzdata.points
+    min_val, max_val = value_range or (nzdata.min_val, nzdata.max_val)
     # When packing the data, it's important to know where the data starts on the
     # y axis so it can be placed in the scene properly
-    min_y = int(np.min(nonzero_points[:, 2]))
-    create_nrrd_model(nrrd_file, points, min_y)
+    min_y = get_min_y(nonzero_points)
+
+    offset, base_shape, header = get_volume_layout(nzdata, crop, region)
+    if crop:
+        print(f"Cropped volume   : {base_shape} at offset {offset}")
+    elif region is not None:
+        print(f"Region volume    : {base_shape} at offset {offset}")
+    if header is not None:
+        nonzero_points = nonzero_points - np.array(offset)
+
+    out = None
+    if encoding.encoding == "detached":
+        # The volume is scattered straight into a memory map of the output file
+        dt = get_quantized_dtype(quantization_bits)
+        out = nrrdio.create_detached_nrrd(nrrd_file, base_shape, dt, header)
+    # quantization_bits = 32 if exporting data as floating point
+    points = map_values_nrrd(
+        nonzero_points,
+        nzdata.values,
+        min_val,
+        max_val,
+        quantization_bits,
+        base_shape,
+        out,
+    )
+    create_nrrd_model(nrrd_file, points, min_y, header, encoding, pipeline)
+    write_volume_extras(
+        nrrd_file,
+        points,
+        header,
+        encoding,
+        lod_levels,
+        pooling,
+        occupancy_grid,
+        pipeline,
+    )
+
+
+def write_volume_extras(
+    nrrd_file: pathlib.Path,
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    header: dict[str, Any] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    lod_levels: int = 0,
+    pooling: str = "max",
+    occupancy_grid: OccupancyGrid | None = None,
+    pipeline: Pipeline | None = None,
+) -> None:
+    """
+    Write the outputs derived from an exported volume: its occupancy grid and its
+    level of detail pyramid, if requested. See convert_nc_nrrd for the meaning of
+    each option.
+
+    :params nrrd_file: filepath of the exported volume
+    :params volume: the exported volume
+    :params header: header fields of the volume
+    :params encoding: how the NRRD data is stored and compressed
+    :params lod_levels: number of additional downsampled volumes to export
+    :params pooling: how voxels are combined when downsampling, "max" or "mean"
+    :params occupancy_grid: optionally export a coarse grid of where the volume
+    holds data
+    :params pipeline: optionally compress and write each level on concurrent stages
+    """
+    if occupancy_grid is not None:
+        grid_file = occupancy.write_occupancy_grid(
+            nrrd_file, volume, occupancy_grid, header, encoding
+        )
+        print(f"Occupancy grid   : {grid_file}")
+
+    if lod_levels:
+        levels = [
+            {
+                "level": 0,
+                "factor": 1,
+                "file": nrrdio.get_header_path(nrrd_file, encoding).name,
+                "sizes": list(volume.shape),
+            }
+        ]
+        # Each level is pooled from the previous one, so the pyramid is built in a
+        # single pass over progressively smaller volumes
+        for level in range(1, lod_levels + 1):
+            factor = 2**level
+            with profiling.stage("downsample LOD") as counts:
+                volume = lod.downsample_volume(volume, pooling)
+                counts.items = volume.size
+            level_file = lod.get_level_path(nrrd_file, level)
+            level_header = lod.get_level_header(header, factor)
+            nrrdio.write_nrrd(level_file, volume, level_header, encoding, pipeline)
+            levels.append(
+                {
+                    "level": level,
+                    "factor": factor,
+                    "file": nrrdio.get_header_path(level_file, encoding).name,
+                    "sizes": list(volume.shape),
+                }
+            )
+        manifest = lod.write_lod_manifest(nrrd_file, levels, pooling=pooling)
+        print(f"LOD manifest     : {manifest}")
+
+
+def stream_nc_nrrd(
+    nc_file: pathlib.Path,
+    nrrd_file: pathlib.Path,
+    variable: str = "QC",
+    quantization_bits: int = 8,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    timestep: int = 0,
+    value_range: tuple[np.float_, np.float_] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline = Pipeline(),
+    value_stats: StreamingStats | None = None,
+) -> tuple[npt.NDArray[np.uint8 | np.uint16 | np.float32], dict[str, Any] | None]:
+    """
+    Convert one timestep of a variable to NRRD in a single pipelined pass. Reading
+    hyperslabs, extracting and scattering their non-zero values into the volume,
+    and compressing and writing each completed block of planes of the volume run
+    as concurrent stages, so that the time taken approaches that of the slowest
+    stage. The position and scale of the volume must be known before reading, so
+    the volume cannot be cropped and quantizing requires a value range.
+
+    :params nc_file: netCDF4 file to convert to a 3D texture
+    :params nrrd_file: output filepath with .nrrd extension
+    :params variable: the variable to export to a 3D texture
+    :params quantization_bits: 8 or 16 to quantize the data, otherwise float
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params timestep: index along nt to export, ignored for 3-dimensional variables
+    :params value_range: min and max used for quantization, required if quantizing
+    :params encoding: how the NRRD data is stored and compressed
+    :params cache: optional cache of decoded variables
+    :params region: optional (x, y, z) index ranges to export, the volume then spans
+    the region
+    :params pipeline: number of stages and depth of the queues between them
+    :params value_stats: optionally gather statistics of the data into this
+    :returns: the volume and its header fields, for any outputs derived from it
+    :raises: ValueError if quantizing without a value range
+    """
+    if quantization_bits in (8, 16) and value_range is None:
+        raise ValueError("a value range is required to quantize while streaming")
+    # Float export does not scale values, so the range only matters if quantizing
+    min_val, max_val = value_range or (np.float_(0.0), np.float_(1.0))
+    base_shape = (512, 512, 512)
+    offset = (0, 0, 0)
+    header = None
+    if region is not None:
+        offset, base_shape = get_region_box(region)
+        print(f"Region volume    : {base_shape} at offset {offset}")
+        header = get_crop_header(offset, get_variable_shape(nc_file, variable))
+    dt = get_quantized_dtype(quantization_bits)
+    if encoding.encoding == "detached":
+        volume = nrrdio.create_detached_nrrd(nrrd_file, base_shape, dt, header)
+    else:
+        volume = np.zeros(base_shape, dtype=dt, order="F")
+
+    def scatter(item: tuple[int, NonzeroData]) -> tuple[int, NonzeroData]:
+        part = item[1]
+        map_values_nrrd(
+            part.points - np.array(offset),
+            part.values,
+            min_val,
+            max_val,
+            quantization_bits,
+            base_shape,
+            volume,
+        )
+        return item
+
+    slabs = read_netcdf_slabs(nc_file, variable, timestep, slab_bytes, cache, region)
+    extract = functools.partial(extract_slab, origin=offset)
+    parts = run_pipeline(slabs, [extract, scatter], pipeline)
+    point_counts: list[int] = []
+    min_ys: list[int] = []
+
+    def iter_blocks() -> Iterator[npt.NDArray[np.uint8 | np.uint16 | np.float32]]:
+        # Slabs arrive in z order and only touch their own planes, so the planes
+        # below the end of each slab are complete once it has been scattered
+        done = 0
+        for z0, part in parts:
+            if value_stats is not None:
+                add_value_stats(value_stats, part)
+            point_counts.append(len(part.points))
+            if len(part.points):
+                min_ys.append(int(np.min(part.points[:, 2])))
+            end = min(z0 + part.shape[2], base_shape[2])
+            if end > done:
+                yield volume[:, :, done:end]
+                done = end
+        yield from nrrdio.iter_volume_blocks(volume[:, :, done:])
+
+    if isinstance(volume, np.memmap):
+        for _ in iter_blocks():
+            pass
+        with profiling.stage("write NRRD") as counts:
+            volume.flush()
+            counts.bytes_written = volume.nbytes
+    else:
+        nrrdio.write_nrrd_blocks(
+            nrrd_file,
+            base_shape,
+            volume.dtype,
+            iter_blocks(),
+            header,
+            encoding,
+            pipeline,
+        )
+    print(f"Found {sum(point_counts)} points")
+    print(f"Y offset: {min(min_ys, default=0)} meters")
+    return volume, header
+
+
+def convert_nc_gltf_series(
+    nc_file: pathlib.Path,
+    gltf_file: pathlib.Path,
+    res_file: pathlib.Path,
+    timesteps: Iterable[int],
+    variable: str = "QC",
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    workers: int | None = None,
+    lod_levels: int = 0,
+    quantize_positions: bool = False,
+    include_values: bool = False,
+    chunk_points: int | None = None,
+    threshold: float | None = None,
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
+) -> bool:
+    """
+    Export several timesteps of a netCDF dataset as one glb or gltf point cloud per
+    timestep, spread across a pool of worker processes. The timestep is appended to
+    the name of each output file (and vertices file).
+
+    :params nc_file: netCDF4 file to convert to 3D objects
+    :params gltf_file: output filepath, can have glb or gltf extension
+    :params res_file: when exporting gltf, vertices are stored in this filepath
+    :params timesteps: indices along nt to export
+    :params variable: the variable to export to 3D point clouds
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params workers: number of worker processes, defaults to the number of CPUs
+    :params lod_levels: number of decimated point clouds to export per timestep
+    :params quantize_positions: store positions as 8- or 16-bit integers
+    :params include_values: with quantized positions, also store data values
+    :params chunk_points: split each point cloud into Morton ordered chunks of at
+    most this many points
+    :params threshold: if provided, only points with a value above it are exported
+    :params cache: optional cache of decoded variables
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variable
+    :params pipeline: optionally run the stages of each export concurrently
+    :returns: True if successful
+    """
+    profiled = profiling.is_enabled()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                profiling.call_profiled,
+                profiled,
+                convert_nc_gltf,
+                nc_file,
+                get_timestep_path(gltf_file, t),
+                get_timestep_path(res_file, t),
+                variable,
+                slab_bytes,
+                t,
+                lod_levels,
+                quantize_positions,
+                include_values,
+                chunk_points,
+                threshold,
+                cache,
+                region,
+                pipeline,
+            )
+            for t in timesteps
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            profiling.merge(future.result()[1])
+    return True
+
+
+def convert_nc_nrrd_series(
+    nc_file: pathlib.Path,
+    nrrd_file: pathlib.Path,
+    timesteps: Iterable[int],
+    variable: str = "QC",
+    quantization_bits: int = 8,
+    slab_bytes: int = DEFAULT_SLAB_BYTES,
+    crop: bool = False,
+    workers: int | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    lod_levels: int = 0,
+    pooling: str = "max",
+    cache: ArrayCache | None = None,
+    occupancy_grid: OccupancyGrid | None = None,
+    region: Region | None = None,
+    pipeline: Pipeline | None = None,
+    clip_percentile: float | None = None,
+    stats_sidecar: bool = False,
+) -> bool:
+    """
+    Export several timesteps of a netCDF dataset as one NRRD per timestep, spread
+    across a pool of worker processes. When quantizing, all timesteps share the min
+    and max of the whole series so that values are consistent between frames. The
+    timestep is appended to the name of each output file.
+
+    :params nc_file: netCDF4 file to convert to 3D textures
+    :params nrrd_file: output filepath with .nrrd extension
+    :params timesteps: indices along nt to export
+    :params variable: the variable to export to 3D textures
+    :params quantization_bits: passed to pre-processing function to quantize float data
+    :params slab_bytes: memory budget for each hyperslab read from the netCDF file
+    :params crop: crop each volume to the bounding box of its non-zero data
+    :params workers: number of worker processes, defaults to the number of CPUs
+    :params encoding: how the NRRD data is stored and compressed
+    :params lod_levels: number of downsampled volumes to export per timestep
+    :params pooling: how voxels are combined when downsampling, "max" or "mean"
+    :params cache: optional cache of decoded variables, which also lets the export
+    reuse the timesteps decoded while finding the range of the series
+    :params occupancy_grid: optionally also export a coarse grid of where each
+    volume holds data
+    :params region: optional (x, y, z) index ranges to export instead of the whole
+    variable, the range of the series is then that of the region
+    :params pipeline: optionally run the stages of each export concurrently, the
+    shared range lets quantized timesteps be written while they are read
+    :params clip_percentile: when quantizing, share a range clipped at this
+    percentile of the non-zero values of the whole series instead of its min and
+    max, see StreamingStats.get_clipped_range
+    :params stats_sidecar: also write the statistics of each timestep to a
+    .stats.json file next to its volume
+    :returns: True if successful
+    """
+    timesteps = list(timesteps)
+    # Stages run in the worker processes are sent back to this one
+    profiled = profiling.is_enabled()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        value_range = None
+        if quantization_bits in (8, 16) and clip_percentile is not None:
+            # Percentiles of the series need the histograms of every timestep
+            series_stats = StreamingStats()
+            for timestep_stats, stages in pool.map(
+                functools.partial(profiling.call_profiled, profiled, get_value_stats),
+                itertools.repeat(nc_file),
+                itertools.repeat(variable),
+                timesteps,
+                itertools.repeat(slab_bytes),
+                itertools.repeat(cache),
+                itertools.repeat(region),
+            ):
+                series_stats.merge(timestep_stats)
+                profiling.merge(stages)
+            value_range = series_stats.get_clipped_range(clip_percentile)
+            print(f"Clipped range    : {value_range[0]:g} to {value_range[1]:g}")
+        elif quantization_bits in (8, 16):
+            ranges: list[tuple[np.float_, np.float_]] = []
+            for timestep_range, stages in pool.map(
+                functools.partial(profiling.call_profiled, profiled, get_value_range),
+                itertools.repeat(nc_file),
+                itertools.repeat(variable),
+                timesteps,
+                itertools.repeat(slab_bytes),
+                itertools.repeat(cache),
+                itertools.repeat(region),
+            ):
+                ranges.append(timestep_range)
+                profiling.merge(stages)
+            value_range = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+            print(f"Series range     : {value_range[0]} to {value_range[1]}")
+        futures = [
+            pool.submit(
+                profiling.call_profiled,
+                profiled,
+                convert_nc_nrrd,
+                nc_file,
+                get_timestep_path(nrrd_file, t),
+                variable,
+                quantization_bits,
+                slab_bytes,
+                crop,
+                t,
+                value_range,
+                encoding,
+                lod_levels,
+                pooling,
+                cache,
+                occupancy_grid,
+                region,
+                pipeline,
+                # Recorded in the sidecars, the shared range is already clipped
+                clip_percentile,
+                stats_sidecar,
+            )
+            for t in timesteps
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            profiling.merge(future.result()[1])
     return True
 
 
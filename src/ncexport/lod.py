@@ -0,0 +1,124 @@
+"""Level of detail pyramids: downsampled volumes and decimated point clouds that
+a viewer can show while the full resolution export is still loading."""
+
+import json
+import pathlib
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+
+def get_level_path(path: pathlib.Path, level: int) -> pathlib.Path:
+    """appends the level of detail to the stem of a filepath, level 0 is unchanged"""
+    if level == 0:
+        return path
+    return path.with_name(f"{path.stem}_lod{level}{path.suffix}")
+
+
+def get_manifest_path(path: pathlib.Path) -> pathlib.Path:
+    """filepath of the level of detail manifest for an output filepath"""
+    return path.with_name(f"{path.stem}.lod.json")
+
+
+def downsample_volume(
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32], pooling: str = "max"
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """
+    Halve the resolution of a volume on every axis by pooling each 2x2x2 block of
+    voxels. Axes with an odd length are padded with zeros. Mean pooling rounds to
+    the nearest value when the volume holds integers.
+
+    :param volume: (x, y, z) volume to downsample
+    :param pooling: "max" or "mean"
+    :returns: volume of half the size (rounded up) with the same type, in Fortran
+    order like the volumes written to NRRD
+    """
+    pad = [(0, n % 2) for n in volume.shape]
+    if any(after for _, after in pad):
+        volume = np.pad(volume, pad)
+    nx, ny, nz = (n // 2 for n in volume.shape)
+    # Splitting each axis in Fortran order gives index = offset + 2 * block, which
+    # is a view of the Fortran ordered volumes that ncexport creates
+    blocks = volume.reshape((2, nx, 2, ny, 2, nz), order="F")
+    if pooling == "max":
+        pooled = blocks.max(axis=(0, 2, 4))
+    else:
+        pooled = blocks.mean(axis=(0, 2, 4), dtype=np.float64)
+        if np.issubdtype(volume.dtype, np.integer):
+            pooled = np.rint(pooled)
+    return np.asfortranarray(pooled, dtype=volume.dtype)
+
+
+def decimate_cells(
+    points: npt.NDArray[np.int_],
+    factor: int,
+    values: npt.NDArray[np.float_] | None = None,
+) -> tuple[npt.NDArray[np.int_], npt.NDArray[np.float_] | None]:
+    """
+    Voxel grid decimation of a point cloud: points are binned into cubes of factor
+    grid cells on a side and each occupied cube is kept once.
+
+    :param points: N-by-3 array of [x, y, z] indices
+    :param factor: edge length of the decimation cubes in grid cells
+    :param values: optional value of each point, the max is kept for each cube
+    :returns: M-by-3 array of cube indices (M <= N) and their values, if provided
+    """
+    cells, inverse = np.unique(points // factor, axis=0, return_inverse=True)
+    if values is None:
+        return cells, None
+    if len(values) == 0:
+        return cells, values
+    cell_values = np.full(len(cells), values.min(), dtype=values.dtype)
+    np.maximum.at(cell_values, inverse.reshape(-1), values)
+    return cells, cell_values
+
+
+def decimate_points(
+    points: npt.NDArray[np.int_], factor: int
+) -> npt.NDArray[np.float32]:
+    """
+    Voxel grid decimation of a point cloud, where each occupied cube is replaced by
+    a point at its center, in the coordinates of the original grid.
+
+    :param points: N-by-3 array of [x, y, z] indices
+    :param factor: edge length of the decimation cubes in grid cells
+    :returns: M-by-3 array of cube centers, M <= N
+    """
+    cells = decimate_cells(points, factor)[0]
+    return (cells * factor + (factor - 1) / 2).astype(np.float32)
+
+
+def get_level_header(header: dict[str, Any] | None, factor: int) -> dict[str, Any]:
+    """
+    NRRD header fields for a downsampled level, so that it occupies the same space
+    as the full resolution volume: voxels are factor times larger and the first
+    voxel center moves to the middle of the first pooled block.
+
+    :param header: header fields of the full resolution volume, if any
+    :param factor: downsampling factor of the level
+    :returns: dictionary of header fields
+    """
+    level_header = dict(header or {})
+    origin = np.asarray(level_header.get("space origin", np.zeros(3)), dtype=float)
+    level_header["space dimension"] = 3
+    level_header["space directions"] = np.eye(3) * factor
+    level_header["space origin"] = origin + (factor - 1) / 2
+    return level_header
+
+
+def write_lod_manifest(
+    path: pathlib.Path, levels: list[dict[str, Any]], **metadata: Any
+) -> pathlib.Path:
+    """
+    Write a small JSON manifest describing each level of a pyramid, finest first.
+
+    :param path: filepath of the full resolution output
+    :param levels: one entry per level with at least its file and factor
+    :param metadata: additional top level entries, such as the pooling mode
+    :returns: filepath of the manifest
+    """
+    manifest_path = get_manifest_path(path)
+    with open(manifest_path, "w") as fh:
+        json.dump({**metadata, "levels": levels}, fh, indent=2)
+    return manifest_path
@@ -0,0 +1,98 @@
+"""Morton (Z-order) sorting of point clouds and their division into spatially
+compact chunks, so that viewers can cull chunks that are outside the view."""
+
+from typing import Final
+
+import numpy as np
+import numpy.typing as npt
+
+MORTON_BITS: Final = 21
+"""Bits per coordinate in a 64-bit Morton code, the largest index is 2**21 - 1."""
+
+Chunk = tuple[int, int]
+"""Start and end (exclusive) of a chunk in an array of sorted points."""
+
+
+def spread_bits(v: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint64]:
+    """inserts two zero bits between each of the low 21 bits of every value"""
+    v = v & np.uint64(0x1FFFFF)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def morton_codes(points: npt.NDArray[np.int_ | np.float32]) -> npt.NDArray[np.uint64]:
+    """
+    Interleave the bits of the coordinates of each point into a Morton code, with
+    x in the lowest bit. Sorting by the code orders points along a Z-order curve,
+    so points that are close in the array are also close in space.
+
+    :param points: N-by-3 array of non-negative [x, y, z] coordinates, fractional
+    parts are ignored
+    :returns: the Morton code of each point
+    """
+    coords = points.astype(np.uint64)
+    return (
+        spread_bits(coords[:, 0])
+        | (spread_bits(coords[:, 1]) << np.uint64(1))
+        | (spread_bits(coords[:, 2]) << np.uint64(2))
+    )
+
+
+def get_chunk_bounds(codes: npt.NDArray[np.uint64], max_points: int) -> list[Chunk]:
+    """
+    Divide sorted Morton codes into chunks of at most max_points points. The
+    points are split along an octree, so that each leaf is a cube of space, then
+    consecutive leaves are merged while they fit in a chunk, which keeps chunks
+    compact without creating many tiny ones.
+
+    :param codes: Morton codes in ascending order
+    :param max_points: largest number of points in a chunk
+    :returns: list of (start, end) index ranges covering all codes in order
+    """
+    if len(codes) == 0:
+        return []
+    depth = max(int(codes[-1]).bit_length() + 2, 3) // 3
+    leaves: list[Chunk] = []
+    stack = [(0, len(codes), 3 * (depth - 1))]
+    while stack:
+        start, end, shift = stack.pop()
+        if end - start <= max_points or shift < 0:
+            leaves.append((start, end))
+            continue
+        # The octant of a code at this level is given by 3 bits starting at shift
+        base = int(codes[start]) >> (shift + 3) << (shift + 3)
+        splits = np.searchsorted(
+            codes[start:end], np.array([base + (k << shift) for k in range(1, 8)])
+        )
+        bounds = [start] + [start + int(s) for s in splits] + [end]
+        # Pushed in reverse so that leaves are produced in Morton order
+        for lo, hi in reversed(list(zip(bounds[:-1], bounds[1:]))):
+            if hi > lo:
+                stack.append((lo, hi, shift - 3))
+
+    chunks: list[Chunk] = []
+    for start, end in leaves:
+        if chunks and end - chunks[-1][0] <= max_points:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+def sort_points(
+    points: npt.NDArray[np.int_ | np.float32], max_points: int
+) -> tuple[npt.NDArray[np.intp], list[Chunk]]:
+    """
+    Order a point cloud by Morton code and divide it into chunks of bounded size.
+
+    :param points: N-by-3 array of non-negative [x, y, z] coordinates
+    :param max_points: largest number of points in a chunk
+    :returns: indices that sort the points, and the chunks of the sorted points
+    """
+    codes = morton_codes(points)
+    order = np.argsort(codes, kind="stable")
+    return order, get_chunk_bounds(codes[order], max_points)
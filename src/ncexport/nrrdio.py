@@ -0,0 +1,418 @@
+"""Writers for NRRD files with encodings that pynrrd does not provide: block
+parallel gzip and detached raw data filled through a memory map."""
+
+import concurrent.futures
+import struct
+import pathlib
+import zlib
+from typing import Any, Callable, Final, Iterable, Iterator, NamedTuple
+
+import nrrd
+from nrrd.types import NRRDFieldMap
+import numpy as np
+import numpy.typing as npt
+
+from . import profiling
+from .pipeline import Pipeline, run_pipeline
+
+NRRD_CUSTOM_FIELDS: Final[NRRDFieldMap] = {
+    "original sizes": "int list",
+    "channels": "string list",
+    "channel min": "double list",
+    "channel max": "double list",
+    "block size": "int",
+}
+"""Types of the key/value pairs that ncexport adds to NRRD headers."""
+
+NRRD_TYPES: Final = {
+    np.dtype(np.uint8): "uint8",
+    np.dtype(np.uint16): "uint16",
+    np.dtype(np.float32): "float",
+}
+"""NRRD type names of the data types that ncexport exports."""
+
+GZIP_BLOCK_BYTES: Final = 2**20
+"""Size of the blocks of data compressed independently when using pgzip."""
+
+DEFLATE_WINDOW: Final = 2**15
+"""Number of bytes of the previous block used to prime each pgzip block."""
+
+
+class NrrdEncoding(NamedTuple):
+    """How the data in an NRRD file should be stored."""
+
+    encoding: str = "gzip"
+    """one of options.ENCODINGS"""
+    level: int = 9
+    """compression level from 1 (fastest) to 9 (smallest), ignored if uncompressed"""
+    threads: int | None = None
+    """number of compression threads for pgzip, defaults to the number of CPUs"""
+
+
+def format_header(
+    shape: tuple[int, ...],
+    dtype: np.dtype[Any],
+    encoding: str,
+    fields: dict[str, Any] | None = None,
+    data_file: str | None = None,
+) -> bytes:
+    """
+    Format an NRRD header without writing any data, for data that is written
+    separately. Data is assumed to be stored with the first axis varying fastest,
+    which matches the default index order of pynrrd.
+
+    :param shape: shape of the volume
+    :param dtype: numpy type of the volume, one of the keys of NRRD_TYPES
+    :param encoding: value of the NRRD encoding field, e.g. "raw" or "gzip"
+    :param fields: additional header fields, such as those from get_crop_header
+    :param data_file: name of the detached data file, if any
+    :returns: the header, including the blank line that terminates it
+    """
+    lines = [
+        "NRRD0005",
+        "# This NRRD file was generated by ncexport",
+        f"type: {NRRD_TYPES[dtype]}",
+        f"dimension: {len(shape)}",
+    ]
+    fields = dict(fields or {})
+    if "space dimension" in fields:
+        lines.append(f"space dimension: {fields.pop('space dimension')}")
+    lines.append(f"sizes: {nrrd.format_number_list(np.array(shape))}")
+    if "space directions" in fields:
+        directions = nrrd.format_optional_matrix(fields.pop("space directions"))
+        lines.append(f"space directions: {directions}")
+    if "kinds" in fields:
+        lines.append(f"kinds: {' '.join(fields.pop('kinds'))}")
+    lines.append(f"encoding: {encoding}")
+    if dtype.itemsize > 1:
+        lines.append("endian: little")
+    if "space origin" in fields:
+        lines.append(f"space origin: {nrrd.format_vector(fields.pop('space origin'))}")
+    if data_file is not None:
+        lines.append(f"data file: {data_file}")
+    for key, value in fields.items():
+        if NRRD_CUSTOM_FIELDS.get(key) in ("int list", "double list"):
+            value = nrrd.format_number_list(np.asarray(value))
+        elif NRRD_CUSTOM_FIELDS.get(key) == "string list":
+            value = " ".join(value)
+        lines.append(f"{key}:={value}")
+    return ("\n".join(lines) + "\n\n").encode("ascii")
+
+
+def deflate_block(
+    block: memoryview, previous: memoryview | None, level: int, last: bool
+) -> bytes:
+    """
+    Compress one block of a larger stream as raw deflate data. The block is primed
+    with the end of the previous block so that matches can span block boundaries,
+    and all but the last block end on a byte boundary without finishing the stream,
+    so that the compressed blocks can be concatenated into a single deflate stream.
+
+    :param block: data to compress
+    :param previous: the block before this one, or None for the first block
+    :param level: compression level from 1 to 9
+    :param last: whether this is the final block of the stream
+    :returns: raw deflate data for the block
+    """
+    if previous is None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=previous[-DEFLATE_WINDOW:]
+        )
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    with profiling.stage("compress") as counts:
+        deflated = compressor.compress(block) + compressor.flush(flush_mode)
+        counts.bytes_read = len(block)
+        counts.bytes_written = len(deflated)
+    return deflated
+
+
+def gzip_parallel(
+    data: memoryview,
+    level: int = 9,
+    threads: int | None = None,
+    block_bytes: int = GZIP_BLOCK_BYTES,
+) -> Iterator[bytes]:
+    """
+    Compress data as a single member gzip stream using a pool of threads, each
+    compressing independent blocks (zlib releases the GIL while compressing). The
+    result is readable by any gzip decoder, including the one used by three.js.
+
+    :param data: bytes to compress
+    :param level: compression level from 1 to 9
+    :param threads: number of compression threads, defaults to the number of CPUs
+    :param block_bytes: size of the independently compressed blocks
+    :returns: generator of consecutive pieces of the gzip stream
+    """
+    blocks = [data[i : i + block_bytes] for i in range(0, len(data), block_bytes)]
+    if not blocks:
+        blocks = [data]
+    # magic, deflate, no flags, no mtime, no extra flags, unknown OS
+    yield b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+    crc = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        compressed = pool.map(
+            deflate_block,
+            blocks,
+            [None] + blocks[:-1],
+            [level] * len(blocks),
+            [i == len(blocks) - 1 for i in range(len(blocks))],
+        )
+        for block, deflated in zip(blocks, compressed):
+            crc = zlib.crc32(block, crc)
+            yield deflated
+    yield struct.pack("<II", crc, len(data) & 0xFFFFFFFF)
+
+
+def iter_volume_blocks(
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    block_bytes: int = GZIP_BLOCK_BYTES,
+) -> Iterator[npt.NDArray[np.uint8 | np.uint16 | np.float32]]:
+    """
+    Split a Fortran ordered volume into consecutive blocks of whole planes along
+    its last axis, which are contiguous pieces of the data in file order.
+
+    :param volume: volume to split, with the first axis varying fastest
+    :param block_bytes: approximate size of each block, at least one plane
+    :returns: generator of views of the volume
+    """
+    fortran = np.asfortranarray(volume)
+    plane_bytes = max(1, fortran[..., :1].nbytes)
+    depth = max(1, block_bytes // plane_bytes)
+    for start in range(0, fortran.shape[-1], depth):
+        yield fortran[..., start : start + depth]
+
+
+def get_block_bytes(
+    block: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+) -> memoryview:
+    """bytes of a block of planes in file order, without copying them"""
+    return np.asfortranarray(block).T.data.cast("B")
+
+
+def write_nrrd_blocks(
+    nrrd_file: pathlib.Path,
+    shape: tuple[int, ...],
+    dtype: np.dtype[Any],
+    blocks: Iterable[npt.NDArray[np.uint8 | np.uint16 | np.float32]],
+    fields: dict[str, Any] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    pipeline: Pipeline = Pipeline(),
+) -> None:
+    """
+    Write an NRRD file from consecutive blocks of planes of a volume, such as those
+    from iter_volume_blocks, as they are produced. Producing a block, compressing
+    it and writing it to the file run as concurrent stages of a pipeline. gzip
+    data is compressed as one stream by a single stage, while pgzip blocks are
+    compressed independently by a pool of threads as with write_nrrd. Detached
+    data is not supported, since it is filled in place.
+
+    :param nrrd_file: output filepath
+    :param shape: shape of the whole volume
+    :param dtype: numpy type of the volume
+    :param blocks: blocks of planes along the last axis, in order
+    :param fields: additional header fields
+    :param encoding: raw, gzip or pgzip, with the compression level and threads
+    :param pipeline: number of stages and depth of the queues between them
+    """
+    if encoding.encoding == "detached":
+        raise ValueError("detached volumes are filled in place")
+    compressed = encoding.encoding != "raw"
+    header = format_header(shape, dtype, "gzip" if compressed else "raw", fields)
+    if encoding.encoding == "pgzip":
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=encoding.threads)
+        previous: list[memoryview | None] = [None]
+
+        def submit(block: memoryview) -> tuple[memoryview, Any]:
+            # Every block is flushed without ending the stream, an empty final
+            # block is added once the last one is known
+            future = pool.submit(
+                deflate_block, block, previous[0], encoding.level, False
+            )
+            previous[0] = block
+            return block, future
+
+        def resolve(item: tuple[memoryview, Any]) -> tuple[memoryview, bytes]:
+            return item[0], item[1].result()
+
+        steps: list[Callable[[Any], Any]] = [get_block_bytes, submit, resolve]
+    elif compressed:
+        # wbits of 16 + MAX_WBITS adds the gzip header and trailer to the stream
+        compressor = zlib.compressobj(
+            encoding.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+
+        def compress(block: memoryview) -> tuple[memoryview, bytes]:
+            with profiling.stage("compress") as counts:
+                deflated = compressor.compress(block)
+                counts.bytes_read = len(block)
+                counts.bytes_written = len(deflated)
+            return block, deflated
+
+        steps = [get_block_bytes, compress]
+    else:
+
+        def passthrough(block: memoryview) -> tuple[memoryview, memoryview]:
+            return block, block
+
+        steps = [get_block_bytes, passthrough]
+
+    crc = 0
+    size = 0
+    with open(nrrd_file, "wb") as fh:
+        fh.write(header)
+        if encoding.encoding == "pgzip":
+            # magic, deflate, no flags, no mtime, no extra flags, unknown OS
+            fh.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+        try:
+            for data, piece in run_pipeline(blocks, steps, pipeline):
+                if encoding.encoding == "pgzip":
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                with profiling.stage("write NRRD") as counts:
+                    fh.write(piece)
+                    counts.bytes_written = len(piece)
+        finally:
+            if encoding.encoding == "pgzip":
+                pool.shutdown()
+        if encoding.encoding == "pgzip":
+            # A final empty block with fixed codes ends the deflate stream
+            fh.write(b"\x03\x00")
+            fh.write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+        elif compressed:
+            fh.write(compressor.flush())
+
+
+def write_nrrd(
+    nrrd_file: pathlib.Path,
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    fields: dict[str, Any] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+    pipeline: Pipeline | None = None,
+) -> None:
+    """
+    Write a volume to an NRRD file using any of the supported encodings. To avoid
+    holding a detached volume in memory, create it with create_detached_nrrd and
+    fill it in place instead.
+
+    :param nrrd_file: output filepath
+    :param volume: data to write, with x varying fastest in the file
+    :param fields: additional header fields
+    :param encoding: encoding, compression level and threads to use
+    :param pipeline: optionally compress and write the volume in blocks with
+    write_nrrd_blocks, so that compressing overlaps with writing
+    """
+    if pipeline is not None and encoding.encoding != "detached":
+        write_nrrd_blocks(
+            nrrd_file,
+            volume.shape,
+            volume.dtype,
+            iter_volume_blocks(volume),
+            fields,
+            encoding,
+            pipeline,
+        )
+        return
+    if encoding.encoding == "detached":
+        out = create_detached_nrrd(nrrd_file, volume.shape, volume.dtype.type, fields)
+        with profiling.stage("write NRRD") as counts:
+            out[...] = volume
+            out.flush()
+            counts.bytes_written = out.nbytes
+        return
+    if encoding.encoding != "pgzip":
+        header = dict(fields or {})
+        header["encoding"] = encoding.encoding
+        # pynrrd compresses while writing, so gzip has a stage of its own name
+        name = "write NRRD" if encoding.encoding == "raw" else "compress+write NRRD"
+        with profiling.stage(name) as counts:
+            nrrd.write(
+                str(nrrd_file),
+                volume,
+                header,
+                custom_field_map=NRRD_CUSTOM_FIELDS,
+                compression_level=encoding.level,
+            )
+            counts.bytes_read = volume.nbytes
+            counts.bytes_written = profiling.get_file_bytes(nrrd_file)
+        return
+    # The transpose of a Fortran ordered volume is C contiguous and exposes the
+    # voxels in file order without copying them
+    fortran = np.asfortranarray(volume)
+    data = fortran.T.data.cast("B")
+    with open(nrrd_file, "wb") as fh:
+        fh.write(format_header(volume.shape, volume.dtype, "gzip", fields))
+        for piece in gzip_parallel(data, encoding.level, encoding.threads):
+            with profiling.stage("write NRRD") as counts:
+                fh.write(piece)
+                counts.bytes_written = len(piece)
+
+
+def encode_nrrd(
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    fields: dict[str, Any] | None = None,
+    encoding: NrrdEncoding = NrrdEncoding(),
+) -> bytes:
+    """
+    Encode a volume as the contents of an NRRD file with attached data, to send it
+    somewhere without writing a file.
+
+    :param volume: data to encode, with x varying fastest in the file
+    :param fields: additional header fields
+    :param encoding: raw, gzip or pgzip, with the compression level and threads
+    :returns: the header followed by the data
+    :raises: ValueError for detached data, which needs two files
+    """
+    if encoding.encoding == "detached":
+        raise ValueError("detached NRRD data cannot be encoded as a single file")
+    compressed = encoding.encoding != "raw"
+    header = format_header(
+        volume.shape, volume.dtype, "gzip" if compressed else "raw", fields
+    )
+    data = get_block_bytes(volume)
+    if encoding.encoding == "pgzip":
+        pieces = list(gzip_parallel(data, encoding.level, encoding.threads))
+    elif compressed:
+        # wbits of 16 + MAX_WBITS adds the gzip header and trailer to the stream
+        compressor = zlib.compressobj(
+            encoding.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+        with profiling.stage("compress") as counts:
+            pieces = [compressor.compress(data), compressor.flush()]
+            counts.bytes_read = len(data)
+            counts.bytes_written = sum(len(piece) for piece in pieces)
+    else:
+        pieces = [data.tobytes()]
+    return header + b"".join(pieces)
+
+
+def get_header_path(nrrd_file: pathlib.Path, encoding: NrrdEncoding) -> pathlib.Path:
+    """filepath of the file holding the NRRD header for the given encoding"""
+    if encoding.encoding == "detached":
+        return nrrd_file.with_suffix(".nhdr")
+    return nrrd_file
+
+
+def create_detached_nrrd(
+    nrrd_file: pathlib.Path,
+    shape: tuple[int, ...],
+    dtype: type[np.uint8 | np.uint16 | np.float32],
+    fields: dict[str, Any] | None = None,
+) -> np.memmap[Any, np.dtype[Any]]:
+    """
+    Write a .nhdr header and create the zero-filled .raw data file it refers to,
+    returning a memory map of the data so that the volume can be filled in place
+    without holding it in memory.
+
+    :param nrrd_file: output filepath, the suffix is replaced by .nhdr and .raw
+    :param shape: shape of the volume
+    :param dtype: numpy type of the volume
+    :param fields: additional header fields
+    :returns: writable memory map of the data file, call flush() when done
+    """
+    header_path = get_header_path(nrrd_file, NrrdEncoding("detached"))
+    raw_path = nrrd_file.with_suffix(".raw")
+    header = format_header(shape, np.dtype(dtype), "raw", fields, raw_path.name)
+    header_path.write_bytes(header)
+    return np.memmap(raw_path, dtype=dtype, mode="w+", shape=shape, order="F")
@@ -0,0 +1,112 @@
+"""Coarse grids describing where a volume holds data, written next to the volume
+so that a ray marching shader can skip over empty space."""
+
+import pathlib
+from typing import Any, Final, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from . import lod, nrrdio
+
+MAX_DISTANCE: Final = 255
+"""Largest distance stored in a distance field, farther blocks are clamped."""
+
+
+class OccupancyGrid(NamedTuple):
+    """Which grid to export alongside a volume."""
+
+    mode: str = "max"
+    """one of options.OCCUPANCY_MODES"""
+    block_size: int = 8
+    """edge length in voxels of the block covered by each grid cell"""
+
+
+def get_occupancy_path(path: pathlib.Path, mode: str) -> pathlib.Path:
+    """filepath of the occupancy grid for an output filepath"""
+    return path.with_name(f"{path.stem}_{mode}grid{path.suffix}")
+
+
+def get_block_max(
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32], block_size: int
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """
+    Max of each cubic block of voxels. The last three axes are the spatial ones,
+    any leading (channel) axis is kept. Blocks at the far edges are smaller when an
+    axis is not a multiple of the block size, rather than padding the volume.
+
+    :param volume: volume to reduce, e.g. in (x, y, z) or (channels, x, y, z) order
+    :param block_size: edge length of a block in voxels
+    :returns: volume of block maxima, in Fortran order like the exported volumes
+    """
+    grid = volume
+    for axis in range(volume.ndim - 3, volume.ndim):
+        starts = np.arange(0, volume.shape[axis], block_size)
+        grid = np.maximum.reduceat(grid, starts, axis=axis)
+    return np.asfortranarray(grid)
+
+
+def get_distance_field(
+    occupied: npt.NDArray[np.bool_], max_distance: int = MAX_DISTANCE
+) -> npt.NDArray[np.uint8]:
+    """
+    Chebyshev distance from every cell of a grid to the nearest occupied cell, so
+    that a ray in a cell at distance d can advance d - 1 cells along every axis
+    without passing an occupied cell. Computed by repeatedly growing the occupied
+    region by one cell, which for the Chebyshev metric is a dilation by a cube
+    that separates into one step along each axis.
+
+    :param occupied: boolean grid of cells that hold data
+    :param max_distance: largest distance to compute, at most 255
+    :returns: distance of each cell, 0 where occupied and max_distance where no
+    occupied cell is closer
+    """
+    distance = np.full(occupied.shape, max_distance, dtype=np.uint8, order="F")
+    distance[occupied] = 0
+    reached = occupied.copy()
+    for step in range(1, max_distance):
+        grown = reached.copy()
+        for axis in range(grown.ndim):
+            view = np.moveaxis(grown, axis, 0)
+            source = view.copy()
+            view[1:] |= source[:-1]
+            view[:-1] |= source[1:]
+        added = grown & ~reached
+        if not added.any():
+            break
+        distance[added] = step
+        reached = grown
+    return distance
+
+
+def write_occupancy_grid(
+    nrrd_file: pathlib.Path,
+    volume: npt.NDArray[np.uint8 | np.uint16 | np.float32],
+    occupancy: OccupancyGrid,
+    header: dict[str, Any] | None = None,
+    encoding: nrrdio.NrrdEncoding = nrrdio.NrrdEncoding(),
+) -> pathlib.Path:
+    """
+    Write the occupancy grid of an exported volume to a companion NRRD. A max grid
+    has the type of the volume and holds the max of each block, over all channels
+    of a multi-channel volume. A distance field is uint8 and holds the distance in
+    blocks to the nearest block with any non-zero voxel. The grid occupies the
+    same space as the volume, with the block size stored in the header.
+
+    :param nrrd_file: filepath of the exported volume
+    :param volume: the exported volume, in (x, y, z) or (channels, x, y, z) order
+    :param occupancy: kind of grid and block size
+    :param header: header fields of the volume, without any channel fields
+    :param encoding: how the NRRD data is stored and compressed
+    :returns: filepath of the grid
+    """
+    grid = get_block_max(volume, occupancy.block_size)
+    if grid.ndim == 4:
+        grid = np.asfortranarray(grid.max(axis=0))
+    if occupancy.mode == "distance":
+        grid = get_distance_field(grid != 0)
+    grid_header = lod.get_level_header(header, occupancy.block_size)
+    grid_header["block size"] = occupancy.block_size
+    grid_file = get_occupancy_path(nrrd_file, occupancy.mode)
+    nrrdio.write_nrrd(grid_file, grid, grid_header, encoding)
+    return nrrdio.get_header_path(grid_file, encoding)
@@ -0,0 +1,122 @@
+"""Defaults and choices of the command line options, shared with the modules
+that use them. Nothing heavy is imported here, so that the parsers can be built,
+and usage or argument errors printed, without loading the export modules and
+their netCDF4, gltflib, nrrd and PIL dependencies."""
+
+from typing import Final, NamedTuple
+
+# Reading netCDF files, shared by the export tools
+CACHE_DIR_ENV: Final = "NCEXPORT_CACHE_DIR"
+"""Environment variable that overrides the default cache directory."""
+
+DEFAULT_CACHE_BYTES: Final = 4 * 2**30
+"""Default size cap of the cache, least recently used arrays are evicted past it."""
+
+DEFAULT_SLAB_BYTES: Final = 64 * 2**20
+"""Default memory budget (in bytes) for a single hyperslab read from netCDF."""
+
+GRID_SPACING: Final = 40.0
+"""Default grid spacing in metres, that of the RICO and MISR datasets."""
+
+
+# nc2nrrd
+ENCODINGS: Final = ("raw", "gzip", "pgzip", "detached")
+"""Supported ways of storing NRRD data. pgzip is gzip compressed by a pool of
+threads, detached writes a .nhdr header next to an uncompressed .raw file."""
+
+POOLING_MODES: Final = ("max", "mean")
+"""Ways of combining each 2x2x2 block of voxels when downsampling a volume."""
+
+MAX_LOD_LEVELS: Final = 3
+"""Coarsest level that can be requested, downsampled by 2**MAX_LOD_LEVELS."""
+
+OCCUPANCY_MODES: Final = ("max", "distance")
+"""Kinds of grid: the max value of each block, or the distance to the nearest
+block that holds data."""
+
+MAX_CHANNELS: Final = 4
+"""Most variables that can be packed into one volume, as RGBA."""
+
+BRICK_SIZES: Final = (16, 32, 64, 128)
+"""Supported edge lengths of a brick, in voxels."""
+
+MAX_CLIP_PERCENTILE: Final = 50.0
+"""Clipping percentiles must be below this, or the scale would be empty."""
+
+
+# ncradiance
+NADIR_ANGLE: Final = 8
+"""Index of the nadir viewing zenith angle in MISR radiance files."""
+
+TILE_SIZE: Final = 256
+"""Edge length of a tile in pixels."""
+
+TILE_FORMATS: Final = ("png", "webp")
+"""Image formats that tiles can be written in."""
+
+
+# ncbatch
+OUTPUT_EXTENSIONS: Final = {
+    "glb": ".glb",
+    "gltf": ".gltf",
+    "nrrd": ".nrrd",
+    "png": ".png",
+}
+"""File extension written for each kind of output."""
+
+MANIFEST_NAME: Final = "ncexport_manifest.json"
+"""Default filename of the manifest, created in the output directory."""
+
+SETTLE_SECONDS: Final = 5.0
+"""A file is complete once its size and modification time stay unchanged this long."""
+
+POLL_SECONDS: Final = 2.0
+"""Time between scans of the watched directories."""
+
+
+# ncbench
+class Tier(NamedTuple):
+    """Size of the synthetic inputs of one benchmark tier."""
+
+    grid: tuple[int, int, int]
+    """(x, y, z) shape of the cloud variable"""
+    image: tuple[int, int]
+    """(x, y) shape of each radiance image"""
+
+
+SIZE_TIERS: Final = {
+    "small": Tier((64, 64, 32), (256, 256)),
+    "medium": Tier((256, 256, 64), (1024, 1024)),
+    "large": Tier((512, 512, 128), (2048, 2048)),
+}
+"""Synthetic input sizes, the large tier fills the default 512 voxel NRRD cube."""
+
+BENCHMARKS: Final = (
+    "parse_netcdf",
+    "get_nonzero_points",
+    "map_points_nrrd",
+    "create_gltf_model",
+    "create_nrrd_model",
+    "export_radiance_image",
+)
+"""Functions that are benchmarked, in the order they run."""
+
+DEFAULT_DIMENSIONS: Final = ("nt", "nz", "ny", "nx")
+"""Dimension order of the cloud variable in the LES files."""
+
+DEFAULT_SPARSITY: Final = 0.02
+"""Fraction of voxels holding cloud in the synthetic files."""
+
+
+# ncserve
+DEFAULT_HOST: Final = "127.0.0.1"
+"""Default address to listen on, only reachable from this machine."""
+
+DEFAULT_PORT: Final = 8650
+"""Default TCP port to listen on."""
+
+DEFAULT_MEMORY_BYTES: Final = 2 * 2**30
+"""Default memory budget (in bytes) for decoded variables kept between requests."""
+
+DEFAULT_OPEN_DATASETS: Final = 16
+"""Default number of netCDF files kept open between requests."""
@@ -0,0 +1,161 @@
+"""Pipelined execution: a stream of items passes through a sequence of steps
+that run concurrently on a pool of threads, connected by bounded queues, so that
+reading, computing and writing overlap instead of running one after another."""
+
+import concurrent.futures
+import queue
+import threading
+from typing import Any, Callable, Final, Iterable, Iterator, NamedTuple, Sequence
+
+DEFAULT_QUEUE_DEPTH: Final = 4
+"""Default number of items that can wait between two stages."""
+
+POLL_SECONDS: Final = 0.1
+"""How often a blocked stage checks whether the pipeline has been stopped."""
+
+
+class Pipeline(NamedTuple):
+    """How a stream of work is spread over concurrent stages."""
+
+    stages: int = 3
+    """number of threads the steps are spread over, 1 runs them in sequence"""
+    queue_depth: int = DEFAULT_QUEUE_DEPTH
+    """number of items that can wait between two stages, which bounds memory"""
+
+
+class Failure(NamedTuple):
+    """An exception raised by a stage, passed down the pipeline to the consumer."""
+
+    error: BaseException
+
+
+DONE: Final = object()
+"""Marker passed down the pipeline once the source is exhausted."""
+
+
+def get_stage_sizes(units: int, stages: int) -> list[int]:
+    """
+    Number of consecutive units of work in each stage when units are spread as
+    evenly as possible over stages, earlier stages taking any extra unit.
+
+    :param units: the source plus the number of steps
+    :param stages: requested number of stages, at most units are used
+    :returns: size of each stage, summing to units
+    """
+    stages = max(1, min(stages, units))
+    size, extra = divmod(units, stages)
+    return [size + 1] * extra + [size] * (stages - extra)
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    steps: Sequence[Callable[[Any], Any]],
+    pipeline: Pipeline = Pipeline(),
+) -> Iterator[Any]:
+    """
+    Apply each step in turn to every item of a source, with the iteration of the
+    source and the steps spread over pipeline.stages threads. Each stage applies
+    its steps to one item at a time and hands it to the next stage through a
+    queue of at most pipeline.queue_depth items, so that a slow stage holds back
+    the ones before it instead of letting items pile up in memory. Items are
+    produced in the order of the source. A step may keep state between items,
+    since each step is only ever called from one thread.
+
+    An exception in any stage stops the pipeline and is raised to the consumer.
+    If the consumer stops early, the stages are stopped and a source with a
+    close method, such as a generator, is closed.
+
+    :param source: items to process, iterated on the first stage
+    :param steps: functions applied in order to each item
+    :param pipeline: number of stages and depth of the queues between them
+    :returns: generator of the processed items
+    """
+    sizes = get_stage_sizes(1 + len(steps), pipeline.stages)
+    if len(sizes) == 1:
+        for item in source:
+            for step in steps:
+                item = step(item)
+            yield item
+        return
+
+    groups: list[Sequence[Callable[[Any], Any]]] = []
+    start = 0
+    for size in sizes:
+        # The first stage spends one of its units iterating the source
+        stop = start + size - (1 if not groups else 0)
+        groups.append(steps[start:stop])
+        start = stop
+    stop_event = threading.Event()
+    queues: list[queue.Queue[Any]] = [
+        queue.Queue(maxsize=max(1, pipeline.queue_depth)) for _ in groups
+    ]
+
+    def put(out: queue.Queue[Any], item: Any) -> bool:
+        while not stop_event.is_set():
+            try:
+                out.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(inq: queue.Queue[Any]) -> Any:
+        while not stop_event.is_set():
+            try:
+                return inq.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return DONE
+
+    def apply(group: Sequence[Callable[[Any], Any]], item: Any) -> Any:
+        for step in group:
+            item = step(item)
+        return item
+
+    def run_source(
+        group: Sequence[Callable[[Any], Any]], out: queue.Queue[Any]
+    ) -> None:
+        try:
+            for item in source:
+                if not put(out, apply(group, item)):
+                    return
+            put(out, DONE)
+        except BaseException as err:
+            put(out, Failure(err))
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    def run_stage(
+        group: Sequence[Callable[[Any], Any]],
+        inq: queue.Queue[Any],
+        out: queue.Queue[Any],
+    ) -> None:
+        while True:
+            item = get(inq)
+            if item is DONE or isinstance(item, Failure):
+                put(out, item)
+                return
+            try:
+                item = apply(group, item)
+            except BaseException as err:
+                put(out, Failure(err))
+                return
+            if not put(out, item):
+                return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        pool.submit(run_source, groups[0], queues[0])
+        for i in range(1, len(groups)):
+            pool.submit(run_stage, groups[i], queues[i - 1], queues[i])
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is DONE:
+                    break
+                if isinstance(item, Failure):
+                    raise item.error
+                yield item
+        finally:
+            stop_event.set()
@@ -0,0 +1,248 @@
+"""Per-stage profiling of an export. Stages of the conversion are wrapped in
+stage(), which records wall time, CPU time, memory and the amount of data handled
+while profiling is enabled, and does nothing otherwise."""
+
+import contextlib
+import json
+import pathlib
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Final, Iterable, Iterator, NamedTuple
+
+if sys.platform != "win32":
+    import resource
+
+RSS_UNIT: Final = 1 if sys.platform == "darwin" else 1024
+"""Bytes per unit of ru_maxrss, which macOS reports in bytes and Linux in KiB."""
+
+
+class StageMetrics(NamedTuple):
+    """Totals over every call of one stage."""
+
+    name: str
+    calls: int = 0
+    wall_seconds: float = 0.0
+    """time spent in the stage, summed over threads and processes running it"""
+    cpu_seconds: float = 0.0
+    """CPU time of the threads running the stage"""
+    peak_rss_bytes: int = 0
+    """highest resident set size of the process when the stage ended"""
+    rss_growth_bytes: int = 0
+    """increase of the peak resident set size while in the stage"""
+    bytes_read: int = 0
+    """bytes taken in, decoded from files or consumed by compression"""
+    bytes_written: int = 0
+    """bytes put out, written to files or produced by compression"""
+    items: int = 0
+    """voxels, points or pixels handled by the stage"""
+
+
+@dataclass
+class StageCounts:
+    """Amounts of data handled by one call of a stage, filled in by the stage."""
+
+    bytes_read: int = 0
+    bytes_written: int = 0
+    items: int = 0
+
+
+class Profile:
+    """Metrics of the stages run since profiling was enabled."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.stages: dict[str, StageMetrics] = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def add(self, metrics: StageMetrics) -> None:
+        """adds the metrics of one or more calls to the totals of a stage"""
+        with self.lock:
+            total = self.stages.get(metrics.name, StageMetrics(metrics.name))
+            self.stages[metrics.name] = StageMetrics(
+                metrics.name,
+                total.calls + metrics.calls,
+                total.wall_seconds + metrics.wall_seconds,
+                total.cpu_seconds + metrics.cpu_seconds,
+                max(total.peak_rss_bytes, metrics.peak_rss_bytes),
+                total.rss_growth_bytes + metrics.rss_growth_bytes,
+                total.bytes_read + metrics.bytes_read,
+                total.bytes_written + metrics.bytes_written,
+                total.items + metrics.items,
+            )
+
+
+_profile: Profile | None = None
+"""Profile collecting stages in this process, None while profiling is disabled."""
+
+
+def get_peak_rss(children: bool = False) -> int:
+    """highest resident set size of this process so far in bytes, or of its largest
+    terminated child process, such as a worker process. 0 if unknown"""
+    if sys.platform == "win32":
+        return 0
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss * RSS_UNIT
+
+
+def get_children_cpu() -> float:
+    """CPU time of the terminated child processes, such as worker processes"""
+    if sys.platform == "win32":
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def is_enabled() -> bool:
+    """whether stages are being recorded in this process"""
+    return _profile is not None
+
+
+def enable() -> None:
+    """start recording stages in this process, discarding any earlier records"""
+    global _profile
+    _profile = Profile()
+
+
+def disable() -> Profile | None:
+    """stop recording stages and return what was recorded, if anything"""
+    global _profile
+    profile, _profile = _profile, None
+    return profile
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[StageCounts]:
+    """
+    Record one call of a stage of the export. The stage can report the data it
+    handles through the yielded counts, which are discarded when profiling is
+    disabled. Wall and CPU time are measured on the calling thread, so stages
+    that run concurrently on several threads are each timed separately.
+
+    :param name: name of the stage, calls with the same name are added together
+    :returns: context manager yielding counts for the stage to fill in
+    """
+    counts = StageCounts()
+    profile = _profile
+    if profile is None:
+        yield counts
+        return
+    rss_before = get_peak_rss()
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield counts
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.thread_time() - start_cpu
+        rss_after = get_peak_rss()
+        profile.add(
+            StageMetrics(
+                name,
+                1,
+                wall,
+                cpu,
+                rss_after,
+                rss_after - rss_before,
+                counts.bytes_read,
+                counts.bytes_written,
+                counts.items,
+            )
+        )
+
+
+def get_file_bytes(*paths: pathlib.Path) -> int:
+    """total size of the files that exist among paths, for bytes written"""
+    return sum(path.stat().st_size for path in paths if path.is_file())
+
+
+def call_profiled(
+    enabled: bool, func: Callable[..., Any], *args: Any
+) -> tuple[Any, list[StageMetrics]]:
+    """
+    Call a function in a worker process, recording its stages if profiling is
+    enabled in the parent, so that they can be merged into the parent's profile
+    with merge.
+
+    :param enabled: whether profiling is enabled in the parent process
+    :param func: function to call
+    :param args: positional arguments of the function
+    :returns: the result of the function and the stages it ran
+    """
+    if not enabled:
+        return func(*args), []
+    enable()
+    try:
+        result = func(*args)
+    finally:
+        profile = disable()
+    return result, list(profile.stages.values()) if profile is not None else []
+
+
+def merge(stages: Iterable[StageMetrics]) -> None:
+    """adds stages recorded in a worker process to the profile of this process"""
+    profile = _profile
+    if profile is not None:
+        for metrics in stages:
+            profile.add(metrics)
+
+
+def get_report(profile: Profile, **fields: Any) -> dict[str, Any]:
+    """
+    Summary of a profile for monitoring, with the total time and memory of the
+    whole run next to the totals of each stage.
+
+    :param profile: profile returned by disable
+    :param fields: additional top level entries, such as the command line
+    :returns: JSON serializable dictionary
+    """
+    return {
+        **fields,
+        "wall_seconds": time.perf_counter() - profile.start_wall,
+        "cpu_seconds": time.process_time() - profile.start_cpu,
+        "children_cpu_seconds": get_children_cpu(),
+        "peak_rss_bytes": max(get_peak_rss(), get_peak_rss(children=True)),
+        "stages": [metrics._asdict() for metrics in profile.stages.values()],
+    }
+
+
+def format_bytes(count: float) -> str:
+    """human readable size in binary units"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if count < 1024 or unit == "GiB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GiB"
+
+
+def print_report(report: dict[str, Any]) -> None:
+    """prints the stages of a report from get_report as a table"""
+    columns = (
+        f"{'stage':<20} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'peak RSS':>11}"
+        f" {'RSS +':>11} {'read':>11} {'written':>11} {'items':>12}"
+    )
+    print(f"\n{columns}\n{'-' * len(columns)}")
+    for metrics in report["stages"]:
+        print(
+            f"{metrics['name']:<20} {metrics['calls']:>6}"
+            f" {metrics['wall_seconds']:>9.3f} {metrics['cpu_seconds']:>9.3f}"
+            f" {format_bytes(metrics['peak_rss_bytes']):>11}"
+            f" {format_bytes(metrics['rss_growth_bytes']):>11}"
+            f" {format_bytes(metrics['bytes_read']):>11}"
+            f" {format_bytes(metrics['bytes_written']):>11}"
+            f" {metrics['items']:>12}"
+        )
+    print("-" * len(columns))
+    print(
+        f"{'total':<20} {'':>6} {report['wall_seconds']:>9.3f}"
+        f" {report['cpu_seconds'] + report['children_cpu_seconds']:>9.3f}"
+        f" {format_bytes(report['peak_rss_bytes']):>11}"
+    )
+
+
+def write_report(report_file: pathlib.Path, report: dict[str, Any]) -> None:
+    """writes a report from get_report as JSON"""
+    with open(report_file, "w") as fh:
+        json.dump(report, fh, indent=2)
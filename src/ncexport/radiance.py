@@ -1,32 +1,264 @@
-import matplotlib as mpl
+import concurrent.futures
+import io
 import netCDF4
 import numpy as np
 import pathlib
 from PIL import Image
 import numpy.typing as npt
+from typing import Final, Sequence
 
-from .convert import quantize
+from . import arraycache, profiling, tiles
+from .arraycache import ArrayCache
+from .convert import Region, get_region_selection, quantize_array, write_value_stats
+from .stats import StreamingStats
+from .options import NADIR_ANGLE
 
+COLORMAP: Final = "Blues_r"
+"""Matplotlib colormap applied to radiance images."""
+
+
+def get_angle_count(nc_file: pathlib.Path, variable: str = "rad") -> int:
+    """number of viewing angles (length of the last dimension) of a variable"""
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        return rootgrp.variables[variable].shape[-1]
+
+
+def get_image_shape(nc_file: pathlib.Path, variable: str = "rad") -> tuple[int, int]:
+    """(x, y) shape of the image at each viewing angle of a variable"""
+    with netCDF4.Dataset(nc_file, "r") as rootgrp:
+        shape = rootgrp.variables[variable].shape
+        return shape[0], shape[1]
+
+
+def read_radiance(
+    nc_file: pathlib.Path,
+    variable: str,
+    angles: Sequence[int],
+    cache: ArrayCache | None = None,
+    region: Region | None = None,
+) -> npt.NDArray[np.float_]:
+    """
+    Read the images at several viewing angles with a single read of the variable,
+    through the cache if provided. Masked pixels are set to the minimum of the
+    unmasked pixels, so that they map to the bottom of the colormap.
+
+    :param nc_file: netCDF4 file to read
+    :param variable: the radiance variable, with the viewing angle as last dimension
+    :param angles: indices of the viewing angles to read
+    :param cache: optional cache of decoded variables
+    :param region: optional (x, y) index ranges to read instead of whole images
+    :returns: (x, y, angle) array holding the selected angles in order
+    """
+    key = None
+    if cache is not None:
+        selection = "angles" + ",".join(str(angle) for angle in angles)
+        selection += get_region_selection(region)
+        key = arraycache.get_cache_key(nc_file, variable, selection)
+        cached = arraycache.load_array(cache, key)
+        if cached is not None:
+            return cached
+    with profiling.stage("read radiance") as counts:
+        with netCDF4.Dataset(nc_file, "r") as rootgrp:
+            if region is None:
+                radarr = rootgrp.variables[variable][:, :, list(angles)]
+            else:
+                (x0, x1), (y0, y1) = region
+                radarr = rootgrp.variables[variable][x0:x1, y0:y1, list(angles)]
+        if np.ma.is_masked(radarr):
+            radarr = np.ma.filled(radarr, np.ma.min(radarr))
+        radarr = np.asarray(radarr)
+        counts.bytes_read = radarr.nbytes
+        counts.items = radarr.size
+    if cache is not None and key is not None:
+        arraycache.store_array(cache, key, radarr)
+    return radarr
+
+
+def get_colormap_lut(name: str = COLORMAP) -> npt.NDArray[np.uint8]:
+    """
+    Precompute the 8-bit RGB color of each of the 256 quantized levels, so that
+    colormapping an image is a single table lookup per pixel.
+
+    :param name: name of a matplotlib colormap
+    :returns: 256-by-3 array of colors
+    """
+    # matplotlib takes longer to import than the rest of the export tools, and is
+    # only needed once the colors are known to be needed
+    import matplotlib as mpl
 
-def export_radiance_image(
-    nc_file: pathlib.Path, image_file: pathlib.Path, variable: str = "rad"
-) -> bool:
-    rootgrp = netCDF4.Dataset(nc_file, "r")
-    radvar = rootgrp.variables[variable]
-    # Always take viewing zenith angle 8 (nadir) for now
-    radarr: npt.NDArray[np.float_] = radvar[:, :, 8]
-    min_val: np.float_ = np.min(radarr[:])
-    max_val: np.float_ = np.max(radarr[:])
     levels = 255
+    colormap = mpl.colormaps[name]
+    colors = colormap(np.arange(levels + 1) / float(levels))
+    return (colors[:, :3] * levels).astype(np.uint8)
+
+
+def quantize_image(
+    radarr: npt.NDArray[np.float_], min_val: np.float_, max_val: np.float_
+) -> npt.NDArray[np.uint8]:
+    """
+    Quantize an image to the 256 levels of a colormap over the given range.
+
+    :param radarr: 2-dimensional array of radiance values
+    :param min_val: value mapped to level 0
+    :param max_val: value mapped to level 255
+    :returns: uint8 array with the same shape as radarr
+    """
+    # Scaled in double precision, as the per-pixel quantize did with the Python
+    # floats np.vectorize passed it, so that no pixel lands on another level
+    levels = quantize_array(radarr.astype(np.float64), min_val, max_val, 255)
+    # 255 levels always quantizes to uint8, the view only narrows the type
+    return levels.view(np.uint8)
+
 
-    def quantize_uint8(x):
-        return quantize(x, min_val, max_val, levels)
+def colormap_image(
+    radarr: npt.NDArray[np.float_],
+    min_val: np.float_,
+    max_val: np.float_,
+    lut: npt.NDArray[np.uint8],
+) -> npt.NDArray[np.uint8]:
+    """
+    Quantize an image to 8 bits over the given range and colormap it.
 
-    vec_quantize = np.vectorize(quantize_uint8)
-    imgarr: npt.NDArray[np.uint8] = vec_quantize(radarr)
-    colormap = mpl.colormaps["Blues_r"]
-    cm_imgarr = colormap(imgarr / float(levels))
+    :param radarr: 2-dimensional array of radiance values
+    :param min_val: value mapped to the first color
+    :param max_val: value mapped to the last color
+    :param lut: 256-by-3 array of colors, from get_colormap_lut
+    :returns: RGB image with the same first two dimensions as radarr
+    """
+    with profiling.stage("colormap") as counts:
+        levels = quantize_image(radarr, min_val, max_val)
+        rgb = lut[levels]
+        counts.items = levels.size
+    return rgb
 
-    radimg = Image.fromarray((cm_imgarr[:, :, :3] * levels).astype(np.uint8))
-    radimg.save(image_file)
+
+def get_angle_path(image_file: pathlib.Path, angle: int) -> pathlib.Path:
+    """appends the viewing angle index to the stem of a filepath"""
+    return image_file.with_name(f"{image_file.stem}_a{angle}{image_file.suffix}")
+
+
+def save_image(rgb: npt.NDArray[np.uint8], image_file: pathlib.Path) -> None:
+    """writes an RGB array to an image file, the format is chosen by its extension"""
+    with profiling.stage("encode image") as counts:
+        Image.fromarray(rgb).save(image_file)
+        counts.bytes_written = profiling.get_file_bytes(image_file)
+        counts.items = rgb.shape[0] * rgb.shape[1]
+
+
+def encode_image(rgb: npt.NDArray[np.uint8], image_format: str = "png") -> bytes:
+    """encodes an RGB array as the contents of an image file, without writing it"""
+    stream = io.BytesIO()
+    with profiling.stage("encode image") as counts:
+        Image.fromarray(rgb).save(stream, format=image_format)
+        counts.bytes_written = stream.tell()
+        counts.items = rgb.shape[0] * rgb.shape[1]
+    return stream.getvalue()
+
+
+def export_radiance_images(
+    nc_file: pathlib.Path,
+    image_file: pathlib.Path,
+    variable: str = "rad",
+    angles: Sequence[int] = (NADIR_ANGLE,),
+    cache: ArrayCache | None = None,
+    threads: int | None = None,
+    tile_format: str | None = None,
+    region: Region | None = None,
+    clip_percentile: float | None = None,
+    stats_sidecar: bool = False,
+) -> list[pathlib.Path]:
+    """
+    Export colormapped images of radiance at several viewing angles. All angles are
+    read at once and share the min and max of the whole selection, so brightness
+    can be compared between images. With a single angle the image is written to
+    image_file, otherwise the angle index is appended to the name of each image.
+    Images are colormapped and encoded by a pool of threads, since numpy and the
+    image encoders release the GIL. With a tile format, each angle is written as
+    a pyramid of tiles named after the image instead of as a single image.
+
+    :param nc_file: netCDF4 file to read
+    :param image_file: output filepath, png or jpg
+    :param variable: the radiance variable, with the viewing angle as last dimension
+    :param angles: indices of the viewing angles to export
+    :param cache: optional cache of decoded variables
+    :param threads: number of threads, defaults to the number of CPUs
+    :param tile_format: optionally write tile pyramids in this format, see
+    options.TILE_FORMATS
+    :param region: optional (x, y) index ranges to export instead of whole images,
+    the color scale is then that of the region
+    :param clip_percentile: span the color scale between this percentile of the
+    non-zero radiance and its complement instead of the min and max, so that a
+    few bright pixels do not darken the rest, see StreamingStats.get_clipped_range
+    :param stats_sidecar: also write the statistics of the selection to a
+    .stats.json file named after image_file
+    :returns: filepaths of the images, or of the pyramid metadata when tiling, in
+    the order of angles
+    """
+    radarr = read_radiance(nc_file, variable, angles, cache, region)
+    if clip_percentile is None and not stats_sidecar:
+        min_val: np.float_ = np.min(radarr)
+        max_val: np.float_ = np.max(radarr)
+    else:
+        # The statistics pass finds the range as well, so it replaces min and max
+        value_stats = StreamingStats()
+        for i in range(len(angles)):
+            with profiling.stage("statistics") as counts:
+                value_stats.update(radarr[:, :, i])
+                counts.items = radarr[:, :, i].size
+        min_val = np.float_(value_stats.min_val)
+        max_val = np.float_(value_stats.max_val)
+        if clip_percentile is not None:
+            min_val, max_val = value_stats.get_clipped_range(clip_percentile)
+        if stats_sidecar:
+            write_value_stats(
+                image_file,
+                value_stats,
+                (min_val, max_val),
+                variable=variable,
+                angles=list(angles),
+                colormap=COLORMAP,
+                clip_percentile=clip_percentile,
+            )
+    lut = get_colormap_lut()
+
+    if tile_format is not None:
+        metadata_files: list[pathlib.Path] = []
+        for i, angle in enumerate(angles):
+            path = image_file if len(angles) == 1 else get_angle_path(image_file, angle)
+            with profiling.stage("quantize") as counts:
+                levels = quantize_image(radarr[:, :, i], min_val, max_val)
+                counts.items = levels.size
+            metadata_file = tiles.write_tile_pyramid(
+                path,
+                levels,
+                lut,
+                tile_format,
+                threads,
+                variable=variable,
+                angle=angle,
+                colormap=COLORMAP,
+                min=float(min_val),
+                max=float(max_val),
+            )
+            metadata_files.append(metadata_file)
+        return metadata_files
+
+    def export_angle(i: int) -> pathlib.Path:
+        angle = angles[i]
+        path = image_file if len(angles) == 1 else get_angle_path(image_file, angle)
+        save_image(colormap_image(radarr[:, :, i], min_val, max_val, lut), path)
+        return path
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(export_angle, range(len(angles))))
+
+
+def export_radiance_image(
+    nc_file: pathlib.Path,
+    image_file: pathlib.Path,
+    variable: str = "rad",
+    cache: ArrayCache | None = None,
+) -> bool:
+    # Always take viewing zenith angle 8 (nadir) for now
+    export_radiance_images(nc_file, image_file, variable, (NADIR_ANGLE,), cache)
     return True
@@ -0,0 +1,623 @@
+"""Long running conversion service. Exports are served over HTTP, on a TCP port or
+a Unix socket, as in-memory files. Open datasets and decoded variables are kept
+between requests, so that exporting the same data again with different settings
+skips opening and decoding the netCDF file."""
+
+import collections
+import functools
+import http.server
+import json
+import pathlib
+import socketserver
+import threading
+import urllib.parse
+from typing import Any, Callable, Final, NamedTuple, TypeVar
+
+import netCDF4
+import numpy as np
+import numpy.typing as npt
+
+from . import arraycache, convert, morton, nrrdio, radiance
+from .options import (
+    DEFAULT_HOST,
+    DEFAULT_MEMORY_BYTES,
+    DEFAULT_OPEN_DATASETS,
+    DEFAULT_PORT,
+    ENCODINGS,
+    GRID_SPACING,
+)
+
+T = TypeVar("T")
+
+NETCDF_LOCK: Final = threading.RLock()
+"""Serializes access to netCDF files, since the netCDF and HDF5 libraries are not
+thread safe. Only reading is serialized, exports are computed concurrently."""
+
+CONTENT_TYPES: Final = {
+    "glb": "model/gltf-binary",
+    "nrrd": "application/octet-stream",
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "json": "application/json",
+}
+"""Content type of each kind of response."""
+
+
+class Export(NamedTuple):
+    """The contents of an exported file, as sent in a response."""
+
+    data: bytes
+    kind: str
+    """key of CONTENT_TYPES"""
+
+
+class DatasetPool:
+    """
+    netCDF files kept open between requests, closing the least recently used one
+    past max_open. A file that changed on disk since it was opened is reopened.
+    Handles must only be used while holding NETCDF_LOCK.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_OPEN_DATASETS) -> None:
+        self.max_open = max_open
+        self.handles: collections.OrderedDict[
+            pathlib.Path, tuple[tuple[int, int], netCDF4.Dataset]
+        ] = collections.OrderedDict()
+
+    def get(self, nc_file: pathlib.Path) -> netCDF4.Dataset:
+        """open handle of a netCDF file, opening it if needed"""
+        stat = nc_file.stat()
+        identity = (stat.st_size, stat.st_mtime_ns)
+        entry = self.handles.pop(nc_file, None)
+        if entry is not None and entry[0] != identity:
+            entry[1].close()
+            entry = None
+        if entry is None:
+            entry = (identity, netCDF4.Dataset(nc_file, "r"))
+        self.handles[nc_file] = entry
+        while len(self.handles) > self.max_open:
+            _, (_, rootgrp) = self.handles.popitem(last=False)
+            rootgrp.close()
+        return entry[1]
+
+    def close(self) -> None:
+        """closes every open handle"""
+        while self.handles:
+            _, (_, rootgrp) = self.handles.popitem()
+            rootgrp.close()
+
+
+class ArrayLRU:
+    """
+    Decoded variables kept in memory between requests, keyed by
+    arraycache.get_cache_key so that a modified file is never served from memory.
+    The least recently used arrays are dropped once the arrays take more than
+    max_bytes. Arrays are made read-only, since they are shared by requests.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.arrays: collections.OrderedDict[str, npt.NDArray[Any]] = (
+            collections.OrderedDict()
+        )
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, count: bool = True) -> npt.NDArray[Any] | None:
+        """cached array, if any, marking it as the most recently used. Lookups
+        are counted as hits or misses unless count is False"""
+        with self.lock:
+            array = self.arrays.get(key)
+            if array is not None:
+                self.arrays.move_to_end(key)
+            if count:
+                self.hits += array is not None
+                self.misses += array is None
+            return array
+
+    def put(self, key: str, array: npt.NDArray[Any]) -> None:
+        """keeps an array unless it is larger than the whole budget"""
+        size = get_array_bytes(array)
+        if size > self.max_bytes:
+            return
+        array.flags.writeable = False
+        with self.lock:
+            previous = self.arrays.pop(key, None)
+            if previous is not None:
+                self.nbytes -= get_array_bytes(previous)
+            self.arrays[key] = array
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, dropped = self.arrays.popitem(last=False)
+                self.nbytes -= get_array_bytes(dropped)
+
+
+def get_array_bytes(array: npt.NDArray[Any]) -> int:
+    """memory held by an array, including the mask of a masked array"""
+    if np.ma.isMaskedArray(array):
+        return array.nbytes + np.ma.getmaskarray(array).nbytes
+    return array.nbytes
+
+
+class ExportService:
+    """Exports files under a root directory, sharing open datasets and decoded
+    variables between requests, which may arrive on concurrent threads."""
+
+    def __init__(
+        self,
+        root: pathlib.Path,
+        memory_bytes: int = DEFAULT_MEMORY_BYTES,
+        max_open: int = DEFAULT_OPEN_DATASETS,
+        slab_bytes: int = convert.DEFAULT_SLAB_BYTES,
+    ) -> None:
+        self.root = root.expanduser().resolve()
+        self.datasets = DatasetPool(max_open)
+        self.arrays = ArrayLRU(memory_bytes)
+        self.slab_bytes = slab_bytes
+
+    def resolve(self, name: str) -> pathlib.Path:
+        """
+        Path of a netCDF file given relative to the root directory.
+
+        :param name: path of the file within the root directory
+        :returns: absolute path of the file
+        :raises: PermissionError if the path leads outside of the root directory
+        :raises: FileNotFoundError if there is no such netCDF file
+        """
+        nc_file = (self.root / name).resolve()
+        if not nc_file.is_relative_to(self.root):
+            raise PermissionError(f"{name} is outside of the served directory")
+        if not nc_file.is_file() or nc_file.suffix.lower() != ".nc":
+            raise FileNotFoundError(f"{name} is not a netCDF file")
+        return nc_file
+
+    def read_cached(
+        self,
+        nc_file: pathlib.Path,
+        variable: str,
+        selection: str,
+        read: Callable[[netCDF4.Variable], npt.NDArray[Any]],
+    ) -> npt.NDArray[Any]:
+        """
+        Decoded part of a variable, from memory if it was read before. Reads are
+        serialized, and a request that waited for another one reading the same
+        data uses its result instead of reading it again.
+
+        :param nc_file: netCDF4 file to read
+        :param variable: the variable to read
+        :param selection: which part of the variable is read, see get_cache_key
+        :param read: function reading the part from the open variable
+        :returns: the decoded data, read-only
+        :raises: KeyError if the variable does not exist in the netCDF database
+        """
+        key = arraycache.get_cache_key(nc_file, variable, selection)
+        array = self.arrays.get(key)
+        if array is not None:
+            return array
+        with NETCDF_LOCK:
+            array = self.arrays.get(key, count=False)
+            if array is None:
+                array = read(self.datasets.get(nc_file).variables[variable])
+                self.arrays.put(key, array)
+        return array
+
+    def read_variable(
+        self, nc_file: pathlib.Path, variable: str, timestep: int = 0
+    ) -> npt.NDArray[np.float_]:
+        """
+        One timestep of a variable in (x, y, z) order, see convert.parse_netcdf.
+
+        :param nc_file: netCDF4 file to read
+        :param variable: the variable to read
+        :param timestep: index along nt to read, ignored for 3-dimensional variables
+        :returns: the decoded timestep, read-only
+        :raises: KeyError if the variable does not exist in the netCDF database
+        :raises: ValueError if the timestep is out of range or the dimensions of the
+        variable are not named as expected
+        """
+
+        def read(qcvar: netCDF4.Variable) -> npt.NDArray[np.float_]:
+            dimensions = qcvar.dimensions
+            if "nt" in dimensions:
+                count = qcvar.shape[dimensions.index("nt")]
+                if not 0 <= timestep < count:
+                    raise ValueError(f"timestep {timestep} is out of range")
+            shape = convert.get_xyz_shape(qcvar)
+            qcarr = np.empty(shape, dtype=qcvar.dtype, order="F")
+            slabs = convert.iter_variable_slabs(qcvar, timestep, self.slab_bytes)
+            for z0, slab in slabs:
+                qcarr[:, :, z0 : z0 + slab.shape[2]] = slab
+            return qcarr
+
+        return self.read_cached(nc_file, variable, f"t{timestep}", read)
+
+    def read_nonzero_data(
+        self,
+        nc_file: pathlib.Path,
+        variable: str,
+        timestep: int = 0,
+        threshold: float | None = None,
+        region: convert.Region | None = None,
+    ) -> convert.NonzeroData:
+        """sparse data of one timestep of a variable, or of a region of it, see
+        convert.read_nonzero_data"""
+        qcarr = self.read_variable(nc_file, variable, timestep)
+        shape = (qcarr.shape[0], qcarr.shape[1], qcarr.shape[2])
+        if region is not None:
+            (x0, x1), (y0, y1), (z0, z1) = region
+            qcarr = qcarr[x0:x1, y0:y1, z0:z1]
+        slabs = convert.iter_array_slabs(qcarr, self.slab_bytes)
+        return convert.extract_nonzero_slabs(slabs, threshold, region, shape)
+
+    def export_glb(
+        self,
+        nc_file: pathlib.Path,
+        variable: str = "QC",
+        timestep: int = 0,
+        threshold: float | None = None,
+        region: convert.Region | None = None,
+        quantize_positions: bool = False,
+        include_values: bool = False,
+        chunk_points: int | None = None,
+    ) -> Export:
+        """point cloud of one timestep of a variable as a glb file, see
+        convert.convert_nc_gltf for the meaning of each option"""
+        nzdata = self.read_nonzero_data(nc_file, variable, timestep, threshold, region)
+        points = nzdata.points
+        values = nzdata.values if include_values else None
+        chunks = None
+        if chunk_points:
+            order, chunks = morton.sort_points(points, chunk_points)
+            points = points[order]
+            if values is not None:
+                values = values[order]
+        if quantize_positions:
+            gltf = convert.get_quantized_gltf_model(
+                convert.rotate_points(points),
+                values=values,
+                value_range=(nzdata.min_val, nzdata.max_val),
+                chunks=chunks,
+            )
+        else:
+            gltf = convert.get_gltf_model(
+                convert.rotate_points(points, np.float32), chunks=chunks
+            )
+        return Export(convert.get_glb_bytes(gltf), "glb")
+
+    def export_nrrd(
+        self,
+        nc_file: pathlib.Path,
+        variable: str = "QC",
+        timestep: int = 0,
+        quantization_bits: int = 32,
+        crop: bool = False,
+        region: convert.Region | None = None,
+        encoding: nrrdio.NrrdEncoding = nrrdio.NrrdEncoding(),
+    ) -> Export:
+        """volume of one timestep of a variable as an NRRD file, see
+        convert.convert_nc_nrrd for the meaning of each option"""
+        nzdata = self.read_nonzero_data(nc_file, variable, timestep, region=region)
+        offset, base_shape, header = convert.get_volume_layout(nzdata, crop, region)
+        points = nzdata.points
+        if header is not None:
+            points = points - np.array(offset)
+        volume = convert.map_values_nrrd(
+            points,
+            nzdata.values,
+            nzdata.min_val,
+            nzdata.max_val,
+            quantization_bits,
+            base_shape,
+        )
+        return Export(nrrdio.encode_nrrd(volume, header, encoding), "nrrd")
+
+    def export_image(
+        self,
+        nc_file: pathlib.Path,
+        variable: str = "rad",
+        angle: int = radiance.NADIR_ANGLE,
+        region: convert.Region | None = None,
+        image_format: str = "png",
+    ) -> Export:
+        """
+        Colormapped radiance at one viewing angle, see
+        radiance.export_radiance_images. The whole variable is decoded once, and
+        masked pixels are filled with the minimum of the exported image.
+
+        :param nc_file: netCDF4 file to read
+        :param variable: the radiance variable, with the viewing angle last
+        :param angle: index of the viewing angle to export
+        :param region: optional (x, y) index ranges to export
+        :param image_format: png or jpeg
+        :returns: the encoded image
+        :raises: ValueError if the angle is out of range
+        """
+        radarr = self.read_cached(nc_file, variable, "all", lambda var: var[:])
+        if not 0 <= angle < radarr.shape[-1]:
+            raise ValueError(f"viewing angle {angle} is out of range")
+        if region is not None:
+            (x0, x1), (y0, y1) = region
+            radarr = radarr[x0:x1, y0:y1]
+        image = radarr[:, :, angle]
+        if np.ma.is_masked(image):
+            image = np.ma.filled(image, np.ma.min(image))
+        image = np.asarray(image)
+        rgb = radiance.colormap_image(
+            image, np.min(image), np.max(image), radiance.get_colormap_lut()
+        )
+        return Export(radiance.encode_image(rgb, image_format), image_format)
+
+    def get_shape(self, nc_file: pathlib.Path, variable: str) -> tuple[int, ...]:
+        """shape of a variable as stored, for checking a region before reading it"""
+        with NETCDF_LOCK:
+            qcvar = self.datasets.get(nc_file).variables[variable]
+            if "nx" in qcvar.dimensions:
+                return convert.get_xyz_shape(qcvar)
+            return tuple(qcvar.shape)
+
+    def describe(self, nc_file: pathlib.Path) -> dict[str, Any]:
+        """variables of a netCDF file with their dimensions, shape and type"""
+        with NETCDF_LOCK:
+            rootgrp = self.datasets.get(nc_file)
+            return {
+                "variables": {
+                    name: {
+                        "dimensions": list(var.dimensions),
+                        "shape": list(var.shape),
+                        "dtype": str(var.dtype),
+                    }
+                    for name, var in rootgrp.variables.items()
+                },
+            }
+
+    def get_status(self) -> dict[str, Any]:
+        """what the service holds in memory, for monitoring"""
+        with self.arrays.lock:
+            return {
+                "root": str(self.root),
+                "open_datasets": len(self.datasets.handles),
+                "cached_arrays": len(self.arrays.arrays),
+                "cached_bytes": self.arrays.nbytes,
+                "memory_bytes": self.arrays.max_bytes,
+                "hits": self.arrays.hits,
+                "misses": self.arrays.misses,
+            }
+
+    def close(self) -> None:
+        """closes every open dataset"""
+        with NETCDF_LOCK:
+            self.datasets.close()
+
+
+def parse_bool(text: str) -> bool:
+    """whether a query parameter is set to a true value"""
+    return text.lower() in ("1", "true", "yes")
+
+
+class Query:
+    """Parameters of a request, converted as they are read."""
+
+    def __init__(self, query: str) -> None:
+        self.params = {
+            name: values[-1] for name, values in urllib.parse.parse_qs(query).items()
+        }
+
+    def get(self, name: str, parse: Callable[[str], T], default: T) -> T:
+        """
+        Value of a parameter, or a default if it was not given.
+
+        :param name: name of the parameter
+        :param parse: converts the text of the parameter, e.g. int
+        :param default: value of a missing parameter
+        :returns: the converted value
+        :raises: ValueError if the parameter cannot be converted
+        """
+        if name not in self.params:
+            return default
+        try:
+            return parse(self.params[name])
+        except ValueError:
+            raise ValueError(f"invalid value for {name}") from None
+
+    def get_region(self, shape: tuple[int, ...]) -> convert.Region | None:
+        """region given as bbox, in the format of the --bbox option"""
+        if "bbox" not in self.params:
+            return None
+        spacing = self.get("spacing", float, GRID_SPACING)
+        if spacing <= 0:
+            raise ValueError("spacing must be positive")
+        return convert.parse_bbox(self.params["bbox"], shape, spacing)
+
+
+class ExportHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers GET requests for exports of a file under the root directory, named by
+    the file parameter:
+
+    /glb   point cloud, with variable, t, bbox, spacing, threshold, quantize,
+           values and chunk_points
+    /nrrd  volume, with variable, t, bbox, spacing, bits, crop, encoding and level
+    /png   radiance image, with variable, angle, bbox, spacing and format
+    /info  dimensions and variables of the file
+    /      status of the service
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args: Any, service: ExportService, **kwargs: Any) -> None:
+        self.service = service
+        super().__init__(*args, **kwargs)
+
+    def address_string(self) -> str:
+        # Clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = Query(url.query)
+        routes: dict[str, Callable[[Query], Export]] = {
+            "/": self.get_status,
+            "/info": self.get_info,
+            "/glb": self.get_glb,
+            "/nrrd": self.get_nrrd,
+            "/png": self.get_image,
+        }
+        route = routes.get(url.path.rstrip("/") or "/")
+        if route is None:
+            self.send_error_json(404, f"unknown path {url.path}")
+            return
+        try:
+            export = route(query)
+        except FileNotFoundError as err:
+            self.send_error_json(404, str(err))
+        except KeyError as err:
+            self.send_error_json(404, f"variable {err.args[0]} does not exist")
+        except PermissionError as err:
+            self.send_error_json(403, str(err))
+        except (ValueError, TypeError) as err:
+            self.send_error_json(400, str(err))
+        except Exception as err:
+            self.log_error("export failed: %r", err)
+            self.send_error_json(500, "export failed")
+        else:
+            self.send_bytes(200, export)
+
+    def send_bytes(self, code: int, export: Export) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", CONTENT_TYPES[export.kind])
+        self.send_header("Content-Length", str(len(export.data)))
+        self.end_headers()
+        self.wfile.write(export.data)
+
+    def send_error_json(self, code: int, message: str) -> None:
+        self.send_bytes(code, get_json_export({"error": message}))
+
+    def get_file(self, query: Query) -> pathlib.Path:
+        if "file" not in query.params:
+            raise ValueError("the file parameter is required")
+        return self.service.resolve(query.params["file"])
+
+    def get_status(self, query: Query) -> Export:
+        return get_json_export(self.service.get_status())
+
+    def get_info(self, query: Query) -> Export:
+        return get_json_export(self.service.describe(self.get_file(query)))
+
+    def get_glb(self, query: Query) -> Export:
+        nc_file = self.get_file(query)
+        variable = query.get("variable", str, "QC")
+        chunk_points = query.get("chunk_points", int, None)
+        if chunk_points is not None and chunk_points < 1:
+            raise ValueError("chunks must hold at least 1 point")
+        quantize_positions = query.get("quantize", parse_bool, False)
+        include_values = query.get("values", parse_bool, False)
+        if include_values and not quantize_positions:
+            raise ValueError("values requires quantize")
+        return self.service.export_glb(
+            nc_file,
+            variable,
+            query.get("t", int, 0),
+            query.get("threshold", float, None),
+            query.get_region(self.service.get_shape(nc_file, variable)),
+            quantize_positions,
+            include_values,
+            chunk_points,
+        )
+
+    def get_nrrd(self, query: Query) -> Export:
+        nc_file = self.get_file(query)
+        variable = query.get("variable", str, "QC")
+        bits = query.get("bits", int, 32)
+        if bits not in (8, 16, 32):
+            raise ValueError("bits must be 8, 16 or 32")
+        encoding = query.get("encoding", str, "gzip")
+        if encoding not in ENCODINGS or encoding == "detached":
+            raise ValueError("encoding must be raw, gzip or pgzip")
+        level = query.get("level", int, 9)
+        if not 1 <= level <= 9:
+            raise ValueError("level must be between 1 and 9")
+        return self.service.export_nrrd(
+            nc_file,
+            variable,
+            query.get("t", int, 0),
+            bits,
+            query.get("crop", parse_bool, False),
+            query.get_region(self.service.get_shape(nc_file, variable)),
+            nrrdio.NrrdEncoding(encoding, level),
+        )
+
+    def get_image(self, query: Query) -> Export:
+        nc_file = self.get_file(query)
+        image_format = query.get("format", str, "png").lower()
+        if image_format == "jpg":
+            image_format = "jpeg"
+        if image_format not in ("png", "jpeg"):
+            raise ValueError("format must be png or jpeg")
+        variable = query.get("variable", str, "rad")
+        shape = self.service.get_shape(nc_file, variable)
+        return self.service.export_image(
+            nc_file,
+            variable,
+            query.get("angle", int, radiance.NADIR_ANGLE),
+            query.get_region(shape[:2]),
+            image_format,
+        )
+
+
+def get_json_export(content: dict[str, Any]) -> Export:
+    """a JSON response"""
+    return Export(json.dumps(content, indent=2).encode(), "json")
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """HTTP server on a Unix socket, handling each request on its own thread."""
+
+    daemon_threads = True
+
+
+def serve(
+    service: ExportService,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: pathlib.Path | None = None,
+    ready: Callable[[socketserver.BaseServer], None] | None = None,
+) -> None:
+    """
+    Serve exports until interrupted, each request on its own thread. The
+    datasets are closed and the socket file is removed on the way out.
+
+    :param service: service answering the requests
+    :param host: address to listen on
+    :param port: TCP port to listen on, 0 picks a free port
+    :param socket_path: listen on this Unix socket instead of a TCP port
+    :param ready: optionally called with the server once it is listening, e.g.
+    to shut it down from another thread
+    """
+    handler = functools.partial(ExportHandler, service=service)
+    server: socketserver.BaseServer
+    if socket_path is not None:
+        if socket_path.is_socket():
+            # Left behind by a server that did not shut down cleanly
+            socket_path.unlink()
+        server = ThreadingUnixHTTPServer(str(socket_path), handler)
+        print(f"listening on     : {socket_path}")
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), handler)
+        print(f"listening on     : http://{host}:{server.server_address[1]}/")
+    try:
+        if ready is not None:
+            ready(server)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and socket_path.is_socket():
+            socket_path.unlink()
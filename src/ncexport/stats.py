@@ -0,0 +1,283 @@
+"""Statistics of exported data gathered in a single pass as it is read: range,
+mean, number of non-zero values and a histogram of the non-zero values, from which
+percentiles are estimated without sorting or scanning the data again. They are
+written next to an export as a small JSON sidecar for building transfer
+functions."""
+
+import json
+import math
+import pathlib
+from typing import Any, Final
+
+import numpy as np
+import numpy.typing as npt
+from .options import MAX_CLIP_PERCENTILE
+
+RELATIVE_ACCURACY: Final = 0.005
+"""Largest relative error of estimated percentiles, which sets the bin widths."""
+
+SIDECAR_BINS: Final = 256
+"""Number of histogram bins over the scale of an export in its sidecar."""
+
+SIDECAR_PERCENTILES: Final = (0.1, 1.0, 5.0, 25.0, 50.0, 75.0, 95.0, 99.0, 99.9)
+"""Percentiles of the non-zero values written to the sidecar."""
+
+
+class LogBins:
+    """Counts of positive values in bins numbered by key, bin k holding values in
+    (gamma**(k - 1), gamma**k]. Bins are added as values outside of them arrive."""
+
+    def __init__(self) -> None:
+        self.offset = 0
+        """key of the first bin"""
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def extend(self, lo: int, hi: int) -> None:
+        """adds empty bins so that the keys lo to hi have a bin"""
+        if len(self.counts) == 0:
+            self.offset = lo
+            self.counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        before = max(0, self.offset - lo)
+        after = max(0, hi - self.offset - len(self.counts) + 1)
+        if before or after:
+            self.counts = np.pad(self.counts, (before, after))
+            self.offset -= before
+
+    def add(self, keys: npt.NDArray[np.int64]) -> None:
+        """counts one value in the bin of each key"""
+        if len(keys) == 0:
+            return
+        self.extend(int(np.min(keys)), int(np.max(keys)))
+        self.counts += np.bincount(keys - self.offset, minlength=len(self.counts))
+
+    def merge(self, other: "LogBins") -> None:
+        """adds the counts of bins with the same keys, e.g. from another process"""
+        if len(other.counts) == 0:
+            return
+        self.extend(other.offset, other.offset + len(other.counts) - 1)
+        start = other.offset - self.offset
+        self.counts[start : start + len(other.counts)] += other.counts
+
+    def get_keys(self) -> npt.NDArray[np.int64]:
+        """key of each bin"""
+        return np.arange(self.offset, self.offset + len(self.counts), dtype=np.int64)
+
+
+class StreamingStats:
+    """
+    Running statistics of a stream of chunks of data. The histogram covers the
+    non-zero values, since zeros (empty space) make up most of a sparse cloud
+    field. Its bins grow geometrically, so every estimated percentile is within
+    relative_accuracy of a value in the data however far outliers stretch the
+    range, and the number of bins grows with the logarithm of the range rather
+    than with the amount of data.
+    """
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY) -> None:
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        """ratio of the bounds of each bin"""
+        self.positive = LogBins()
+        self.negative = LogBins()
+        """bins of the magnitude of negative values"""
+        self.count = 0
+        """number of values, including zeros"""
+        self.nonzero = 0
+        """number of values in the histogram"""
+        self.total = 0.0
+        """sum of all values"""
+        self.min_val: float | None = None
+        self.max_val: float | None = None
+
+    def update(self, data: npt.NDArray[np.float_]) -> None:
+        """adds every value of a chunk of dense data"""
+        if data.size == 0:
+            return
+        values = data[data != 0]
+        self.add(values, data.size, float(np.min(data)), float(np.max(data)))
+
+    def add(
+        self,
+        values: npt.NDArray[np.float_],
+        count: int,
+        min_val: float,
+        max_val: float,
+    ) -> None:
+        """
+        Add a chunk of data given by its non-zero values, such as the values of a
+        hyperslab extracted with convert.extract_slab, without its zeros.
+
+        :param values: the non-zero values of the chunk, or those above a threshold
+        :param count: number of values in the chunk, including zeros
+        :param min_val: minimum of the chunk, including zeros
+        :param max_val: maximum of the chunk, including zeros
+        """
+        self.add_extent(count, min_val, max_val)
+        # Fill values or infinities would stretch the bins without end
+        values = values[np.isfinite(values) & (values != 0)]
+        self.nonzero += len(values)
+        self.total += float(np.sum(values, dtype=np.float64))
+        self.positive.add(self.get_keys(values[values > 0]))
+        self.negative.add(self.get_keys(-values[values < 0]))
+
+    def add_extent(self, count: int, min_val: float, max_val: float) -> None:
+        """adds to the number of values and widens the range of the data"""
+        self.count += count
+        self.min_val = min_val if self.min_val is None else min(self.min_val, min_val)
+        self.max_val = max_val if self.max_val is None else max(self.max_val, max_val)
+
+    def merge(self, other: "StreamingStats") -> None:
+        """
+        Add the statistics of other data, such as another timestep read by a
+        worker process, as if it had been added to these.
+
+        :param other: statistics with the same relative accuracy
+        :raises: ValueError if the relative accuracy differs
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("statistics must have the same relative accuracy")
+        if other.min_val is None or other.max_val is None:
+            return
+        self.add_extent(other.count, other.min_val, other.max_val)
+        self.nonzero += other.nonzero
+        self.total += other.total
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+
+    def get_keys(self, magnitudes: npt.NDArray[np.float_]) -> npt.NDArray[np.int64]:
+        """key of the bin of each positive value"""
+        logs = np.log(magnitudes.astype(np.float64)) / math.log(self.gamma)
+        return np.ceil(logs).astype(np.int64)
+
+    @property
+    def mean(self) -> float:
+        """mean of all values, including zeros"""
+        return self.total / self.count if self.count else 0.0
+
+    def get_bins(self) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.int64]]:
+        """representative value and count of every bin, in increasing order"""
+        # The value halfway between the bounds in relative terms, so that every
+        # value of the bin is within the relative accuracy of it
+        scale = 2 / (self.gamma + 1)
+        positive = scale * self.gamma ** self.positive.get_keys().astype(np.float64)
+        negative = -scale * self.gamma ** self.negative.get_keys().astype(np.float64)
+        values = np.concatenate([negative[::-1], positive])
+        counts = np.concatenate([self.negative.counts[::-1], self.positive.counts])
+        return values, counts
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Estimate a percentile of the non-zero values from the histogram.
+
+        :param percentile: between 0 and 100
+        :returns: the estimated value, within the data range
+        :raises: ValueError if there are no non-zero values
+        """
+        if self.nonzero == 0 or self.min_val is None or self.max_val is None:
+            raise ValueError("data contains no non-zero values")
+        values, counts = self.get_bins()
+        rank = percentile / 100 * (self.nonzero - 1)
+        index = int(np.searchsorted(np.cumsum(counts), rank, side="right"))
+        value = float(values[min(index, len(values) - 1)])
+        return min(max(value, self.min_val), self.max_val)
+
+    def get_clipped_range(self, percentile: float) -> tuple[np.float_, np.float_]:
+        """
+        Value range for quantizing that ignores outliers: from the given
+        percentile of the non-zero values to its complement, e.g. 1 to 99. If the
+        data holds zeros, the range starts at the minimum instead, so that empty
+        space stays at the bottom of the scale and faint values are kept. Values
+        outside of the range are clamped when quantizing.
+
+        :param percentile: percentile clipped at each end, below 50
+        :returns: (min, max) to quantize with
+        :raises: ValueError if the percentile is out of range or nothing was added
+        """
+        if not 0 <= percentile < MAX_CLIP_PERCENTILE:
+            raise ValueError(f"percentile must be in [0, {MAX_CLIP_PERCENTILE:g})")
+        if self.min_val is None or self.max_val is None:
+            raise ValueError("no data was added")
+        full_range = (np.float_(self.min_val), np.float_(self.max_val))
+        if self.nonzero == 0:
+            return full_range
+        lo = self.get_percentile(percentile)
+        if self.nonzero < self.count:
+            lo = min(lo, self.min_val)
+        hi = self.get_percentile(100 - percentile)
+        if not hi > lo:
+            return full_range
+        return np.float_(lo), np.float_(hi)
+
+    def get_histogram(
+        self, value_range: tuple[float, float], bins: int = SIDECAR_BINS
+    ) -> list[int]:
+        """
+        Number of non-zero values in each of evenly spaced bins over a scale, with
+        values outside of it counted in the first or last bin as they are clamped
+        when quantizing.
+
+        :param value_range: data values at the ends of the scale
+        :param bins: number of bins
+        :returns: count of each bin
+        """
+        values, counts = self.get_bins()
+        lo, hi = value_range
+        if not hi > lo:
+            return [int(np.sum(counts))] + [0] * (bins - 1)
+        index = np.floor((values - lo) / (hi - lo) * bins).astype(np.int64)
+        np.clip(index, 0, bins - 1, out=index)
+        return np.bincount(index, weights=counts, minlength=bins).astype(int).tolist()
+
+    def get_summary(self, value_range: tuple[float, float]) -> dict[str, Any]:
+        """
+        JSON serializable statistics of the data, with its histogram over a scale.
+
+        :param value_range: data values at the ends of the scale of the export
+        :returns: dictionary of statistics
+        """
+        summary: dict[str, Any] = {
+            "count": self.count,
+            "nonzero": self.nonzero,
+            "min": self.min_val,
+            "max": self.max_val,
+            "mean": self.mean,
+        }
+        if self.nonzero:
+            summary["percentiles"] = {
+                f"{p:g}": self.get_percentile(p) for p in SIDECAR_PERCENTILES
+            }
+        summary["histogram"] = {
+            "min": float(value_range[0]),
+            "max": float(value_range[1]),
+            "counts": self.get_histogram(value_range),
+        }
+        return summary
+
+
+def get_sidecar_path(path: pathlib.Path) -> pathlib.Path:
+    """filepath of the statistics sidecar for an output filepath"""
+    return path.with_name(f"{path.stem}.stats.json")
+
+
+def write_sidecar(
+    path: pathlib.Path,
+    stats: StreamingStats,
+    value_range: tuple[float, float],
+    **metadata: Any,
+) -> pathlib.Path:
+    """
+    Write the statistics of an export next to it as JSON. The scale records the
+    data values quantized to 0 and to the highest level, and the histogram of the
+    non-zero values spans it, ready to be drawn under a transfer function editor.
+
+    :param path: filepath of the export
+    :param stats: statistics of the exported data
+    :param value_range: data values at the ends of the scale of the export
+    :param metadata: additional top level entries, such as the variable
+    :returns: filepath of the sidecar
+    """
+    sidecar_path = get_sidecar_path(path)
+    scale = {"min": float(value_range[0]), "max": float(value_range[1])}
+    content = {**metadata, "scale": scale, **stats.get_summary(value_range)}
+    with open(sidecar_path, "w") as fh:
+        json.dump(content, fh, indent=2)
+    return sidecar_path
@@ -0,0 +1,165 @@
+"""Tiled image pyramids of radiance in the XYZ (z/x/y) layout of web maps, so
+that a viewer can stream only the tiles in view at the zoom level it needs."""
+
+import concurrent.futures
+import json
+import math
+import pathlib
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from PIL import Image
+
+from . import profiling
+from .options import TILE_SIZE
+
+
+def get_tile_dir(path: pathlib.Path) -> pathlib.Path:
+    """directory holding the tiles of the pyramid for an output filepath"""
+    return path.with_name(f"{path.stem}_tiles")
+
+
+def get_metadata_path(path: pathlib.Path) -> pathlib.Path:
+    """filepath of the pyramid metadata for an output filepath"""
+    return path.with_name(f"{path.stem}.tiles.json")
+
+
+def get_max_zoom(shape: tuple[int, ...], tile_size: int = TILE_SIZE) -> int:
+    """zoom level at which the image is at full resolution, zoom 0 is one tile"""
+    return max(math.ceil(math.log2(max(shape[:2]) / tile_size)), 0)
+
+
+def downsample_levels(levels: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    """
+    Halve the resolution of a quantized image by averaging each 2x2 block of
+    pixels, rounded to the nearest level. An odd row or column is repeated rather
+    than padded with zeros, so that the edge of the image does not darken.
+
+    :param levels: 2-dimensional array of quantized values
+    :returns: image of half the size, rounded up
+    """
+    pad = [(0, n % 2) for n in levels.shape]
+    if any(after for _, after in pad):
+        levels = np.pad(levels, pad, mode="edge")
+    rows, cols = levels.shape[0] // 2, levels.shape[1] // 2
+    blocks = levels.reshape(rows, 2, cols, 2)
+    pooled = blocks.sum(axis=(1, 3), dtype=np.uint16)
+    return ((pooled + 2) // 4).astype(np.uint8)
+
+
+def colormap_tile(
+    levels: npt.NDArray[np.uint8],
+    lut: npt.NDArray[np.uint8],
+    tile_size: int = TILE_SIZE,
+) -> npt.NDArray[np.uint8]:
+    """
+    Colormap the quantized pixels of one tile. Tiles at the right and bottom edges
+    of the image are padded to the full tile size with transparent pixels, so that
+    every tile has the same size.
+
+    :param levels: quantized pixels of the tile, at most tile_size on a side
+    :param lut: 256-by-3 array of colors, from radiance.get_colormap_lut
+    :param tile_size: edge length of a tile in pixels
+    :returns: RGB tile, or RGBA if it was padded
+    """
+    rgb = lut[levels]
+    if levels.shape == (tile_size, tile_size):
+        return rgb
+    rgba = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+    rgba[: levels.shape[0], : levels.shape[1], :3] = rgb
+    rgba[: levels.shape[0], : levels.shape[1], 3] = 255
+    return rgba
+
+
+def write_tile_pyramid(
+    path: pathlib.Path,
+    levels: npt.NDArray[np.uint8],
+    lut: npt.NDArray[np.uint8],
+    tile_format: str = "png",
+    threads: int | None = None,
+    **metadata: Any,
+) -> pathlib.Path:
+    """
+    Write a quantized image as a pyramid of tiles, in {z}/{x}/{y} files where x is
+    the column and y the row of a tile counted from the top left. The image is at
+    full resolution at the highest zoom level, and each lower level halves it
+    until the whole image fits in a single tile. Tiles are colormapped and encoded
+    by a pool of threads. A JSON file describing the pyramid is written next to
+    the tile directory.
+
+    :param path: output filepath, the pyramid is named after its stem
+    :param levels: (rows, columns) array of quantized pixels, the same orientation
+    as the full size image
+    :param lut: 256-by-3 array of colors, from radiance.get_colormap_lut
+    :param tile_format: "png" or "webp"
+    :param threads: number of threads, defaults to the number of CPUs
+    :param metadata: additional top level entries, such as the value range
+    :returns: filepath of the metadata
+    """
+    tile_dir = get_tile_dir(path)
+    max_zoom = get_max_zoom(levels.shape)
+    height, width = levels.shape
+
+    def save_tile(
+        zoom: int, x: int, y: int, tile: npt.NDArray[np.uint8]
+    ) -> pathlib.Path:
+        tile_path = tile_dir / str(zoom) / str(x) / f"{y}.{tile_format}"
+        tile_path.parent.mkdir(parents=True, exist_ok=True)
+        with profiling.stage("encode tile") as counts:
+            rgb = colormap_tile(tile, lut)
+            if tile_format == "webp":
+                Image.fromarray(rgb).save(tile_path, lossless=True)
+            else:
+                Image.fromarray(rgb).save(tile_path)
+            counts.bytes_written = profiling.get_file_bytes(tile_path)
+            counts.items = tile.size
+        return tile_path
+
+    zooms: list[dict[str, Any]] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = []
+        for zoom in range(max_zoom, -1, -1):
+            if zoom < max_zoom:
+                with profiling.stage("downsample tiles") as counts:
+                    levels = downsample_levels(levels)
+                    counts.items = levels.size
+            rows = math.ceil(levels.shape[0] / TILE_SIZE)
+            cols = math.ceil(levels.shape[1] / TILE_SIZE)
+            zooms.append(
+                {
+                    "zoom": zoom,
+                    "width": levels.shape[1],
+                    "height": levels.shape[0],
+                    "columns": cols,
+                    "rows": rows,
+                }
+            )
+            for x in range(cols):
+                for y in range(rows):
+                    tile = levels[
+                        y * TILE_SIZE : (y + 1) * TILE_SIZE,
+                        x * TILE_SIZE : (x + 1) * TILE_SIZE,
+                    ]
+                    futures.append(pool.submit(save_tile, zoom, x, y, tile))
+        tile_count = len([f.result() for f in futures])
+
+    metadata_path = get_metadata_path(path)
+    with open(metadata_path, "w") as fh:
+        json.dump(
+            {
+                **metadata,
+                "tiles": f"{tile_dir.name}/{{z}}/{{x}}/{{y}}.{tile_format}",
+                "format": tile_format,
+                "tile size": TILE_SIZE,
+                "width": width,
+                "height": height,
+                "min zoom": 0,
+                "max zoom": max_zoom,
+                "tile count": tile_count,
+                "levels": sorted(zooms, key=lambda z: z["zoom"]),
+            },
+            fh,
+            indent=2,
+        )
+    return metadata_path
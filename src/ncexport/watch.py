@@ -0,0 +1,366 @@
+"""Incremental conversion of netCDF files as they appear in directories, such as
+the snapshots an LES run writes for hours. Files are converted once they are
+complete and again whenever they change, and outputs are renamed into place so
+that a server never reads a partially written file."""
+
+import collections
+import concurrent.futures
+import ctypes
+import os
+import pathlib
+import select
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+from types import TracebackType
+from typing import Any, Final, NamedTuple
+
+from . import batch
+from .options import POLL_SECONDS, SETTLE_SECONDS
+
+TEMP_PREFIX: Final = ".ncexport-"
+"""Prefix of the hidden directories outputs are written to before being published."""
+
+IN_CLOSE_WRITE: Final = 0x00000008
+"""inotify event of a file opened for writing being closed."""
+
+IN_MOVED_TO: Final = 0x00000080
+"""inotify event of a file being renamed into a watched directory."""
+
+INOTIFY_EVENT: Final = struct.Struct("iIII")
+"""Header of an inotify event: watch descriptor, mask, cookie and name length."""
+
+
+class FileState(NamedTuple):
+    """Size and modification time of an input, and when they were first seen."""
+
+    size: int
+    mtime: float
+    since: float
+    """time.monotonic() of the scan that first saw this size and time"""
+
+
+class PollWaker:
+    """Sleeps between scans of the watched directories, the portable fallback."""
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+
+    def wait(self, timeout: float) -> set[pathlib.Path]:
+        """waits until the timeout or a call to wake, returns no closed files"""
+        self.event.wait(timeout)
+        self.event.clear()
+        return set()
+
+    def wake(self) -> None:
+        """ends the current wait early, e.g. when a conversion completes"""
+        self.event.set()
+
+    def close(self) -> None:
+        """releases the resources of the waker"""
+
+    def __enter__(self) -> "PollWaker":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+class InotifyWaker(PollWaker):
+    """
+    Wakes the watch loop as soon as a file is closed after writing in, or renamed
+    into, a watched directory, using Linux inotify through the C library. Scans
+    still happen every poll interval, for files that are written without being
+    closed and for events missed while the queue overflowed.
+    """
+
+    def __init__(self, directories: list[pathlib.Path]) -> None:
+        super().__init__()
+        libc = ctypes.CDLL(None, use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify is not available")
+        self.directories: dict[int, pathlib.Path] = {}
+        for directory in directories:
+            wd = add_watch(
+                self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"cannot watch {directory}")
+            self.directories[wd] = directory
+        # Written to by wake, so that select returns without an inotify event
+        self.wake_read, self.wake_write = os.pipe()
+
+    def wait(self, timeout: float) -> set[pathlib.Path]:
+        """waits until the timeout, a call to wake or files being closed, and
+        returns the files that were closed or moved in"""
+        readable, _, _ = select.select([self.fd, self.wake_read], [], [], timeout)
+        if self.wake_read in readable:
+            os.read(self.wake_read, 4096)
+        if self.fd not in readable:
+            return set()
+        closed: set[pathlib.Path] = set()
+        try:
+            while data := os.read(self.fd, 64 * 1024):
+                offset = 0
+                while offset < len(data):
+                    wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset : offset + length].rstrip(b"\0")
+                    offset += length
+                    if wd in self.directories and name:
+                        closed.add(self.directories[wd] / os.fsdecode(name))
+        except BlockingIOError:
+            pass
+        return closed
+
+    def wake(self) -> None:
+        os.write(self.wake_write, b"\0")
+
+    def close(self) -> None:
+        for fd in (self.fd, self.wake_read, self.wake_write):
+            os.close(fd)
+
+
+def get_waker(directories: list[pathlib.Path]) -> PollWaker:
+    """inotify on Linux if the C library provides it, polling otherwise"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWaker(directories)
+        except (OSError, AttributeError) as err:
+            print(f"inotify unavailable, polling instead: {err}")
+    return PollWaker()
+
+
+def update_states(
+    states: dict[pathlib.Path, FileState],
+    directories: list[pathlib.Path],
+    closed: set[pathlib.Path],
+    settle_seconds: float,
+) -> list[pathlib.Path]:
+    """
+    Scan the watched directories and find the inputs that are complete: those
+    whose size and modification time have not changed for settle_seconds, or
+    that were closed after writing since the last scan and have not changed
+    since then.
+
+    :param states: state of each input at earlier scans, updated in place
+    :param directories: directories to scan for .nc files
+    :param closed: files reported closed or moved in by inotify
+    :param settle_seconds: time without changes after which a file is complete
+    :returns: inputs that are complete, in sorted order
+    """
+    now = time.monotonic()
+    inpaths = batch.find_inputs(str(directory) for directory in directories)
+    complete: list[pathlib.Path] = []
+    for inpath in inpaths:
+        try:
+            stat = inpath.stat()
+        except FileNotFoundError:
+            continue
+        state = states.get(inpath)
+        if state is None or (state.size, state.mtime) != (stat.st_size, stat.st_mtime):
+            # A file closed after writing is complete without waiting
+            since = now - settle_seconds if inpath in closed else now
+            state = states[inpath] = FileState(stat.st_size, stat.st_mtime, since)
+        elif inpath in closed:
+            state = states[inpath] = state._replace(since=now - settle_seconds)
+        if now - state.since >= settle_seconds:
+            complete.append(inpath)
+    for inpath in set(states).difference(inpaths):
+        del states[inpath]
+    return complete
+
+
+def ignore_interrupt() -> None:
+    """initializes a worker process to ignore Ctrl-C while it is idle, so that it
+    exits quietly when the pool shuts down, see run_published"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_published(job: batch.Job) -> str:
+    """
+    Run a job in a worker process, writing its outputs to a hidden temporary
+    directory next to them, then renaming them into place. Renaming is atomic
+    within a filesystem, so readers see either the previous output or the new
+    one. The main output is renamed last, after the files it refers to, such as
+    the .bin of a .gltf.
+
+    :param job: the conversion to perform
+    :returns: sha256 digest of the input file
+    """
+    outdir = job.outpath.parent
+    tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=outdir))
+    # Ctrl-C stops the conversion, and the job is reported as unfinished
+    handler = signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        digest = batch.run_job(job._replace(outpath=tmp_dir / job.outpath.name))
+        outputs = sorted(tmp_dir.iterdir(), key=lambda p: p.name == job.outpath.name)
+        for path in outputs:
+            os.replace(path, outdir / path.name)
+    finally:
+        signal.signal(signal.SIGINT, handler)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return digest
+
+
+def record_result(
+    future: "concurrent.futures.Future[str]",
+    job: batch.Job,
+    stat: os.stat_result,
+    manifest: dict[str, dict[str, Any]],
+    version: str,
+) -> bool:
+    """adds a completed conversion to the manifest, returns whether it succeeded"""
+    try:
+        digest = future.result()
+    except KeyboardInterrupt:
+        # Raised in the worker process when Ctrl-C interrupts it with this one
+        print(f"STOPPED {job.inpath.name} -> {job.kind}: unfinished")
+        return False
+    except Exception as err:
+        print(f"FAILED {job.inpath.name} -> {job.kind}: {err!r}")
+        return False
+    manifest[job.key] = batch.get_manifest_entry(job, digest, version, stat)
+    print(f"done   {job.inpath.name} -> {job.outpath.name}")
+    return True
+
+
+def watch_directories(
+    directories: list[pathlib.Path],
+    kinds: list[str],
+    outdir: pathlib.Path | None = None,
+    variable: str = "QC",
+    rad_variable: str = "rad",
+    quantization_bits: int = 8,
+    workers: int | None = None,
+    manifest_path: pathlib.Path | None = None,
+    force: bool = False,
+    settle_seconds: float = SETTLE_SECONDS,
+    poll_seconds: float = POLL_SECONDS,
+    stop: threading.Event | None = None,
+) -> tuple[int, int]:
+    """
+    Convert the netCDF files in directories as they are completed, until
+    interrupted. Files already there are converted first, unless the manifest
+    shows them up to date, and a file that changes is converted again once it is
+    complete. Conversions run in a pool of worker processes, and complete files
+    wait in a queue for a free worker, so at most one conversion per worker is in
+    progress. A conversion that fails is retried once its input changes.
+
+    :param directories: directories to watch, not recursively
+    :param kinds: kinds of output to create, keys of batch.OUTPUT_EXTENSIONS
+    :param outdir: directory for the outputs, defaults to the directory of each input
+    :param variable: variable exported to glb, gltf and nrrd outputs
+    :param rad_variable: variable exported to png outputs
+    :param quantization_bits: 8 or 16 to quantize nrrd outputs, otherwise float
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param manifest_path: manifest location, defaults to batch.MANIFEST_NAME in
+    outdir, or in the first directory
+    :param force: convert files already there even if the manifest shows them up
+    to date
+    :param settle_seconds: time without changes after which a file is complete
+    :param poll_seconds: time between scans of the directories
+    :param stop: optionally stops watching once set, e.g. from another thread
+    :returns: number of conversions performed, and failed or left unfinished
+    """
+    directories = [directory.resolve() for directory in directories]
+    if manifest_path is None:
+        manifest_path = (outdir or directories[0]) / batch.MANIFEST_NAME
+    manifest = batch.load_manifest(manifest_path)
+    version = batch.get_tool_version()
+    workers = workers or os.cpu_count() or 1
+
+    states: dict[pathlib.Path, FileState] = {}
+    # Size and modification time of the input last converted by each job, or
+    # that failed to convert, so that it is not converted again until it changes
+    handled: dict[str, tuple[int, float]] = {}
+    queue: collections.deque[tuple[batch.Job, os.stat_result]] = collections.deque()
+    running: dict[
+        "concurrent.futures.Future[str]", tuple[batch.Job, os.stat_result]
+    ] = {}
+    converted = failed = 0
+    with (
+        concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=ignore_interrupt
+        ) as pool,
+        get_waker(directories) as waker,
+    ):
+        closed: set[pathlib.Path] = set()
+        try:
+            while stop is None or not stop.is_set():
+                for future in [future for future in running if future.done()]:
+                    job, stat = running.pop(future)
+                    handled[job.key] = (stat.st_size, stat.st_mtime)
+                    if record_result(future, job, stat, manifest, version):
+                        # Saved after every conversion, like a batch
+                        batch.save_manifest(manifest_path, manifest)
+                        converted += 1
+                    else:
+                        failed += 1
+
+                busy = {job.key for job, _ in (*queue, *running.values())}
+                for inpath in update_states(
+                    states, directories, closed, settle_seconds
+                ):
+                    try:
+                        stat = inpath.stat()
+                    except FileNotFoundError:
+                        continue
+                    for kind in kinds:
+                        job = batch.get_job(
+                            inpath,
+                            kind,
+                            outdir,
+                            variable,
+                            rad_variable,
+                            quantization_bits,
+                        )
+                        if job.key in busy:
+                            continue
+                        if handled.get(job.key) == (stat.st_size, stat.st_mtime):
+                            continue
+                        if not force or job.key in handled:
+                            entry = manifest.get(job.key)
+                            if batch.is_up_to_date(job, entry, version, {}):
+                                handled[job.key] = (stat.st_size, stat.st_mtime)
+                                continue
+                        print(f"queued {inpath.name} -> {job.outpath.name}")
+                        queue.append((job, stat))
+
+                while queue and len(running) < workers:
+                    job, stat = queue.popleft()
+                    future = pool.submit(run_published, job)
+                    future.add_done_callback(lambda _: waker.wake())
+                    running[future] = (job, stat)
+                closed = waker.wait(poll_seconds)
+        except KeyboardInterrupt:
+            # The worker processes are interrupted as well
+            print("\nStopping")
+        finally:
+            # Conversions that completed are kept even if stopping is interrupted
+            try:
+                pool.shutdown(cancel_futures=True)
+                for future, (job, stat) in running.items():
+                    if future.cancelled():
+                        continue
+                    if record_result(future, job, stat, manifest, version):
+                        converted += 1
+                    else:
+                        failed += 1
+            finally:
+                batch.save_manifest(manifest_path, manifest)
+    return converted, failed
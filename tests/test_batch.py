@@ -0,0 +1,72 @@
+"""Skipping of unchanged inputs with the batch manifest."""
+
+import os
+import pathlib
+
+import pytest
+
+from ncexport import batch
+
+VERSION = "1.0"
+
+
+@pytest.fixture
+def job(tmp_path: pathlib.Path) -> batch.Job:
+    """a job whose input and output exist"""
+    inpath = tmp_path / "les.nc"
+    inpath.write_bytes(b"netCDF data")
+    job = batch.get_job(inpath, "nrrd", None, "QC", "rad", 8)
+    job.outpath.write_bytes(b"NRRD0004")
+    return job
+
+
+def get_entry(job: batch.Job) -> dict[str, object]:
+    """entry recorded after running the job on the current input"""
+    digest = batch.hash_file(job.inpath)
+    return batch.get_manifest_entry(job, digest, VERSION, job.inpath.stat())
+
+
+def test_unchanged_input_is_skipped(job: batch.Job) -> None:
+    digests: dict[pathlib.Path, str] = {}
+    assert batch.is_up_to_date(job, get_entry(job), VERSION, digests)
+    # Matching size and modification time avoid hashing the input
+    assert digests == {}
+
+
+def test_touched_input_is_skipped(job: batch.Job) -> None:
+    entry = get_entry(job)
+    stat = job.inpath.stat()
+    os.utime(job.inpath, (stat.st_atime, stat.st_mtime + 60))
+    digests: dict[pathlib.Path, str] = {}
+    assert batch.is_up_to_date(job, entry, VERSION, digests)
+    assert digests == {job.inpath: entry["sha256"]}
+    # The new modification time is recorded, so the next run does not hash again
+    assert entry["mtime"] == job.inpath.stat().st_mtime
+
+
+def test_changed_input_is_converted(job: batch.Job) -> None:
+    entry = get_entry(job)
+    stat = job.inpath.stat()
+    job.inpath.write_bytes(b"netCDF DATA")
+    os.utime(job.inpath, (stat.st_atime, stat.st_mtime + 60))
+    assert not batch.is_up_to_date(job, entry, VERSION, {})
+    job.inpath.write_bytes(b"more netCDF data")
+    assert not batch.is_up_to_date(job, entry, VERSION, {})
+
+
+def test_missing_entry_or_output_is_converted(job: batch.Job) -> None:
+    entry = get_entry(job)
+    assert not batch.is_up_to_date(job, None, VERSION, {})
+    assert not batch.is_up_to_date(job, entry, "2.0", {})
+    job.outpath.unlink()
+    assert not batch.is_up_to_date(job, entry, VERSION, {})
+
+
+def test_manifest_round_trip(job: batch.Job, tmp_path: pathlib.Path) -> None:
+    manifest_path = tmp_path / "manifest.json"
+    assert batch.load_manifest(manifest_path) == {}
+    manifest = {job.key: get_entry(job)}
+    batch.save_manifest(manifest_path, manifest)
+    loaded = batch.load_manifest(manifest_path)
+    assert loaded == manifest
+    assert batch.is_up_to_date(job, loaded[job.key], VERSION, {})
@@ -0,0 +1,37 @@
+"""Parsing of timestep and viewing angle selections."""
+
+import pytest
+
+from ncexport import cli
+
+
+@pytest.mark.parametrize(
+    "spec,expected",
+    [
+        ("all", [0, 1, 2, 3, 4, 5, 6]),
+        ("0", [0]),
+        ("6", [6]),
+        ("0:7:3", [0, 3, 6]),
+        (":2", [0, 1]),
+        ("5:", [5, 6]),
+        ("4:100", [4, 5, 6]),
+        ("::-3", [6, 3, 0]),
+    ],
+)
+def test_parse_timesteps(spec: str, expected: list[int]) -> None:
+    assert cli.parse_timesteps(spec, 7) == expected
+
+
+@pytest.mark.parametrize(
+    "spec", ["7", "-1", "3:3", "5:2", "10:", "0:1:2:3", "0:1:0", "one", ""]
+)
+def test_parse_timesteps_rejects(spec: str) -> None:
+    with pytest.raises(ValueError):
+        cli.parse_timesteps(spec, 7)
+
+
+def test_parse_angles() -> None:
+    assert cli.parse_angles("8,0,4", 9) == [0, 4, 8]
+    assert cli.parse_angles("2:5,3,all", 4) == [0, 1, 2, 3]
+    with pytest.raises(ValueError):
+        cli.parse_angles("0,9", 9)
@@ -0,0 +1,238 @@
+"""Parity of the vectorized quantization with the per-voxel loop it replaced,
+bounding boxes, and exports of selections that hold no data."""
+
+import json
+import pathlib
+import struct
+from typing import Any
+
+import nrrd
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from ncexport import bench, bricks, convert, options
+
+BASE_SHAPE = (512, 512, 512)
+
+
+def map_points_nrrd_loop(
+    nz_points: npt.NDArray[np.int_],
+    vardata: npt.NDArray[np.float_],
+    quantization_bits: int,
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """the per-voxel loop of map_points_nrrd before it was vectorized"""
+    min_val: np.float_ = np.min(vardata[:])
+    max_val: np.float_ = np.max(vardata[:])
+    levels: int = (2 ** (quantization_bits)) - 1
+    if quantization_bits == 8:
+        dt = np.uint8
+        quant_fn = convert.quantize
+    elif quantization_bits == 16:
+        dt = np.uint16
+        quant_fn = convert.quantize
+    else:
+        dt = np.float32
+        quant_fn = convert.quantize_float
+    points = np.zeros(BASE_SHAPE, dtype=dt)
+    for pt in nz_points:
+        if (
+            pt[0] > BASE_SHAPE[0] - 1
+            or pt[1] > BASE_SHAPE[1] - 1
+            or pt[2] > BASE_SHAPE[2] - 1
+        ):
+            continue
+        in_x, in_y, in_z = (int(i) for i in pt)
+        # Indexing with a tuple of ints gives a scalar of the type of vardata,
+        # float32 like the netCDF data the loop quantized
+        value: np.float_ = vardata[in_x, in_y, in_z]
+        points[in_x, in_y, in_z] = quant_fn(value, min_val, max_val, levels)
+    return points
+
+
+def get_vardata() -> npt.NDArray[np.float32]:
+    """sparse float32 field extending past the 512 voxel cube, like an LES field"""
+    rng = np.random.default_rng(0)
+    vardata = np.zeros((520, 40, 530), dtype=np.float32)
+    mask = rng.random(vardata.shape) < 0.05
+    vardata[mask] = rng.lognormal(-7, 1.5, np.count_nonzero(mask))
+    # Points at the edges of the range and of the volume
+    vardata[0, 0, 0] = -1e-4
+    vardata[511, 39, 511] = np.max(vardata) * 2
+    vardata[515, 1, 2] = 0.5
+    vardata[3, 2, 525] = 0.25
+    return vardata
+
+
+@pytest.mark.parametrize("bits", [8, 16, 32])
+def test_map_points_nrrd_matches_loop(bits: int) -> None:
+    vardata = get_vardata()
+    nz_points = np.argwhere(vardata)
+    expected = map_points_nrrd_loop(nz_points, vardata, bits)
+    actual = convert.map_points_nrrd(nz_points, vardata, bits)
+    assert actual.dtype == expected.dtype
+    assert actual.shape == expected.shape
+    assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("bits", [8, 16, 32])
+def test_quantize_array_matches_scalar(bits: int) -> None:
+    levels = 2**bits - 1
+    rng = np.random.default_rng(1)
+    minu, maxu = np.float32(1e-5), np.float32(3e-3)
+    values = np.concatenate(
+        [
+            rng.uniform(minu, maxu, 10000).astype(np.float32),
+            np.array([minu, maxu], dtype=np.float32),
+            np.nextafter(np.array([minu, maxu], dtype=np.float32), [0, 1]),
+            np.array([0, -1e-3, 1e-2, 1.0], dtype=np.float32),
+        ]
+    )
+    actual = convert.quantize_array(values, minu, maxu, levels)
+    if bits == 32:
+        # Float output keeps every value, including those outside of the range
+        expected = np.array(
+            [convert.quantize_float(u, minu, maxu, levels) for u in values]
+        )
+        assert actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
+        return
+    # Integer output clamps values outside of the range to its ends
+    clamped = np.clip(values, minu, maxu)
+    expected = np.array([convert.quantize(u, minu, maxu, levels) for u in clamped])
+    assert actual.dtype == expected.dtype
+    assert np.array_equal(actual, expected)
+    assert actual[values == minu].tolist() == [0]
+    assert actual[values == maxu].tolist() == [levels]
+    assert np.all(actual[values < minu] == 0)
+    assert np.all(actual[values > maxu] == levels)
+
+
+@pytest.mark.parametrize(
+    "spec,expected",
+    [
+        ("100:300", ((100, 300), (0, 40), (0, 530))),
+        ("100:300,:,:", ((100, 300), (0, 40), (0, 530))),
+        (":,10:,:20", ((0, 520), (10, 40), (0, 20))),
+        ("500:1000", ((500, 520), (0, 40), (0, 530))),
+        ("15m:45m", ((1, 5), (0, 40), (0, 530))),
+        ("100m:11,0m:1m,5:6", ((10, 11), (0, 1), (5, 6))),
+    ],
+)
+def test_parse_bbox(spec: str, expected: convert.Region) -> None:
+    assert convert.parse_bbox(spec, (520, 40, 530), 10.0) == expected
+
+
+def test_parse_bbox_default_spacing() -> None:
+    spacing = options.GRID_SPACING
+    region = convert.parse_bbox(f"{spacing}m:{3 * spacing}m", (520, 40, 530))
+    assert region[0] == (1, 3)
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        "1:2,1:2,1:2,1:2",
+        "5",
+        "1:2:3",
+        ",",
+        "-1:5",
+        "5:5",
+        "6:5",
+        "600:",
+        "a:b",
+        "50:1m",
+    ],
+)
+def test_parse_bbox_rejects(spec: str) -> None:
+    with pytest.raises(ValueError):
+        convert.parse_bbox(spec, (520, 40, 530), 10.0)
+
+
+def test_get_bounding_box() -> None:
+    points = np.array([[3, 8, 2], [5, 1, 9], [4, 4, 4]], dtype=np.int16)
+    assert convert.get_bounding_box(points) == ((3, 1, 2), (3, 8, 8))
+    empty = np.empty((0, 3), dtype=np.int16)
+    assert convert.get_bounding_box(empty) == ((0, 0, 0), (1, 1, 1))
+    assert convert.get_bounding_box(empty, (7, 0, 2)) == ((7, 0, 2), (1, 1, 1))
+    assert convert.get_min_y(points) == 2
+    assert convert.get_min_y(empty) == 0
+
+
+@pytest.fixture(scope="module")
+def les_file(tmp_path_factory: pytest.TempPathFactory) -> pathlib.Path:
+    """synthetic LES file, clouds only fill a layer well above the lowest levels"""
+    nc_file = tmp_path_factory.mktemp("les") / "les.nc"
+    bench.write_synthetic_les(nc_file, (48, 40, 32), sparsity=0.1)
+    return nc_file
+
+
+def get_glb_json(glb: bytes) -> dict[str, Any]:
+    """the JSON chunk of a glb file, which follows the 12 byte header"""
+    assert glb[:4] == b"glTF"
+    length, kind = struct.unpack("<I4s", glb[12:20])
+    assert kind == b"JSON"
+    return json.loads(glb[20 : 20 + length])
+
+
+CLEAR_AIR: convert.Region = ((0, 10), (0, 10), (0, 4))
+
+
+@pytest.mark.parametrize("crop", [False, True])
+def test_nrrd_of_clear_air_is_empty(
+    les_file: pathlib.Path, tmp_path: pathlib.Path, crop: bool
+) -> None:
+    nrrd_file = tmp_path / "clear.nrrd"
+    assert convert.convert_nc_nrrd(les_file, nrrd_file, crop=crop, region=CLEAR_AIR)
+    volume, header = nrrd.read(str(nrrd_file))
+    assert volume.shape == ((1, 1, 1) if crop else (10, 10, 4))
+    assert not volume.any()
+    assert list(header["space origin"]) == [0, 0, 0]
+
+
+def test_bricks_of_clear_air_are_empty(
+    les_file: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    outpath = tmp_path / "clear.nrrd"
+    assert bricks.convert_nc_bricks(les_file, outpath, crop=True, region=CLEAR_AIR)
+    index_file, data_file = bricks.get_brick_paths(outpath)
+    assert index_file.is_file()
+    assert data_file.stat().st_size == 0
+
+
+@pytest.mark.parametrize(
+    "threshold,region", [(1.0, None), (None, CLEAR_AIR), (1.0, CLEAR_AIR)]
+)
+@pytest.mark.parametrize("quantize", [False, True])
+def test_gltf_of_no_points_is_empty(
+    les_file: pathlib.Path,
+    tmp_path: pathlib.Path,
+    threshold: float | None,
+    region: convert.Region | None,
+    quantize: bool,
+) -> None:
+    glb_file = tmp_path / "clear.glb"
+    assert convert.convert_nc_gltf(
+        les_file,
+        glb_file,
+        tmp_path / "clear.bin",
+        lod_levels=1,
+        quantize_positions=quantize,
+        include_values=quantize,
+        chunk_points=100,
+        threshold=threshold,
+        region=region,
+    )
+    for path in (glb_file, tmp_path / "clear_lod1.glb"):
+        model = get_glb_json(path.read_bytes())
+        assert model["scenes"] == [{}]
+        assert not {"meshes", "accessors", "buffers"} & model.keys()
+
+
+def test_empty_models_encode() -> None:
+    empty = np.empty((0, 3), dtype=np.float32)
+    for gltf in (
+        convert.get_gltf_model(empty),
+        convert.get_quantized_gltf_model(empty, values=np.empty(0, np.float32)),
+    ):
+        assert get_glb_json(convert.get_glb_bytes(gltf))["scenes"] == [{}]
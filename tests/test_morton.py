@@ -0,0 +1,55 @@
+"""Morton ordering of point clouds and their chunks."""
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from ncexport import convert, morton
+
+
+def get_points() -> npt.NDArray[np.int_]:
+    """unique points of a clumpy cloud, with one far from the others"""
+    rng = np.random.default_rng(2)
+    points = rng.integers(0, 64, (3000, 3)) + rng.integers(0, 4, (3000, 1)) * 300
+    points = np.vstack([points, [[2**20, 5, 2**19]]])
+    return np.unique(points, axis=0)
+
+
+def test_morton_codes() -> None:
+    points = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 1], [2, 0, 0]])
+    assert morton.morton_codes(points).tolist() == [1, 2, 4, 7, 8]
+    largest = np.array([[2**21 - 1] * 3])
+    assert morton.morton_codes(largest).tolist() == [2**63 - 1]
+
+
+@pytest.mark.parametrize("max_points", [1, 7, 100, 1000, 10**6])
+def test_chunk_bounds(max_points: int) -> None:
+    points = get_points()
+    order, chunks = morton.sort_points(points, max_points)
+    codes = morton.morton_codes(points[order])
+    assert np.all(np.diff(codes.astype(np.float64)) >= 0)
+    # Chunks cover the sorted points in order, without gaps or empty chunks
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(points)
+    assert all(prev[1] == start for prev, (start, _) in zip(chunks, chunks[1:]))
+    assert all(0 < end - start <= max_points for start, end in chunks)
+    if max_points >= len(points):
+        assert chunks == [(0, len(points))]
+
+
+def test_chunk_bounds_of_no_points() -> None:
+    order, chunks = morton.sort_points(np.empty((0, 3), dtype=np.int16), 10)
+    assert len(order) == 0 and chunks == []
+
+
+def test_chunk_accessor_bounds() -> None:
+    points = get_points()
+    order, chunks = morton.sort_points(points, 500)
+    vertices = points[order].astype(np.float32)
+    model = convert.get_gltf_model(vertices, chunks=chunks).model
+    assert model.accessors is not None
+    assert len(model.accessors) == len(chunks)
+    for accessor, (start, end) in zip(model.accessors, chunks):
+        assert accessor.count == end - start
+        assert accessor.byteOffset == start * 12
+        assert accessor.min == vertices[start:end].min(axis=0).tolist()
+        assert accessor.max == vertices[start:end].max(axis=0).tolist()
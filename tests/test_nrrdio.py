@@ -0,0 +1,53 @@
+"""Block parallel gzip and the NRRD files written with it."""
+
+import gzip
+import pathlib
+
+import nrrd
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from ncexport import nrrdio
+
+
+def get_volume(
+    dtype: type[np.uint8 | np.uint16 | np.float32],
+) -> npt.NDArray[np.uint8 | np.uint16 | np.float32]:
+    """sparse volume with runs of zeros and noise, in Fortran order like exports"""
+    rng = np.random.default_rng(0)
+    volume = np.zeros((70, 50, 90), dtype=dtype, order="F")
+    mask = rng.random(volume.shape) < 0.2
+    volume[mask] = rng.integers(1, 200, np.count_nonzero(mask))
+    return volume
+
+
+@pytest.mark.parametrize("size", [0, 1, 1000, 3 * 4096 + 17])
+@pytest.mark.parametrize("block_bytes", [4096, nrrdio.GZIP_BLOCK_BYTES])
+def test_gzip_parallel_decompresses(size: int, block_bytes: int) -> None:
+    rng = np.random.default_rng(size)
+    # Repeated text compresses across block boundaries, noise does not compress
+    data = (b"cloud water " * size)[:size] + rng.bytes(size // 2)
+    pieces = nrrdio.gzip_parallel(memoryview(data), 6, 3, block_bytes)
+    assert gzip.decompress(b"".join(pieces)) == data
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.float32])
+def test_pgzip_nrrd_round_trip(
+    tmp_path: pathlib.Path, dtype: type[np.uint8 | np.uint16 | np.float32]
+) -> None:
+    volume = get_volume(dtype)
+    fields = {"space origin": np.array([1.0, 2.0, 3.0]), "original sizes": [7, 8, 9]}
+    encoding = nrrdio.NrrdEncoding("pgzip", 5, 2)
+    nrrd_file = tmp_path / "volume.nrrd"
+    nrrdio.write_nrrd(nrrd_file, volume, fields, encoding)
+    data, header = nrrd.read(str(nrrd_file), nrrdio.NRRD_CUSTOM_FIELDS)
+    assert header["encoding"] == "gzip"
+    assert data.dtype == volume.dtype
+    assert np.array_equal(data, volume)
+    assert list(header["space origin"]) == [1.0, 2.0, 3.0]
+    assert list(header["original sizes"]) == [7, 8, 9]
+
+    encoded_file = tmp_path / "encoded.nrrd"
+    encoded_file.write_bytes(nrrdio.encode_nrrd(volume, fields, encoding))
+    assert np.array_equal(nrrd.read(str(encoded_file))[0], volume)
@@ -0,0 +1,80 @@
+"""Order, errors and early stopping of pipelined execution."""
+
+import random
+import time
+from collections.abc import Generator
+from typing import Iterator
+
+import pytest
+
+from ncexport.pipeline import Pipeline, get_stage_sizes, run_pipeline
+
+
+def jitter(value: int) -> int:
+    """sleeps for a random moment, so that stages finish items out of step"""
+    time.sleep(random.random() * 0.002)
+    return value
+
+
+@pytest.mark.parametrize("stages", [1, 2, 3, 4, 8])
+@pytest.mark.parametrize("queue_depth", [1, 4])
+def test_output_order(stages: int, queue_depth: int) -> None:
+    steps = [jitter, lambda x: x * 3, jitter, lambda x: x + 1]
+    output = run_pipeline(range(100), steps, Pipeline(stages, queue_depth))
+    assert list(output) == [x * 3 + 1 for x in range(100)]
+
+
+def test_stage_sizes() -> None:
+    assert get_stage_sizes(5, 3) == [2, 2, 1]
+    assert get_stage_sizes(2, 8) == [1, 1]
+    assert get_stage_sizes(3, 0) == [3]
+
+
+class StepError(Exception):
+    pass
+
+
+def fail_at(value: int) -> int:
+    if value == 5:
+        raise StepError(value)
+    return value
+
+
+def iter_failing() -> Iterator[int]:
+    yield from range(5)
+    raise StepError("source")
+
+
+@pytest.mark.parametrize("stages", [1, 2, 3])
+def test_step_error_is_raised(stages: int) -> None:
+    output = run_pipeline(range(100), [jitter, fail_at, jitter], Pipeline(stages))
+    items: list[int] = []
+    with pytest.raises(StepError):
+        for item in output:
+            items.append(item)
+    # Items before the failing one are produced first
+    assert items == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("stages", [1, 2, 3])
+def test_source_error_is_raised(stages: int) -> None:
+    with pytest.raises(StepError, match="source"):
+        list(run_pipeline(iter_failing(), [jitter, jitter], Pipeline(stages)))
+
+
+@pytest.mark.parametrize("stages", [1, 3])
+def test_early_stop_closes_source(stages: int) -> None:
+    closed: list[bool] = []
+
+    def iter_source() -> Iterator[int]:
+        try:
+            yield from range(1000)
+        finally:
+            closed.append(True)
+
+    output = run_pipeline(iter_source(), [jitter], Pipeline(stages, 2))
+    assert isinstance(output, Generator)
+    assert next(output) == 0
+    output.close()
+    # The source is closed once the pipeline has stopped and joined its threads
+    assert closed == [True]
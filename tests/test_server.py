@@ -0,0 +1,75 @@
+"""Exports served over HTTP, including selections that hold no data."""
+
+import http.server
+import json
+import pathlib
+import socketserver
+import threading
+import urllib.error
+import urllib.request
+from typing import Iterator
+
+import pytest
+
+from ncexport import bench, server
+
+
+@pytest.fixture(scope="module")
+def base_url(tmp_path_factory: pytest.TempPathFactory) -> Iterator[str]:
+    """URL of a server on a free port, serving a synthetic LES file"""
+    root = tmp_path_factory.mktemp("served")
+    bench.write_synthetic_les(root / "les.nc", (48, 40, 32), sparsity=0.1)
+    listening: list[socketserver.BaseServer] = []
+    ready = threading.Event()
+
+    def on_ready(httpd: socketserver.BaseServer) -> None:
+        listening.append(httpd)
+        ready.set()
+
+    service = server.ExportService(pathlib.Path(root))
+    thread = threading.Thread(
+        target=server.serve, args=(service, "127.0.0.1", 0), kwargs={"ready": on_ready}
+    )
+    thread.start()
+    assert ready.wait(10)
+    httpd = listening[0]
+    assert isinstance(httpd, http.server.ThreadingHTTPServer)
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    thread.join()
+
+
+def get(base_url: str, path: str) -> tuple[int, bytes]:
+    """status and body of a GET request"""
+    try:
+        with urllib.request.urlopen(base_url + path) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as err:
+        return err.code, err.read()
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "threshold=5",
+        "bbox=0:10,0:10,0:4",
+        "bbox=0:10,0:10,0:4&quantize=1&values=1&chunk_points=10",
+    ],
+)
+def test_glb_of_no_points(base_url: str, query: str) -> None:
+    status, body = get(base_url, f"/glb?file=les.nc&{query}")
+    assert status == 200
+    assert body.startswith(b"glTF")
+
+
+@pytest.mark.parametrize("crop", [0, 1])
+def test_nrrd_of_clear_air(base_url: str, crop: int) -> None:
+    status, body = get(base_url, f"/nrrd?file=les.nc&bbox=0:10,0:10,0:4&crop={crop}")
+    assert status == 200
+    assert body.startswith(b"NRRD")
+
+
+def test_invalid_bbox(base_url: str) -> None:
+    status, body = get(base_url, "/glb?file=les.nc&bbox=5:5")
+    assert status == 400
+    assert "empty" in json.loads(body)["error"]
@@ -0,0 +1,86 @@
+"""Percentiles and running statistics estimated by StreamingStats."""
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from ncexport import stats
+
+
+def get_data() -> npt.NDArray[np.float32]:
+    """sparse field spanning several orders of magnitude, with a few negatives"""
+    rng = np.random.default_rng(3)
+    data = np.zeros(200000, dtype=np.float32)
+    mask = rng.random(data.size) < 0.3
+    count = np.count_nonzero(mask)
+    signs = np.where(rng.random(count) < 0.1, -1, 1)
+    data[mask] = (rng.lognormal(-6, 2, count) * signs).astype(np.float32)
+    return data
+
+
+def get_stats(data: npt.NDArray[np.float32], chunks: int = 7) -> stats.StreamingStats:
+    value_stats = stats.StreamingStats()
+    for chunk in np.array_split(data, chunks):
+        value_stats.update(chunk)
+    return value_stats
+
+
+@pytest.mark.parametrize("percentile", [0, 0.1, 1, 5, 25, 50, 75, 95, 99, 99.9, 100])
+def test_percentile_matches_numpy(percentile: float) -> None:
+    data = get_data()
+    nonzero = data[data != 0]
+    # The estimate is that of the value at the rank the percentile falls on
+    expected = np.percentile(nonzero, percentile, method="lower")
+    estimate = get_stats(data).get_percentile(percentile)
+    assert abs(estimate - expected) <= stats.RELATIVE_ACCURACY * abs(expected)
+
+
+def test_running_totals() -> None:
+    data = get_data()
+    value_stats = get_stats(data)
+    assert value_stats.count == data.size
+    assert value_stats.nonzero == np.count_nonzero(data)
+    assert value_stats.min_val == np.min(data)
+    assert value_stats.max_val == np.max(data)
+    assert value_stats.mean == pytest.approx(np.mean(data, dtype=np.float64))
+
+
+def test_add_and_merge_match_update() -> None:
+    data = get_data()
+    expected = get_stats(data)
+    # Chunks given by their non-zero values only, as extracted from hyperslabs
+    halves = []
+    for half in np.array_split(data, 2):
+        half_stats = stats.StreamingStats()
+        half_stats.add(half[half != 0], half.size, float(half.min()), float(half.max()))
+        halves.append(half_stats)
+    halves[0].merge(halves[1])
+    for percentile in (1, 50, 99):
+        assert halves[0].get_percentile(percentile) == expected.get_percentile(
+            percentile
+        )
+    assert halves[0].count == expected.count
+    assert halves[0].nonzero == expected.nonzero
+
+
+def test_clipped_range() -> None:
+    data = get_data()
+    value_stats = get_stats(data)
+    # The data holds zeros, so the range keeps its minimum
+    low, high = value_stats.get_clipped_range(1)
+    assert low == np.min(data)
+    assert high == pytest.approx(value_stats.get_percentile(99))
+    high = value_stats.get_clipped_range(0)[1]
+    assert high == pytest.approx(np.max(data), rel=stats.RELATIVE_ACCURACY)
+    with pytest.raises(ValueError):
+        value_stats.get_clipped_range(50)
+
+
+def test_no_nonzero_values() -> None:
+    value_stats = stats.StreamingStats()
+    with pytest.raises(ValueError):
+        value_stats.get_clipped_range(1)
+    value_stats.update(np.zeros(10, dtype=np.float32))
+    assert value_stats.get_clipped_range(1) == (0.0, 0.0)
+    with pytest.raises(ValueError):
+        value_stats.get_percentile(50)
@@ -2,18 +2,25 @@
 
 from typing import Any, Union
 
+__version__: str
+
 class Dataset:
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
     def createDimension(self, dimname: str, size: Union[None, int]) -> None: ...
     def createVariable(self, varname: str, datatype: str, dimensions: tuple) -> Any: ...
     def __getitem__(self, key: str) -> Any: ...
+    def __enter__(self) -> Dataset: ...
+    def __exit__(self, *args: Any) -> None: ...
+    def close(self) -> None: ...
     variables: dict[str, Variable]
     dimensions: dict[str, Union[int, None]]
 
 class Variable:
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
     def __getitem__(
-        self, key: Union[int, slice, tuple[Union[int, slice], ...]]
+        self, key: Union[int, slice, tuple[Union[int, slice, list[int]], ...]]
     ) -> Any: ...
+    def chunking(self) -> Union[str, list[int]]: ...
     shape: tuple[int, ...]
     dimensions: tuple[str, ...]
+    dtype: Any